@@ -0,0 +1,61 @@
+"""
+INTRADAY FORECAST POLLER FOR MILWAUKEE WEATHER DATA
+
+This code performs the following tasks:
+  1.  Loads the historical and YTD rows of the combined data set once and
+      keeps them rendered as CSV text
+  2.  Pulls the forecast from the open-meteo API on a schedule
+  3.  Compares a hash of the forecast values with the last poll, and stops
+      there when the model run has not changed
+  4.  Otherwise saves the new prediction data to the store, calculates the
+      rolling features of the forecast days, updates this year's planting
+      threshold dates, and rewrites the combined CSV
+  5.  Loads the settled rows again whenever the pipeline rewrites them
+
+Start it after a pipeline run (Weather Data Combiner.py) and leave it
+running; stop it with Ctrl+C. It prints one line per poll.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import asyncio
+
+from sewi_weather.cache import CachedClient, WeatherCache, api_client
+from sewi_weather.locations import load_locations
+from sewi_weather.poller import ForecastPoller
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+filepath = ''
+
+# Seconds between polls. The forecast models behind the API update about hourly.
+interval = 900
+
+# Number of polls before stopping; None keeps polling until stopped
+polls = None
+
+# First year of history in the combined data, as in the combiner
+first_year = 1940
+
+# Sites per API request. All sites are read from locations.csv.
+batch_size = 50
+
+################################################################################
+# POLL FORECAST
+################################################################################
+
+# Forecast days expire at once, so every poll fetches the latest model run and
+# stores it in the shared cache for the next pipeline run to reuse
+openmeteo = CachedClient(api_client(), WeatherCache(filepath + '.weather_cache.sqlite', ttl = {'forecast': 0}))
+
+poller = ForecastPoller(openmeteo, load_locations(filepath), filepath, interval = interval,
+                        batch_size = batch_size, first_year = first_year)
+
+try:
+    asyncio.run(poller.run(polls))
+except KeyboardInterrupt:
+    print("Forecast poller stopped")
@@ -6,22 +6,38 @@ Created on Fri Dec 22 2023
 @author: Michelle.Anderson
 
 This code performs the following tasks:
-  1.  Run year-to-date data gathering py script
-  2.  Run prediction data gathering py script
-  3.  Open historical data CSV file
-  4.  Merge historical, year-to-date, and historical data sets
-  5.  Conform and augment data
-  6.  Calculate 7 and 14 day rolling averages for air and soil temperature
-  7.  Calculate 7 day precipitation totals
-  8.  Save processed data as CSV file
+  1.  Run the historical refresh, year-to-date, and prediction data gathering
+      py scripts concurrently as pipeline stages, skipping any stage whose
+      inputs have not changed since it last ran
+  2.  Load historical, year-to-date, and prediction data from the store
+  3.  Merge historical, year-to-date, and prediction data sets into one row
+      per site and date, preferring historical over year-to-date over
+      prediction rows where they overlap
+  4.  Conform and augment data, keeping labels as categoricals and
+      measurements as float32
+  5.  Calculate 7 and 14 day rolling averages for air and soil temperature
+      for each site, computing only rows that are not saved already
+  6.  Calculate 7 day precipitation totals
+  7.  Save processed data as CSV file and to the store
+  8.  Save a day-of-year climatology of the history as a side table CSV
+  9.  Save the first and last dates each year that soil temperature and
+      frost cross planting thresholds, updating only changed years
+ 10.  Save the daily mean, spread and frost and soil temperature
+      probabilities of several ensemble forecast models as a side table CSV
+ 11.  Save the bias and error of the archived forecasts by lead day,
+      scored against the observed days, as a side table CSV
+ 12.  Check the fetched data sets before they are combined: drop repeated
+      days, fill gaps of up to 3 days, fetch missing archive days again and
+      save a quality mask of every value that was changed
 """
 
 ################################################################################
 # LOAD LIBRARIES
 ################################################################################
 
-import pandas as pd
-import numpy as np
+from sewi_weather import profile
+from sewi_weather.pipeline import format_report, run_stages
+from sewi_weather.stages import pipeline_stages
 
 ################################################################################
 # SET PARAMETERS
@@ -29,80 +45,29 @@ import numpy as np
 
 filepath = ''
 
-################################################################################
-# RUN DATA GATHERER SCRIPTS
-################################################################################
-
-with open(filepath + "YTD Weather Data Gatherer.py") as f:
-    exec(f.read())
-    
-with open(filepath + "Prediction Weather Data Gatherer.py") as f:
-    exec(f.read())
-
-################################################################################
-# READ IN DATA
-################################################################################
-
-hist_df = pd.read_csv(filepath + 'MKE Weather Data Historical.csv')
-
-ytd_df = pd.read_csv(filepath + 'MKE Weather Data YTD.csv')
-
-pred_df = pd.read_csv(filepath + 'MKE Weather Data Prediction.csv')
-
-################################################################################
-# ADD METADATA
-################################################################################
-
-hist_df['Data Source'] = 'Historical'
+# First year of history to load. Older year partitions are never opened.
+first_year = 1940
 
-ytd_df['Data Source'] = 'YTD'
+# Stages that may run at the same time
+max_workers = 3
 
-pred_df['Data Source'] = 'Prediction'
+# Set to True to run every stage even if its inputs are unchanged
+force = False
 
 ################################################################################
-# COMBINE DATA
+# RUN PIPELINE
 ################################################################################
 
-full_df = pd.concat([hist_df, ytd_df, pred_df], ignore_index = True)
+# The stages and the combine step are defined in sewi_weather.stages, and are
+# the same ones 'sewi-weather run' runs. pandas and pyarrow are only loaded by
+# the stages that run, so a run with nothing to do returns at once.
+report = run_stages(pipeline_stages(filepath, first_year), filepath + '.pipeline_state.json',
+                    max_workers = max_workers, force = force)
 
-################################################################################
-# AUGMENT DATA
-################################################################################
-
-WMO = {0	: 'Clear sky', 1 : 'Mainly clear', 2 : 'Partly cloudy', 3	: 'Overcast', 45 : 'Fog' , 48 : 'Depositing rime fog', 
-51 : 'Drizzle: Light', 53 : 'Drizzle: Moderate', 55 : 'Drizzle: Dense intensity', 56 : 'Freezing Drizzle: Light', 
-57 : 'Freezing Drizzle: Dense intensity', 61 : 'Rain: Slight', 63 : 'Rain: Moderate', 65 : 'Rain: Heavy intensity',
-66 : 'Freezing Rain: Light', 67 : 'Freezing Rain: Heavy intensity', 71 : 'Snow fall: Slight', 73 : 'Snow fall: Moderate',
-75 : 'Snow fall: Heavy intensity', 77 : 'Snow grains', 80 : 'Rain showers: Slight', 81 : 'Rain showers: Moderate',
-82 : 'Rain showers: Violent', 85 : 'Snow showers slight', 86 : 'Snow showers heavy', 95 : 'Thunderstorm: Slight or moderate',
-96 : 'Thunderstorm with slight hail', 99 : 'Thunderstorm with heavy hail'}
-
-full_df['weather_code_category'] = full_df['weather_code'].map(WMO)
-
-full_df['temperature_2m_7dayavg'] = full_df['temperature_2m_mean'].rolling(7).mean()
-full_df['temperature_2m_14dayavg'] = full_df['temperature_2m_mean'].rolling(14).mean()
-
-full_df['soil_temperature_0_to_7cm_7dayavg'] = full_df['soil_temperature_0_to_7cm_mean'].rolling(7).mean()
-full_df['soil_temperature_7_to_28cm_7dayavg'] = full_df['soil_temperature_7_to_28cm_mean'].rolling(7).mean()
-full_df['soil_temperature_28_to_100cm_7dayavg'] = full_df['soil_temperature_28_to_100cm_mean'].rolling(7).mean()
-full_df['soil_temperature_100_to_255cm_7dayavg'] = full_df['soil_temperature_100_to_255cm_mean'].rolling(7).mean()
-
-full_df['soil_temperature_0_to_7cm_14dayavg'] = full_df['soil_temperature_0_to_7cm_mean'].rolling(14).mean()
-full_df['soil_temperature_7_to_28cm_14dayavg'] = full_df['soil_temperature_7_to_28cm_mean'].rolling(14).mean()
-full_df['soil_temperature_28_to_100cm_14dayavg'] = full_df['soil_temperature_28_to_100cm_mean'].rolling(14).mean()
-full_df['soil_temperature_100_to_255cm_14dayavg'] = full_df['soil_temperature_100_to_255cm_mean'].rolling(14).mean()
-
-full_df['precipitation_sum_7day'] = full_df['precipitation_sum'].rolling(7).sum()
-full_df['rain_sum_7day'] = full_df['rain_sum'].rolling(7).sum()
-full_df['snow_sum_7day'] = full_df['snowfall_sum'].rolling(7).sum()
-
-full_df['relative_date'] = np.where(full_df['date'] == date.today().strftime('%Y-%m-%d'), "Current date", 
-                           np.where(full_df['date'] > date.today().strftime('%Y-%m-%d'), "Prediction", 
-                           np.where(full_df['date'] < date.today().strftime('%Y-%m-%d'), "Historical", "Unknown")))
-
-################################################################################
-# SAVE DATA AS CSV
-################################################################################
+print(format_report(report))
 
-full_df.to_csv(filepath + 'MKE Weather Data CUMULATIVE.csv', index=False)
+profile.finish(filepath)
 
+failed = [row['stage'] for row in report if row['status'] == 'failed']
+if failed:
+    raise RuntimeError("Pipeline stages failed: " + ', '.join(failed))
@@ -0,0 +1,58 @@
+"""
+LOCAL QUERY API FOR MILWAUKEE WEATHER DATA
+
+This code performs the following tasks:
+  1.  Loads the combined data set saved by the pipeline into memory, indexed
+      by location and date
+  2.  Answers HTTP requests for date ranges, columns and locations of it as
+      CSV or JSON, e.g.
+      http://127.0.0.1:8765/weather?days=30&location=Milwaukee&columns=soil_temperature_0_to_7cm_mean
+  3.  Tags every response with an ETag, so clients that send it back get a
+      304 without a body until the data changes
+  4.  Loads the data again whenever the pipeline or the forecast poller
+      rewrites it
+
+Run it after a pipeline run (Weather Data Combiner.py) and leave it running;
+stop it with Ctrl+C. GET /info lists the locations, columns and dates.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+from sewi_weather.query import WeatherQuery, make_server
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+filepath = ''
+
+# Address to listen on. 127.0.0.1 only answers requests from this computer.
+host = '127.0.0.1'
+
+port = 8765
+
+# Print one line per request
+verbose = False
+
+################################################################################
+# SERVE DATA
+################################################################################
+
+# Until the pipeline has saved the combined data, requests are answered with 503
+query = WeatherQuery(filepath)
+try:
+    info = query.info()
+    print(f"Serving {info['rows']} rows for {len(info['locations'])} locations "
+          f"({info['first_date']} to {info['last_date']}) on http://{host}:{port}/weather")
+except FileNotFoundError as error:
+    print(f"{error}. Serving on http://{host}:{port}/weather, with 503 until it is saved")
+
+server = make_server(query, host, port, verbose = verbose)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    print("Query API stopped")
+finally:
+    server.server_close()
@@ -0,0 +1,108 @@
+"""
+FEATURE BENCHMARKS FOR THE MILWAUKEE WEATHER DATA PIPELINE
+
+This code performs the following tasks:
+  1.  Builds synthetic daily data sets of several sites the size of the
+      1940-to-date history
+  2.  Times the 7 and 14 day window features as 13 groupby rolling passes,
+      as one shared cumulative-sum pass, and for only the newest rows
+      continuing from the saved tail
+  3.  Times the day-of-year climatology as a pandas groupby against a
+      sorted year matrix
+  4.  Times the planting threshold event dates as a pandas groupby per
+      event against run-length detection
+  5.  Prints a summary table for each benchmark
+
+Run from the repository folder:  python "Weather Features Benchmark.py"
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import time
+
+from sewi_weather.climatology import build_climatology
+from sewi_weather.events import EVENTS, find_events
+from sewi_weather.features import WINDOWS, rolling_features
+from sewi_weather.synthetic import synthetic_sites
+from tests.reference import climatology_by_groupby, events_by_groupby, features_by_rolling
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+first_year = 1940
+
+last_year = 2025
+
+repeats = 3
+
+# Sites in every benchmark
+feature_sites = 10
+
+################################################################################
+# RUN BENCHMARKS
+################################################################################
+
+def benchmark_features():
+    full_df = synthetic_sites(feature_sites, first_year, last_year)
+    # The newest 300 days of each site play the part of the YTD and prediction rows
+    recent = full_df.groupby('location', observed = True).cumcount(ascending = False) < 300
+    _, tail = rolling_features(full_df[~recent])
+
+    print(f"Features: {len(WINDOWS)} window features, {feature_sites} sites, {len(full_df)} rows")
+    print(f"{'case':<32}{'seconds':>10}{'rows':>10}")
+    feature_cases = {'groupby rolling, one per column': lambda: features_by_rolling(full_df),
+                     'shared cumulative sums': lambda: rolling_features(full_df)[0],
+                     'newest rows from saved tail': lambda: rolling_features(full_df[recent], tail = tail)[0]}
+    results = {}
+    for case, run in feature_cases.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            results[case] = run()
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"{case:<32}{seconds:>10.4f}{len(results[case]):>10}")
+
+
+def benchmark_climatology():
+    full_df = synthetic_sites(feature_sites, first_year, last_year)
+    columns = ['temperature_2m_mean', 'temperature_2m_max', 'temperature_2m_min', 'precipitation_sum',
+               'soil_temperature_0_to_7cm_mean', 'soil_temperature_7_to_28cm_mean']
+
+    print(f"Climatology: {len(columns)} columns, {feature_sites} sites, {len(full_df)} rows")
+    print(f"{'case':<32}{'seconds':>10}{'rows':>10}")
+    climatology_cases = {'groupby, quantile per percentile': lambda: climatology_by_groupby(full_df, columns),
+                         'year matrix, sorted rows': lambda: build_climatology(full_df, columns)}
+    results = {}
+    for case, run in climatology_cases.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            results[case] = run()
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"{case:<32}{seconds:>10.4f}{len(results[case]):>10}")
+
+
+def benchmark_events():
+    full_df = synthetic_sites(feature_sites, first_year, last_year)
+    full_df = full_df.join(rolling_features(full_df)[0])
+
+    print(f"Events: {len(EVENTS)} events, {feature_sites} sites, {len(full_df)} rows")
+    print(f"{'case':<32}{'seconds':>10}{'rows':>10}")
+    event_cases = {'groupby per event': lambda: events_by_groupby(full_df),
+                   'run-length detection': lambda: find_events(full_df)}
+    results = {}
+    for case, run in event_cases.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            results[case] = run()
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"{case:<32}{seconds:>10.4f}{len(results[case]):>10}")
+
+
+if __name__ == '__main__':
+    benchmark_features()
+    print()
+    benchmark_climatology()
+    print()
+    benchmark_events()
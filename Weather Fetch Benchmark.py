@@ -0,0 +1,238 @@
+"""
+FETCH BENCHMARKS FOR THE MILWAUKEE WEATHER DATA PIPELINE
+
+This code performs the following tasks:
+  1.  Times one archive request against concurrent chunks from a local
+      stand-in for the open-meteo API
+  2.  Times decoding the hourly archive variable by variable against the
+      preallocated block decoder
+  3.  Times the daily soil means on 80 years of hourly data, grouping on
+      Python date objects against integer day numbers, with peak memory,
+      and the daily mean, min, max and growing degree hours as a pandas
+      groupby against the one pass that computes them all
+  4.  Measures peak memory of streaming chunks through the daily reducer
+      against decoding the whole hourly archive first
+  5.  Measures size, write and read time of 80 years of hourly data in the
+      store as Parquet and as memory-mapped Arrow IPC files
+  6.  Times fetching and decoding a year of archive data for several
+      sites against validating the same rows with gaps, duplicates, a
+      truncated site and out-of-range values injected, and validating the
+      whole history
+  7.  Prints a summary table for each benchmark
+
+Run from the repository folder:  python "Weather Fetch Benchmark.py"
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import decode, fetch, observed, store, validate
+from sewi_weather.aggregate import DEGREE_HOUR_BASES, daily_means
+from sewi_weather.locations import batch_params, decode_locations, reduce_locations
+from sewi_weather.synthetic import SyntheticClient, synthetic_sites
+from tests.reference import decode_by_variable, inject_faults, means_by_date_objects, stats_by_groupby
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+first_year = 1940
+
+last_year = 2025
+
+repeats = 3
+
+# Sites of the synthetic history the validation benchmark checks as a whole
+history_sites = 10
+
+# Sites and days of the validation benchmark's archive request
+validate_sites = 10
+
+validate_days = 365
+
+# Simulated transfer time of the stand-in API
+seconds_per_mb = 0.05
+
+archive_params = {
+	"latitude": 42.9675,
+	"longitude": -88.54972222,
+	"start_date": f"{first_year}-01-01",
+	"end_date": f"{last_year}-12-31",
+	"hourly": ["soil_temperature_0_to_7cm", "soil_temperature_7_to_28cm", "soil_temperature_28_to_100cm", "soil_temperature_100_to_255cm", "soil_moisture_0_to_7cm", "soil_moisture_7_to_28cm", "soil_moisture_28_to_100cm", "soil_moisture_100_to_255cm"],
+	"daily": ["weather_code", "temperature_2m_max", "temperature_2m_min", "temperature_2m_mean", "precipitation_sum", "rain_sum", "snowfall_sum"],
+}
+
+################################################################################
+# RUN BENCHMARKS
+################################################################################
+
+def benchmark_fetch():
+    print(f"Fetch: hourly archive {first_year}-{last_year}, {seconds_per_mb} s/MB simulated transfer")
+    print(f"{'case':<32}{'seconds':>10}{'calls':>10}{'MB':>10}")
+    fetch_cases = {'single request': dict(chunk_years = 10000, max_workers = 1),
+                   'decades, 4 workers': dict(chunk_years = 10, max_workers = 4),
+                   'years, 8 workers': dict(chunk_years = 1, max_workers = 8),
+                   'decades, 4 workers, 2 failures': dict(chunk_years = 10, max_workers = 4, fail_first = 2)}
+    for case, options in fetch_cases.items():
+        client = SyntheticClient(fail_first = options.pop('fail_first', 0), seconds_per_mb = seconds_per_mb)
+        start = time.perf_counter()
+        chunk_responses = fetch.fetch_chunked(client, "archive", archive_params, backoff_factor = 0, **options)
+        fetch.stitch(chunk_responses, 'Hourly').Variables(0).ValuesAsNumpy()
+        seconds = time.perf_counter() - start
+        print(f"{case:<32}{seconds:>10.4f}{client.calls:>10}{client.bytes_received / 2**20:>10.1f}")
+
+
+def benchmark_decode():
+    variables = archive_params['hourly']
+    chunk_responses = fetch.fetch_chunked(SyntheticClient(), "archive", archive_params)
+    section = fetch.stitch(chunk_responses, 'Hourly')
+
+    print(f"Decode: hourly archive {first_year}-{last_year}, {len(variables)} variables")
+    print(f"{'case':<32}{'seconds':>10}{'rows':>10}")
+    decode_cases = {'variable by variable': lambda: decode_by_variable(section, variables),
+                    'preallocated block': lambda: decode.decode_frame(section, variables)}
+    for case, run in decode_cases.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            df = run()
+            timings.append(time.perf_counter() - start)
+        print(f"{case:<32}{min(timings):>10.4f}{len(df):>10}")
+
+
+def hourly_frame(years):
+    """Decoded hourly archive of one site for the last years."""
+    variables = archive_params['hourly']
+    chunk_responses = fetch.fetch_chunked(SyntheticClient(), "archive", {**archive_params, 'start_date': f"{last_year - years + 1}-01-01"})
+    hourly_df = decode.decode_frame(fetch.stitch(chunk_responses, 'Hourly'), variables)
+    hourly_df.insert(0, 'location', pd.Categorical(['Oconomowoc'] * len(hourly_df)))
+    return hourly_df
+
+
+def benchmark_aggregate():
+    variables = archive_params['hourly']
+    soiltemp, soilmoist = variables[:4], variables[4:]
+    hourly_df = hourly_frame(80)
+
+    print(f"Aggregate: {len(hourly_df)} hourly rows ({last_year - 79}-{last_year}) to daily means")
+    aggregate_cases = {'date objects, two groupbys': lambda: means_by_date_objects(hourly_df, soiltemp, soilmoist),
+                       'int day numbers, one pass': lambda: daily_means(hourly_df, variables)}
+    stats_cases = {'groupby mean, min, max, sum': lambda: stats_by_groupby(hourly_df, variables, soiltemp, DEGREE_HOUR_BASES),
+                   'one pass, with min, max, dh': lambda: daily_means(hourly_df, variables, extremes = soiltemp,
+                                                                    degree_hours = DEGREE_HOUR_BASES)}
+    for cases in (aggregate_cases, stats_cases):
+        print(f"{'case':<32}{'seconds':>10}{'days':>10}{'peak MB':>10}")
+        for case, run in cases.items():
+            start = time.perf_counter()
+            days = len(run())
+            seconds = time.perf_counter() - start
+            # Memory is traced in a second run since tracemalloc slows everything down
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            print(f"{case:<32}{seconds:>10.4f}{days:>10}{peak:>10.1f}")
+
+
+def benchmark_hourly_store():
+    hourly_df = hourly_frame(80)
+    hourly_df['year'] = hourly_df['date'].dt.year
+    column = archive_params['hourly'][0]
+
+    print(f"Hourly store: {len(hourly_df)} hourly rows, one site, {last_year - 79}-{last_year}")
+    print(f"{'case':<32}{'MB':>10}{'write s':>10}{'read s':>10}{'1 col 1 yr s':>14}")
+    for format in ('parquet', 'ipc'):
+        with tempfile.TemporaryDirectory() as folder:
+            folder += os.sep
+            start = time.perf_counter()
+            store.write(hourly_df, 'Hourly', folder, format = format)
+            written = time.perf_counter() - start
+            size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(folder) for file in files)
+            start = time.perf_counter()
+            store.read('Hourly', folder)
+            read = time.perf_counter() - start
+            start = time.perf_counter()
+            store.read('Hourly', folder, columns = [column], years = [last_year])
+            one = time.perf_counter() - start
+            print(f"{format:<32}{size / 2**20:>10.1f}{written:>10.3f}{read:>10.3f}{one:>14.4f}")
+
+
+def benchmark_stream():
+    variables, daily_variables = archive_params['hourly'], archive_params['daily']
+
+    def whole_archive():
+        chunk_responses = fetch.fetch_chunked(SyntheticClient(), "archive", archive_params, max_workers = 1)
+        sections = [(fetch.stitch(chunk_responses, 'Hourly'), fetch.stitch(chunk_responses, 'Daily'))]
+        hourly_df, daily_df = decode_locations(['site'], sections, variables, daily_variables)
+        return daily_means(hourly_df, variables, utc_offset = chunk_responses[0][0].UtcOffsetSeconds())
+
+    def streamed(chunk_years):
+        chunk_stream = fetch.iter_chunked(SyntheticClient(), "archive", archive_params, chunk_years = chunk_years, max_workers = 1)
+        return reduce_locations(['site'], chunk_stream, variables, daily_variables)[1]
+
+    print(f"Stream: hourly archive {first_year}-{last_year} to daily means, one worker")
+    print(f"{'case':<32}{'seconds':>10}{'days':>10}{'peak MB':>10}")
+    stream_cases = {'decode whole archive': whole_archive,
+                    'stream decades': lambda: streamed(10),
+                    'stream years': lambda: streamed(1)}
+    for case, run in stream_cases.items():
+        start = time.perf_counter()
+        days = len(run())
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        print(f"{case:<32}{seconds:>10.4f}{days:>10}{peak:>10.1f}")
+
+
+def benchmark_validate():
+    locations = pd.DataFrame({'name': [f"Site {i}" for i in range(validate_sites)],
+                              'latitude': 42.5 + 0.1 * np.arange(validate_sites), 'longitude': -88.5})
+    end = pd.Timestamp('2025-01-01') + pd.Timedelta(days = validate_days - 1)
+    params = {**observed.PARAMS, 'start_date': '2025-01-01', 'end_date': str(end.date())}
+    print(f"Validate: {validate_sites} sites x {validate_days} days, {seconds_per_mb} s/MB simulated transfer")
+    print(f"{'case':<32}{'rows':>10}{'seconds':>10}")
+
+    client = SyntheticClient(seconds_per_mb = seconds_per_mb)
+    start = time.perf_counter()
+    responses = client.weather_api(observed.URL, params = batch_params(params, locations))
+    df = observed.daily_rows(locations['name'], responses)
+    fetch_seconds = time.perf_counter() - start
+    print(f"{'fetch and decode':<32}{len(df):>10}{fetch_seconds:>10.4f}")
+
+    faulty_df = inject_faults(df)
+    history_df = synthetic_sites(history_sites, first_year, last_year)
+    validate_cases = {'validate fetched rows': lambda: validate.check(faulty_df, end = end),
+                      f"validate history, {history_sites} sites": lambda: validate.check(history_df)}
+    for case, run in validate_cases.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            clean_df, _, _ = run()
+        seconds = (time.perf_counter() - start) / repeats
+        print(f"{case:<32}{len(clean_df):>10}{seconds:>10.4f}")
+        if case == 'validate fetched rows':
+            print(f"{'  share of fetch and decode':<32}{'':>10}{seconds / fetch_seconds:>10.1%}")
+
+
+if __name__ == '__main__':
+    benchmark_fetch()
+    print()
+    benchmark_decode()
+    print()
+    benchmark_aggregate()
+    print()
+    benchmark_stream()
+    print()
+    benchmark_hourly_store()
+    print()
+    benchmark_validate()
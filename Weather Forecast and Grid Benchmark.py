@@ -0,0 +1,163 @@
+"""
+FORECAST AND GRID BENCHMARKS FOR THE MILWAUKEE WEATHER DATA PIPELINE
+
+This code performs the following tasks:
+  1.  Times the daily ensemble statistics of one site's forecast as the
+      member count grows, stacking every member before reducing against
+      pushing chunks of members through the spread reducer, with peak
+      memory
+  2.  Times scoring archived forecasts against the observed days by lead
+      day as a pandas merge and groupby against the dense observation
+      array and bincount sums, as the number of snapshots grows
+  3.  Times fetching a grid over Southeast Wisconsin at several
+      resolutions one batch at a time against four batches in flight, and
+      the regional series as per-cell frames with a weighted groupby
+      against the area-weighted sum over the cell array
+  4.  Prints a summary table for each benchmark
+
+Run from the repository folder:  python "Weather Forecast and Grid Benchmark.py"
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import archive, ensemble, grid
+from sewi_weather.synthetic import SyntheticClient, synthetic_sites
+from tests.reference import regional_by_groupby, skill_by_merge, spread_by_stacking
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+first_year = 1940
+
+last_year = 2025
+
+repeats = 3
+
+# Sites of the synthetic history the skill benchmark scores forecasts against
+history_sites = 10
+
+# Members of each of the three ensemble models in the ensemble benchmark
+ensemble_members = [40, 200, 800]
+
+# Forecast snapshots (daily issues at every site) in the skill benchmark
+skill_snapshots = [100, 1000, 3000]
+
+# Columns scored in the skill benchmark
+skill_columns = ['temperature_2m_max', 'temperature_2m_min', 'temperature_2m_mean', 'precipitation_sum',
+                 'soil_temperature_0_to_7cm_mean', 'soil_temperature_7_to_28cm_mean']
+
+# Cell sizes in degrees and days of the grid benchmark
+grid_resolutions = [0.2, 0.1, 0.05]
+
+grid_days = 90
+
+# Simulated transfer time of the stand-in API
+seconds_per_mb = 0.05
+
+################################################################################
+# SYNTHETIC DATA
+################################################################################
+
+def synthetic_archive(observed_df, snapshots, days = 16, seed = 0):
+    """
+    Daily forecasts issued on the last snapshots days of the observations,
+    each the observed value plus noise that grows with the lead.
+    """
+    rng = np.random.default_rng(seed)
+    observed_df = observed_df.set_index(['location', 'date'])
+    issued = pd.date_range(end = observed_df.index.get_level_values('date').max() - pd.Timedelta(days = days),
+                           periods = snapshots)
+    names = observed_df.index.get_level_values('location').unique()
+    lead = np.tile(np.arange(days, dtype = np.int16), len(issued) * len(names))
+    archive_df = pd.DataFrame({'location': pd.Categorical(np.repeat(names, len(issued) * days), categories = names),
+                               'issued': np.tile(np.repeat(issued.to_numpy(), days), len(names)), 'lead': lead})
+    archive_df['date'] = archive_df['issued'] + pd.to_timedelta(lead, unit = 'D')
+    actual = observed_df.reindex(pd.MultiIndex.from_arrays([archive_df['location'], archive_df['date']]))
+    for column in skill_columns:
+        noise = rng.normal(0.2, 1, len(archive_df)) * (1 + lead / 4)
+        archive_df[column] = (actual[column].to_numpy() + noise).astype(np.float32)
+    return archive_df
+
+################################################################################
+# RUN BENCHMARKS
+################################################################################
+
+def spread_by_reducer(responses):
+    reducer = ensemble.SpreadReducer()
+    for response in responses:
+        for times, block in ensemble.decode_members(response.Hourly(), ensemble.HOURLY_VARIABLES):
+            reducer.push(*ensemble.member_days(times, block, response.UtcOffsetSeconds()))
+    return reducer.finish()
+
+
+def benchmark_ensemble():
+    params = {**ensemble.PARAMS, 'latitude': 42.9675, 'longitude': -88.54972222}
+    print(f"Ensemble: daily spread of a {params['forecast_days']} day forecast of {len(ensemble.MODELS)} models at one site")
+    print(f"{'case':<32}{'members':>10}{'seconds':>10}{'peak MB':>10}")
+    for members in ensemble_members:
+        # Fetched once, so the peak is the decoding and reducing alone
+        responses = SyntheticClient(members = members).weather_api(ensemble.ENSEMBLE_URL, params)
+        for case, run in {'stack members, then reduce': spread_by_stacking,
+                          'spread reducer, chunks of 64': spread_by_reducer}.items():
+            start = time.perf_counter()
+            run(responses)
+            seconds = time.perf_counter() - start
+            tracemalloc.start()
+            run(responses)
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            print(f"{case:<32}{members * len(responses):>10}{seconds:>10.4f}{peak:>10.1f}")
+
+
+def benchmark_skill():
+    observed_df = synthetic_sites(history_sites, first_year, last_year)[['location', 'date'] + skill_columns]
+    print(f"Skill: forecasts of {len(skill_columns)} columns at {history_sites} sites scored by lead day")
+    print(f"{'case':<32}{'snapshots':>10}{'rows':>10}{'seconds':>10}")
+    for snapshots in skill_snapshots:
+        archive_df = synthetic_archive(observed_df, snapshots)
+        for case, run in {'merge, then groupby': lambda a, o: skill_by_merge(a, o, skill_columns),
+                          'dense array and bincount': lambda a, o: archive.forecast_skill(a, o, skill_columns)}.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                run(archive_df, observed_df)
+            seconds = (time.perf_counter() - start) / repeats
+            print(f"{case:<32}{snapshots:>10}{len(archive_df):>10}{seconds:>10.4f}")
+
+
+def benchmark_grid():
+    print(f"Grid: {grid_days} days over {grid.BOUNDS}, {seconds_per_mb} s/MB simulated transfer")
+    print(f"{'case':<32}{'cells':>10}{'seconds':>10}{'ms/cell':>10}")
+    params = {**grid.PARAMS, 'start_date': '2025-01-01',
+              'end_date': str((pd.Timestamp('2025-01-01') + pd.Timedelta(days = grid_days - 1)).date())}
+    for resolution in grid_resolutions:
+        cells = grid.grid_cells(resolution = resolution)
+        for case, workers in {'fetch, one batch at a time': 1, 'fetch, 4 batches in flight': 4}.items():
+            client = SyntheticClient(seconds_per_mb = seconds_per_mb)
+            start = time.perf_counter()
+            days, values = grid.fetch_grid(client, cells, params, max_workers = workers)
+            seconds = time.perf_counter() - start
+            print(f"{case:<32}{len(cells):>10}{seconds:>10.3f}{seconds / len(cells) * 1000:>10.2f}")
+
+        for case, run in {'per-cell frames, groupby': regional_by_groupby,
+                          'cell array, weighted sum': grid.regional_series}.items():
+            start = time.perf_counter()
+            run(cells, days, values)
+            seconds = time.perf_counter() - start
+            print(f"{case:<32}{len(cells):>10}{seconds:>10.3f}{seconds / len(cells) * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    benchmark_ensemble()
+    print()
+    benchmark_skill()
+    print()
+    benchmark_grid()
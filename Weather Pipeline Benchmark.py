@@ -0,0 +1,301 @@
+"""
+END-TO-END BENCHMARK OF THE MILWAUKEE WEATHER DATA PIPELINE
+
+This code performs the following tasks:
+  1.  Builds a scratch folder for each scale with a copy of the combiner
+      script and a locations.csv with that many sites
+  2.  Runs the whole pipeline (the three gatherers, features, climatology
+      and combine stages) against a local stand-in for the open-meteo API
+      that builds FlatBuffers responses for whatever years, variables and
+      sites are requested, so nothing goes over the network
+  3.  Collects wall time, peak memory, rows and bytes received for every
+      stage and step from the run report, with rows and MB per second,
+      keeping the best of a few runs
+  4.  Times the intraday forecast poller's first poll (loading the settled
+      rows) and a refresh after a new model run
+  5.  Times the cold start of the sewi-weather command in a fresh
+      interpreter, for --help and for a status check of every stage, as a
+      scheduled run that finds nothing to do pays it every time
+  6.  Compares each stage with the baseline in "Weather Pipeline Benchmark
+      Baseline.json" and lists the ones that got more than 25% slower or
+      bigger, and by at least 1 s or 50 MB
+  7.  Saves the results as the new baseline when asked to
+
+Each scale runs in a fresh process, from an empty cache and store, so the
+first run of a new machine is what gets measured. Run from the repository
+folder:
+
+    python "Weather Pipeline Benchmark.py"                    all scales
+    python "Weather Pipeline Benchmark.py" "1 year" "10 years"  some scales
+    python "Weather Pipeline Benchmark.py" --save-baseline    save results as the baseline
+
+The exit code is 1 when any stage regressed, so a scheduled job can stop
+before the nightly run does.
+
+The committed baseline was measured on one x86_64 core with Python 3.11.
+Times depend on the machine, so save a baseline of your own before
+comparing on another one.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Years of closed history and number of sites at each scale
+scales = {
+    '1 year': dict(years = 1, sites = 4),
+    '10 years': dict(years = 10, sites = 4),
+    '83 years': dict(years = 83, sites = 4),
+    '50 sites': dict(years = 10, sites = 50),
+}
+
+# Runs per scale; each stage keeps its best time and memory, as stages that
+# run side by side (e.g. climatology and combine) slow each other down a little
+repeats = 3
+
+# Simulated transfer time of the stand-in API
+seconds_per_mb = 0.0
+
+# The gatherers run from the package, so only the combiner is copied
+scripts = ['Weather Data Combiner.py']
+
+baseline_file = 'Weather Pipeline Benchmark Baseline.json'
+
+# A stage regresses when it is this much slower or bigger than the baseline...
+tolerance = 0.25
+
+# Interpreter starts per cold start measurement; the fastest is kept
+cold_starts = 5
+
+# ...and by at least this much, so tiny stages do not trip on noise
+min_seconds = 1.0
+
+min_mb = 50
+
+save_baseline = '--save-baseline' in sys.argv
+
+chosen = [arg for arg in sys.argv[1:] if not arg.startswith('--')] or list(scales)
+
+################################################################################
+# SCRATCH FOLDER
+################################################################################
+
+def write_locations(folder, sites):
+    """locations.csv with sites spread over a grid across Southeast Wisconsin."""
+    side = int(np.ceil(np.sqrt(sites)))
+    rows = np.arange(sites) // side
+    columns = np.arange(sites) % side
+    pd.DataFrame({'name': [f"Site {i:02d}" for i in range(sites)],
+                  'latitude': np.round(42.5 + rows / side, 4),
+                  'longitude': np.round(-88.8 + columns / side, 4)}).to_csv(os.path.join(folder, 'locations.csv'), index = False)
+
+# Runs the command and writes the interpreter's peak resident memory in kB to
+# stderr. A forked child inherits the parent's peak in its usage counters, so
+# it is read from /proc (Linux only) instead.
+COLD_START = """
+import runpy, sys
+try:
+    runpy.run_module('sewi_weather', run_name = '__main__', alter_sys = True)
+finally:
+    try:
+        with open('/proc/self/status') as f:
+            sys.stderr.write(next(line.split()[1] for line in f if line.startswith('VmHWM')))
+    except OSError:
+        pass
+"""
+
+
+def cold_start(name, arguments, repository):
+    """Wall time and peak memory of 'python -m sewi_weather arguments' in a fresh interpreter."""
+    environment = {**os.environ, 'PYTHONPATH': repository}
+    seconds, peak = np.inf, np.nan
+    for _ in range(cold_starts):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', COLD_START] + arguments, env = environment,
+                                stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+        seconds = min(seconds, time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{name}: sewi-weather {' '.join(arguments)} exited with {result.returncode}")
+        if result.stderr.strip().isdigit():
+            peak = np.fmin(peak, int(result.stderr) / 1024)
+    return {'stage': name, 'seconds': round(seconds, 3), 'peak_rss_mb': round(float(peak), 1)}
+
+################################################################################
+# RUN ONE SCALE
+################################################################################
+
+def measure(scale, queue):
+    """Run the pipeline once at one scale and report the profiler's stage records."""
+    # Imported here so the stand-in replaces the client before any stage uses it
+    import openmeteo_requests
+    from sewi_weather import profile
+    from sewi_weather.cache import CachedClient, WeatherCache
+    from sewi_weather.locations import load_locations
+    from sewi_weather.poller import ForecastPoller
+    from sewi_weather.synthetic import SyntheticClient
+
+    settings = scales[scale]
+    repository = os.getcwd()
+    folder = tempfile.mkdtemp(prefix = 'sewi-weather-benchmark-')
+    try:
+        for script in scripts:
+            shutil.copy(os.path.join(repository, script), folder)
+        write_locations(folder, settings['sites'])
+        os.chdir(folder)
+        os.environ['SEWI_WEATHER_START_DATE'] = f"{date.today().year - settings['years']}-01-01"
+
+        client = SyntheticClient(seconds_per_mb = seconds_per_mb)
+        openmeteo_requests.Client = lambda session = None: client
+
+        start = time.perf_counter()
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            runpy.run_path('Weather Data Combiner.py', run_name = '__main__')
+        seconds = time.perf_counter() - start
+        stages = profile.profiler.take()
+        calls, received = client.calls, client.bytes_received
+
+        # The poller's first poll, then a refresh as if a new model run had arrived
+        poller = ForecastPoller(CachedClient(client, WeatherCache('.weather_cache.sqlite', ttl = {'forecast': 0})),
+                                load_locations())
+        for name in ('poller_first_poll', 'poller_refresh'):
+            poller.digest = None
+            with contextlib.redirect_stdout(log):
+                record = asyncio.run(poller.poll())
+            if record['status'] != 'changed':
+                raise RuntimeError(f"{name}: {record.get('error', record['status'])}")
+            stages.append({'stage': name, 'seconds': record['seconds'],
+                           'start_s': min(step['start_s'] for step in record['steps']),
+                           'peak_rss_mb': max(step['peak_rss_mb'] for step in record['steps'])})
+
+        # Every stage is current now, so this is what a scheduled run with nothing due costs
+        for name, arguments in (('cold_start_help', ['--help']), ('cold_start_status', ['status'])):
+            stages.append({**cold_start(name, arguments, repository), 'start_s': time.perf_counter() - start})
+
+        queue.put({'scale': scale, **settings, 'seconds': round(seconds, 3), 'api_calls': calls,
+                   'api_mb': round(received / 2**20, 1), 'stages': stages})
+    except BaseException as error:
+        queue.put({'scale': scale, 'error': repr(error)})
+        raise
+    finally:
+        os.chdir(repository)
+        shutil.rmtree(folder, ignore_errors = True)
+
+
+def run_once(scale):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target = measure, args = (scale, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run_scale(scale):
+    """Best time and memory of each stage over repeats runs."""
+    runs = [run_once(scale) for _ in range(repeats)]
+    failed = [run for run in runs if 'error' in run]
+    if failed:
+        return failed[0]
+    best = runs[0]
+    best['seconds'] = min(run['seconds'] for run in runs)
+    for record in best['stages']:
+        others = [other for run in runs[1:] for other in run['stages'] if other['stage'] == record['stage']]
+        for field in ('seconds', 'peak_rss_mb'):
+            record[field] = min([record[field]] + [other[field] for other in others])
+    return best
+
+################################################################################
+# REPORT
+################################################################################
+
+def stage_table(result):
+    """One row per stage and step with its throughput."""
+    table = pd.DataFrame(result['stages']).sort_values('start_s')
+    for column in ('rows', 'bytes_received'):
+        if column not in table.columns:
+            table[column] = np.nan
+    table = table[['stage', 'seconds', 'peak_rss_mb', 'rows', 'bytes_received']].copy()
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        table['rows_per_s'] = (table['rows'] / table['seconds']).round(0)
+        table['mb_per_s'] = (table['bytes_received'] / 2**20 / table['seconds']).round(1)
+    return table.drop(columns = 'bytes_received')
+
+
+def compare(results, baseline):
+    """Stages slower or bigger than the baseline by more than the tolerance."""
+    rows = []
+    for scale, result in results.items():
+        if scale not in baseline:
+            continue
+        old = {record['stage']: record for record in baseline[scale]['stages']}
+        for record in result['stages']:
+            before = old.get(record['stage'])
+            if before is None:
+                continue
+            for field, floor in (('seconds', min_seconds), ('peak_rss_mb', min_mb)):
+                new_value, old_value = record[field], before[field]
+                if new_value > old_value * (1 + tolerance) and new_value - old_value >= floor:
+                    rows.append({'scale': scale, 'stage': record['stage'], 'measure': field,
+                                 'baseline': old_value, 'now': new_value,
+                                 'change': f"{new_value / old_value - 1:+.0%}" if old_value else 'new'})
+    return pd.DataFrame(rows, columns = ['scale', 'stage', 'measure', 'baseline', 'now', 'change'])
+
+
+if __name__ == '__main__':
+    unknown = set(chosen) - set(scales)
+    if unknown:
+        raise SystemExit(f"Unknown scales {sorted(unknown)}; choose from {list(scales)}")
+
+    results = {}
+    for scale in chosen:
+        result = run_scale(scale)
+        if 'error' in result:
+            raise SystemExit(f"{scale}: pipeline failed with {result['error']}")
+        results[scale] = result
+        print(f"{scale}: {result['years']} years, {result['sites']} sites, {result['seconds']} s, "
+              f"{result['api_calls']} API calls, {result['api_mb']} MB received")
+        print(stage_table(result).to_string(index = False))
+        print()
+
+    baseline = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline)
+    if not baseline:
+        print(f"No baseline in {baseline_file}; run with --save-baseline to save one")
+    elif len(regressions):
+        print(f"Regressions against {baseline_file} (over {tolerance:.0%} and {min_seconds} s or {min_mb} MB):")
+        print(regressions.to_string(index = False))
+    else:
+        print(f"No regressions against {baseline_file}")
+
+    if save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump({**baseline, **results}, f, indent = 1, default = str)
+        print(f"Baseline saved to {baseline_file}")
+
+    sys.exit(1 if len(regressions) else 0)
@@ -0,0 +1,192 @@
+"""
+STORAGE BENCHMARKS FOR THE MILWAUKEE WEATHER DATA PIPELINE
+
+This code performs the following tasks:
+  1.  Builds a synthetic daily data set the size of the 1940-to-date history
+  2.  Saves it both as CSV and to the year-partitioned store
+  3.  Times loading it back each way and records frame size and peak memory
+  4.  Measures memory and CSV and Parquet size of the combined frame with
+      string labels and float64 columns against the compact schema
+  5.  Times answering a request for the last 30 days of one metric at one
+      site by reading and filtering the combined CSV against the query
+      API's in-memory index, with and without an ETag
+  6.  Prints a summary table for each benchmark
+
+Each load runs in a fresh process so peak memory (max RSS) is not shared
+between cases. Run from the repository folder:  python "Weather Storage Benchmark.py"
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.combine import SOURCE_PRIORITY, compact, relative_date, weather_code_category
+from sewi_weather.features import rolling_features
+from sewi_weather.query import WeatherQuery
+from sewi_weather.synthetic import synthetic_daily, synthetic_sites
+from tests.reference import relative_date_by_where, select_by_filter, weather_code_category_by_map
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+first_year = 1940
+
+last_year = 2025
+
+repeats = 3
+
+# Sites in the combined frame of the schema and query benchmarks
+history_sites = 10
+
+################################################################################
+# LOAD CASES
+################################################################################
+
+def load_csv(folder):
+    df = pd.read_csv(os.path.join(folder, 'MKE Weather Data Historical.csv'))
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def load_store(folder):
+    return store.read('Historical', folder + os.sep)
+
+
+def load_store_projected(folder):
+    columns = ['temperature_2m_mean', 'soil_temperature_0_to_7cm_mean']
+    return store.read('Historical', folder + os.sep, columns = columns, years = range(last_year - 29, last_year + 1))
+
+
+cases = {'csv': load_csv, 'store': load_store, 'store, 2 columns x 30 years': load_store_projected}
+
+################################################################################
+# RUN BENCHMARKS
+################################################################################
+
+def measure(case, folder, queue):
+    """Run one load case and report seconds, rows, frame size and peak RSS (MB)."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        df = cases[case](folder)
+        timings.append(time.perf_counter() - start)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((min(timings), len(df), df.memory_usage(deep = True).sum() / 2**20, peak_rss / 1024))
+
+
+def run_case(case, folder):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target = measure, args = (case, folder, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def benchmark_store():
+    with tempfile.TemporaryDirectory() as folder:
+        df = synthetic_daily(first_year, last_year)
+        df.to_csv(os.path.join(folder, 'MKE Weather Data Historical.csv'), index = False)
+        store.write(df, 'Historical', folder + os.sep)
+
+        print(f"Load: {len(df)} daily rows, {first_year}-{last_year}")
+        print(f"{'case':<32}{'seconds':>10}{'rows':>10}{'frame MB':>10}{'peak RSS MB':>14}")
+        for case in cases:
+            seconds, rows, size, peak = run_case(case, folder)
+            print(f"{case:<32}{seconds:>10.4f}{rows:>10}{size:>10.1f}{peak:>14.1f}")
+
+
+def combined_frames():
+    """The combined frame with the combiner's original dtypes and with the compact schema."""
+    full_df = synthetic_sites(history_sites, first_year, last_year)
+    full_df = full_df.join(rolling_features(full_df)[0])
+    sources = np.where(full_df['year'] < last_year, 'Historical', 'YTD')
+    today = full_df['date'].iloc[len(full_df) // 2]
+
+    wide = full_df.astype({'location': object, 'weather_code': np.float64, 'month': np.int64, 'year': np.int64})
+    wide = wide.astype({column: np.float64 for column in wide.select_dtypes('float32').columns})
+    wide['Data Source'] = sources.astype(object)
+    wide['weather_code_category'] = weather_code_category_by_map(wide['weather_code'])
+    wide['relative_date'] = relative_date_by_where(wide['date'], today)
+
+    narrow = compact(full_df.copy())
+    narrow['Data Source'] = pd.Categorical(sources, categories = SOURCE_PRIORITY)
+    narrow['weather_code_category'] = weather_code_category(narrow['weather_code'])
+    narrow['relative_date'] = relative_date(narrow['date'], today)
+    return wide, narrow
+
+
+def benchmark_schema():
+    wide, narrow = combined_frames()
+
+    print(f"Schema: combined frame, {history_sites} sites, {len(wide)} rows")
+    print(f"{'case':<32}{'memory MB':>10}{'CSV MB':>10}{'Parquet MB':>12}{'CSV s':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for case, df in {'strings and float64': wide, 'categoricals and float32': narrow}.items():
+            memory = df.memory_usage(deep = True).sum() / 2**20
+            csv_path, parquet_path = os.path.join(folder, 'combined.csv'), os.path.join(folder, 'combined.parquet')
+            start = time.perf_counter()
+            df.to_csv(csv_path, index = False)
+            seconds = time.perf_counter() - start
+            df.to_parquet(parquet_path, index = False)
+            print(f"{case:<32}{memory:>10.1f}{os.path.getsize(csv_path) / 2**20:>10.1f}"
+                  f"{os.path.getsize(parquet_path) / 2**20:>12.1f}{seconds:>10.2f}")
+
+
+def benchmark_query():
+    _, narrow = combined_frames()
+    end = narrow['date'].max()
+    start = end - pd.Timedelta(days = 29)
+    site, column = narrow['location'].iloc[0], 'soil_temperature_0_to_7cm_7dayavg'
+    params = {'start': [str(start.date())], 'end': [str(end.date())], 'location': [site], 'columns': [column]}
+
+    print(f"Query: last 30 days of {column} at one of {history_sites} sites, {len(narrow)} rows")
+    print(f"{'case':<36}{'seconds':>12}{'rows':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = folder + os.sep
+        narrow.to_csv(filepath + 'combined.csv', index = False)
+        store.write(narrow, 'Combined', filepath)
+
+        def from_csv():
+            df = pd.read_csv(filepath + 'combined.csv', parse_dates = ['date'])
+            return select_by_filter(df, start, end, [site], [column])
+
+        query = WeatherQuery(filepath)
+        cases = [('read and filter the CSV', from_csv, 1),
+                 ('load the store into the index', query.snapshot, 1),
+                 ('select from the index', lambda: query.select(start = start, end = end, locations = [site],
+                                                                columns = [column]), 100),
+                 ('respond, first time', lambda: query.respond(params), 1),
+                 ('respond, cached body', lambda: query.respond(params), 100),
+                 ('respond, matching ETag (304)', lambda: query.respond(params, etag), 100)]
+        results = {}
+        etag = None
+        for case, run, times in cases:
+            start_time = time.perf_counter()
+            for _ in range(times):
+                results[case] = run()
+            seconds = (time.perf_counter() - start_time) / times
+            if case == 'respond, first time':
+                etag = results[case][1]['ETag']
+            rows = len(results[case]) if isinstance(results[case], pd.DataFrame) else ''
+            print(f"{case:<36}{seconds:>12.5f}{rows:>8}")
+
+
+if __name__ == '__main__':
+    benchmark_store()
+    print()
+    benchmark_schema()
+    print()
+    benchmark_query()
@@ -0,0 +1,3 @@
+"""
+Shared helpers for the Southeast Wisconsin weather data pipeline scripts.
+"""
@@ -0,0 +1,7 @@
+"""Run the sewi-weather command as 'python -m sewi_weather'."""
+
+import sys
+
+from sewi_weather.cli import main
+
+sys.exit(main())
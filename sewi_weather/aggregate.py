@@ -0,0 +1,205 @@
+"""
+HOURLY TO DAILY AGGREGATION
+
+Daily means for every requested column share a single grouping of the hourly
+rows. Rows are grouped on an integer day number (days since 1970-01-01)
+instead of Python date objects, and because the decoded hourly rows are
+already ordered by location and time, each group is a contiguous run that
+np.add.reduceat can sum without sorting or hashing.
+
+The same runs give the daily minimum and maximum (np.fmin/np.fmax.reduceat)
+and degree hours, the sum over a day's hours of how far a temperature was
+above a base, so every daily statistic comes from one pass over the hours.
+
+Hours are grouped into local days of the requested timezone (America/Chicago),
+like the API's daily values: the response's UtcOffsetSeconds() is added to
+the UTC timestamps before they are cut into days, as grid.py and ensemble.py
+do, so a day starts at local midnight whether it is fetched on its own or
+as part of a longer range.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import numpy as np
+import pandas as pd
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Growing degree hours: the base temperatures (°F) to sum each hourly column's excess over
+DEGREE_HOUR_BASES = {'soil_temperature_0_to_7cm': [50]}
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def day_number(dates, utc_offset = 0):
+    """
+    Whole days since 1970-01-01 as int32 for an array of datetime64 values.
+    utc_offset (seconds) is added first, which turns UTC times into local days.
+    """
+    dates = np.asarray(dates)
+    if utc_offset:
+        dates = dates.astype('datetime64[s]') + np.timedelta64(int(utc_offset), 's')
+    return dates.astype('datetime64[D]').astype(np.int32)
+
+
+def local_dates(dates, utc_offset = 0):
+    """Local midnight of each UTC time in a datetime64 Series, as the daily rows' 'date'."""
+    return (dates + pd.Timedelta(seconds = utc_offset)).dt.normalize()
+
+
+def run_starts(*keys):
+    """Index of the first row of every run of equal keys."""
+    change = np.zeros(len(keys[0]), dtype = bool)
+    change[:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def mean_runs(values, starts):
+    """
+    NaN-skipping mean of each run along the last axis of values.
+
+    values is one column or a (columns x rows) block like decode_block
+    returns. Runs with no valid values come out as NaN, like a pandas groupby
+    mean. NaNs in values are overwritten with zeros.
+    """
+    valid = ~np.isnan(values)
+    values[~valid] = 0
+    sums = np.add.reduceat(values, starts, axis = -1, dtype = np.float64)
+    counts = np.add.reduceat(valid, starts, axis = -1, dtype = np.int32)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return sums / counts
+
+
+def stat_columns(columns, extremes = (), degree_hours = None, suffix = '_mean'):
+    """
+    Names of the daily statistics reduce_runs returns, in order: the mean of
+    every column, then '_min' and '_max' of the columns in extremes, then
+    '_degree_hours_<base>F' for every column and base in degree_hours.
+    """
+    names = [c + suffix for c in columns]
+    names += [f"{c}_{how}" for c in extremes for how in ('min', 'max')]
+    names += [f"{c}_degree_hours_{base:g}F" for c, bases in (degree_hours or {}).items() for base in bases]
+    return names
+
+
+def reduce_runs(block, starts, columns, extremes = (), degree_hours = None):
+    """
+    Every daily statistic of a (columns x hours) block, as a (statistics x
+    runs) float32 array in stat_columns order.
+
+    columns names the rows of block. extremes lists the columns to take the
+    min and max of, and degree_hours maps columns to the base temperatures
+    to sum the hourly excess over. A run with no values gives NaN. NaNs in
+    block are overwritten with zeros.
+    """
+    stats = []
+    if len(extremes):
+        rows = block[[columns.index(c) for c in extremes]]
+        lows, highs = np.fmin.reduceat(rows, starts, axis = 1), np.fmax.reduceat(rows, starts, axis = 1)
+        stats += [row for pair in zip(lows, highs) for row in pair]
+    for column, bases in (degree_hours or {}).items():
+        row = block[columns.index(column)]
+        counts = np.add.reduceat(~np.isnan(row), starts, dtype = np.int32)
+        for base in bases:
+            # NaN hours compare False, so they add nothing
+            with np.errstate(invalid = 'ignore'):
+                excess = np.where(row > base, row - base, 0)
+            sums = np.add.reduceat(excess, starts, dtype = np.float64)
+            stats.append(np.where(counts > 0, sums, np.nan))
+    # Last, since it zeroes the NaNs the other statistics skip
+    means = mean_runs(block, starts)
+    return np.concatenate([means, np.array(stats).reshape(len(stats), len(starts))]).astype(np.float32)
+
+
+def daily_means(hourly_df, columns, suffix = '_mean', extremes = (), degree_hours = None, utc_offset = 0):
+    """
+    Mean of each column per location and local day, plus the min, max and
+    degree hours asked for (see stat_columns).
+
+    hourly_df needs 'location' and 'date' (datetime64, UTC) columns with each
+    location's rows together and in time order, as decode_locations returns
+    them. utc_offset is the responses' UtcOffsetSeconds(); the sites share
+    the request's timezone. Returns one row per location and local day with
+    a datetime64 'date'.
+    """
+    location, _ = pd.factorize(hourly_df['location'])
+    days = day_number(hourly_df['date'], utc_offset)
+    starts = run_starts(location, days)
+    degree_hours = degree_hours or {}
+
+    # Key runs are found once; each column is then reduced on its own so only
+    # one column at a time is copied
+    stats = {}
+    for column in columns:
+        values = hourly_df[column].to_numpy(dtype = np.float32, copy = True)[None, :]
+        own = ([column] if column in extremes else [],
+               {column: degree_hours[column]} if column in degree_hours else None)
+        stats.update(zip(stat_columns([column], *own, suffix), reduce_runs(values, starts, [column], *own)))
+    daily = pd.DataFrame({name: stats[name] for name in stat_columns(columns, extremes, degree_hours, suffix)})
+    daily.insert(0, 'date', days[starts].astype('datetime64[D]').astype('datetime64[s]'))
+    daily.insert(0, 'location', hourly_df['location'].take(starts).to_numpy())
+    return daily
+
+################################################################################
+# STREAMING REDUCER
+################################################################################
+
+class DailyReducer:
+    """
+    Daily means, and the min, max and degree hours asked for, computed from
+    hourly chunks as they are decoded.
+
+    push() takes (times, block) pairs from decode_block in time order, with
+    the response's UtcOffsetSeconds() so hours are grouped into local days.
+    Days that are complete are reduced straight away and only the hours of
+    the last, possibly unfinished, day are kept for the next chunk, so memory
+    depends on the chunk size rather than the length of the archive.
+    """
+
+    def __init__(self, columns, suffix = '_mean', extremes = (), degree_hours = None):
+        self.columns = stat_columns(columns, extremes, degree_hours, suffix)
+        self._sources = list(columns)
+        self._extremes = list(extremes)
+        self._degree_hours = degree_hours
+        self._hour_days = np.empty(0, dtype = np.int32)
+        self._block = np.empty((len(columns), 0), dtype = np.float32)
+        self._days = []
+        self._means = []
+
+    def _reduce(self, hour_days, block):
+        starts = run_starts(hour_days)
+        self._days.append(hour_days[starts])
+        self._means.append(reduce_runs(block, starts, self._sources, self._extremes, self._degree_hours))
+
+    def push(self, times, block, utc_offset = 0):
+        hour_days = ((times + utc_offset) // 86400).astype(np.int32)
+        if len(self._hour_days):
+            hour_days = np.concatenate([self._hour_days, hour_days])
+            block = np.concatenate([self._block, block], axis = 1)
+        if not len(hour_days):
+            return
+        # Everything before the first hour of the last day is complete
+        cut = np.searchsorted(hour_days, hour_days[-1])
+        if cut:
+            self._reduce(hour_days[:cut], block[:, :cut].copy())
+        self._hour_days = hour_days[cut:].copy()
+        self._block = block[:, cut:].copy()
+
+    def finish(self):
+        """Reduce the last day and return one row per local day with a datetime64 'date'."""
+        if len(self._hour_days):
+            self._reduce(self._hour_days, self._block)
+            self._hour_days = self._hour_days[:0]
+            self._block = self._block[:, :0]
+        days = np.concatenate(self._days) if self._days else np.empty(0, dtype = np.int32)
+        means = np.concatenate(self._means, axis = 1) if self._means else np.empty((len(self.columns), 0), dtype = np.float32)
+        daily = pd.DataFrame(means.T, columns = self.columns, copy = False)
+        daily.insert(0, 'date', days.astype('datetime64[D]').astype('datetime64[s]'))
+        return daily
@@ -0,0 +1,211 @@
+"""
+FORECAST ARCHIVE AND SKILL BACKTESTING
+
+The 'Prediction' data set only holds the latest forecast. Every forecast
+the prediction gatherer or the forecast poller saves is also kept here as a
+snapshot: one row per site and forecast day, with the day it was issued,
+the lead in days and the forecast variables that the archive observes, as
+float32. A snapshot is only added when it differs from the last one
+saved, and a day's later snapshots replace its earlier ones when the
+archive is read, so there is one forecast per site, issue date and day.
+
+Snapshots are appended to the 'Forecast Archive' data set as small files.
+Once a year partition has more than COMPACT_FILES of them it is rewritten
+as one file holding only the latest snapshot of each issue date.
+
+forecast_skill joins the snapshots with the observed days in the YTD and
+historical data sets and returns the bias (forecast minus observed), mean
+absolute error and root mean square error of every variable by lead day.
+Observations are placed in a dense (site and day x variable) array, so the
+join is one fancy-indexing lookup, and the errors of every lead and
+variable are summed by one np.bincount each, without a merge or groupby.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.aggregate import day_number
+from sewi_weather.depths import layer_columns
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Forecast variables the historical and YTD data sets also have
+ARCHIVE_VARIABLES = (['temperature_2m_max', 'temperature_2m_min', 'temperature_2m_mean',
+                      'precipitation_sum', 'rain_sum', 'snowfall_sum']
+                     + [column + '_mean' for column in layer_columns('soil_temperature') + layer_columns('soil_moisture')]
+                     + ['soil_temperature_0_to_7cm_min', 'soil_temperature_0_to_7cm_max',
+                        'soil_temperature_0_to_7cm_degree_hours_50F'])
+
+KEY_COLUMNS = ['location', 'issued', 'date']
+
+# Appended snapshot files a year partition may hold before it is compacted
+COMPACT_FILES = 64
+
+# Digest of the last snapshot saved, so an unchanged forecast is not added again
+ARCHIVE_STATE = '.forecast_archive.json'
+
+################################################################################
+# SNAPSHOTS
+################################################################################
+
+def snapshot(pred_df, issued, variables = ARCHIVE_VARIABLES):
+    """
+    Archive rows of a forecast issued on the given day: the days from the
+    issue date on, with 'issued', an int16 'lead' in days and the variables.
+    """
+    issued = pd.Timestamp(issued).normalize()
+    dates = pred_df['date'].dt.normalize()
+    keep = (dates >= issued).to_numpy()
+    # Plain strings, so snapshots from the gatherer (categorical) and the poller share one schema
+    df = pd.DataFrame({'location': pred_df['location'].astype(str).to_numpy()[keep], 'issued': issued,
+                       'date': dates.to_numpy()[keep],
+                       'lead': (day_number(dates[keep]) - day_number(np.datetime64(issued.date()))).astype(np.int16)})
+    for column in variables:
+        df[column] = pred_df[column].to_numpy(dtype = np.float32)[keep]
+    df['year'] = issued.year
+    return df
+
+
+def archive_forecast(pred_df, filepath = '', issued = None, variables = ARCHIVE_VARIABLES):
+    """
+    Add the forecast to the archive unless it matches the last snapshot
+    saved. Returns the number of rows added.
+    """
+    df = snapshot(pred_df, issued or date.today(), variables)
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index = False).to_numpy().tobytes()).hexdigest()
+    state_path = filepath + ARCHIVE_STATE
+    if os.path.exists(state_path) and store.exists('Forecast Archive', filepath):
+        with open(state_path) as f:
+            if json.load(f).get('digest') == digest:
+                return 0
+
+    # Not rounded, so a second snapshot within the same second still sorts after the first
+    df['captured'] = pd.Timestamp.now()
+    store.write(df, 'Forecast Archive', filepath, mode = 'append')
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump({'digest': digest, 'issued': str(df['issued'].iloc[0].date()) if len(df) else None}, f)
+    os.replace(state_path + '.tmp', state_path)
+
+    for year in df['year'].unique():
+        folder = os.path.join(store.store_path('Forecast Archive', filepath), f"year={year}")
+        if len(os.listdir(folder)) > COMPACT_FILES:
+            store.write(read_archive(filepath, years = [year]), 'Forecast Archive', filepath, mode = 'partitions')
+    return len(df)
+
+
+def read_archive(filepath = '', years = None, columns = None):
+    """
+    The archived forecasts, one row per site, issue date and day (the last
+    snapshot of each issue date), sorted by issue date. years are years of
+    the issue date.
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(KEY_COLUMNS + ['lead', 'captured', 'year'] + list(columns)))
+    df = store.read('Forecast Archive', filepath, columns = columns, years = years)
+    df = df.sort_values(['issued', 'captured'], kind = 'stable')
+    df = df.drop_duplicates(KEY_COLUMNS, keep = 'last')
+    return df.reset_index(drop = True)
+
+################################################################################
+# BACKTESTING
+################################################################################
+
+def _site_codes(location, names):
+    """Position of each row's site in names, from a categorical's codes."""
+    return names.get_indexer(location.categories.astype(str)).astype(np.int64)[location.codes]
+
+
+def forecast_skill(archive_df, observed_df, variables = ARCHIVE_VARIABLES, by_location = False):
+    """
+    Bias, MAE and RMSE of each variable by lead day, with the number of
+    forecast days that could be checked ('n').
+
+    archive_df holds snapshots as read_archive returns them and observed_df
+    one row per site and day with the same variables; where observed_df has
+    a site and day twice, the later row wins. by_location adds a 'location'
+    column and scores every site on its own. Days without an observation
+    are left out.
+    """
+    variables = [column for column in variables if column in archive_df.columns and column in observed_df.columns]
+    forecast_location = archive_df['location'].astype('category').cat
+    observed_location = observed_df['location'].astype('category').cat
+    names = pd.Index(sorted(set(forecast_location.categories.astype(str)) | set(observed_location.categories.astype(str))))
+    forecast_site = _site_codes(forecast_location, names)
+    observed_site = _site_codes(observed_location, names)
+    forecast_day = day_number(archive_df['date'])
+    observed_day = day_number(observed_df['date'])
+
+    # Observations in a dense (site and day x variable) array over the forecast days
+    first = int(forecast_day.min()) if len(forecast_day) else 0
+    span = int(forecast_day.max()) - first + 1 if len(forecast_day) else 0
+    inside = (observed_day >= first) & (observed_day < first + span)
+    observed = np.full((len(names) * span, len(variables)), np.nan, dtype = np.float32)
+    observed[observed_site[inside] * span + observed_day[inside] - first] = \
+        observed_df[variables].to_numpy(dtype = np.float32)[inside]
+
+    errors = archive_df[variables].to_numpy(dtype = np.float32) - observed[forecast_site * span + forecast_day - first]
+    # Leads are a few small integers, so they are numbered by a lookup table instead of sorting
+    lead = archive_df['lead'].to_numpy(dtype = np.int64)
+    low = int(lead.min()) if len(lead) else 0
+    present = np.bincount(lead - low) > 0
+    leads = np.flatnonzero(present) + low
+    lead_index = (np.cumsum(present) - 1)[lead - low]
+    groups = lead_index * len(names) + forecast_site if by_location else lead_index
+    n_groups = len(leads) * (len(names) if by_location else 1)
+
+    # One bin per group and variable; missing errors count as zero with no weight
+    valid = ~np.isnan(errors)
+    errors = np.where(valid, errors, 0).astype(np.float64)
+    bins = (groups[:, None] * len(variables) + np.arange(len(variables))).ravel()
+    size = n_groups * len(variables)
+    n = np.bincount(bins, weights = valid.ravel(), minlength = size).astype(np.int64)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        bias = np.bincount(bins, weights = errors.ravel(), minlength = size) / n
+        mae = np.bincount(bins, weights = np.abs(errors).ravel(), minlength = size) / n
+        rmse = np.sqrt(np.bincount(bins, weights = (errors * errors).ravel(), minlength = size) / n)
+
+    group = np.repeat(np.arange(n_groups), len(variables))
+    skill = pd.DataFrame({'lead': leads[group // len(names) if by_location else group]})
+    if by_location:
+        skill['location'] = pd.Categorical.from_codes(group % len(names), categories = names)
+    skill['variable'] = np.tile(variables, n_groups)
+    skill['n'] = n
+    skill['bias'] = bias
+    skill['mae'] = mae
+    skill['rmse'] = rmse
+    return skill[n > 0].reset_index(drop = True)
+
+
+def backtest(filepath = '', variables = ARCHIVE_VARIABLES, by_location = False):
+    """
+    forecast_skill of the archived forecasts against the historical and YTD
+    data sets, reading only the years the forecasts cover.
+    """
+    archive_df = read_archive(filepath, columns = variables)
+    if not len(archive_df):
+        return forecast_skill(archive_df, archive_df, variables, by_location)
+    years = range(archive_df['date'].min().year, archive_df['date'].max().year + 1)
+    columns = ['location'] + list(variables)
+    # Historical rows come last, so they win over YTD rows of the same day
+    observed_df = pd.concat([store.read(name, filepath, columns = columns, years = years)
+                             for name in ('YTD', 'Historical') if store.exists(name, filepath)], ignore_index = True)
+    return forecast_skill(archive_df, observed_df, variables, by_location)
+
+
+def update_skill(filepath = ''):
+    """Save the forecast skill by lead day as a CSV side table."""
+    skill = backtest(filepath)
+    skill.to_csv(filepath + store.SKILL_FILE, index = False)
+    return skill
@@ -0,0 +1,404 @@
+"""
+DAY-GRANULAR RESPONSE CACHE
+
+Replaces the shared requests_cache '.cache' file. Instead of caching whole
+HTTP responses, which never match again once a YTD end date moves on by a
+day, each site's data is cached one day at a time under a key built from the
+normalized request: endpoint, rounded coordinates, variables, units and the
+day itself. A request then only fetches the days that are missing or
+expired, and yesterday's overlapping YTD window is reused.
+
+Entries expire after a per-endpoint time to live, and the least recently
+used entries are evicted once the cache grows past max_bytes. Hit, miss and
+byte counters are kept in CachedClient.stats().
+
+Archive days are final once they are about a week old, but the newest ones
+are provisional and may still be revised upstream. A day fetched within
+PROVISIONAL_DAYS of its date expires after PROVISIONAL_TTL, like the
+baseline that downloaded them again on every run; only settled days are
+kept for good.
+
+shared_client() hands every stage of a process the same HTTP session and
+cache connection, each wrapped in a CachedClient with its own counters.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather.fetch import request_range
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Seconds a cached day stays valid for each endpoint. None never expires.
+TTL = {'archive': None, 'forecast': 3600}
+
+# Days before the fetch that the archive may still revise
+PROVISIONAL_DAYS = 7
+
+# Seconds a day fetched while still provisional stays valid, for each endpoint
+PROVISIONAL_TTL = {'archive': 6 * 3600}
+
+# Endpoints whose responses are passed through uncached. Ensemble responses
+# carry every member of a model, and there is one response per site and model.
+UNCACHED = {'ensemble'}
+
+# Parameters that select which sites and days are fetched rather than what is fetched
+RANGE_PARAMS = {'latitude', 'longitude', 'start_date', 'end_date', 'past_days', 'forecast_days', 'format'}
+
+################################################################################
+# IN-MEMORY RESPONSES
+################################################################################
+
+class ArrayVariable:
+    """One decoded variable. Mirrors VariableWithValues."""
+
+    def __init__(self, values):
+        self._values = values
+
+    def ValuesAsNumpy(self):
+        return self._values
+
+
+class ArraySection:
+    """An Hourly or Daily section rebuilt from cached days. Mirrors VariablesWithTime."""
+
+    def __init__(self, start, interval, block):
+        self._start = start
+        self._interval = interval
+        self._block = block
+
+    def Time(self):
+        return self._start
+
+    def TimeEnd(self):
+        return self._start + self._interval * self._block.shape[1]
+
+    def Interval(self):
+        return self._interval
+
+    def VariablesLength(self):
+        return self._block.shape[0]
+
+    def Variables(self, j):
+        return ArrayVariable(self._block[j])
+
+
+class CachedResponse:
+    """A site's response rebuilt from cached days. Mirrors WeatherApiResponse."""
+
+    def __init__(self, meta, hourly, daily):
+        self._meta = meta
+        self._hourly = hourly
+        self._daily = daily
+
+    def Latitude(self):
+        return self._meta['latitude']
+
+    def Longitude(self):
+        return self._meta['longitude']
+
+    def Elevation(self):
+        return self._meta['elevation']
+
+    def UtcOffsetSeconds(self):
+        return self._meta['utc_offset']
+
+    def Timezone(self):
+        return self._meta['timezone'].encode()
+
+    def TimezoneAbbreviation(self):
+        return self._meta['abbreviation'].encode()
+
+    def Hourly(self):
+        return self._hourly
+
+    def Daily(self):
+        return self._daily
+
+################################################################################
+# CACHE STORAGE
+################################################################################
+
+def endpoint_name(url):
+    """Short endpoint name used for TTLs and keys, e.g. 'archive' or 'forecast'."""
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+class WeatherCache:
+    """SQLite table of cached site-days with LRU eviction."""
+
+    def __init__(self, path = '.weather_cache.sqlite', max_bytes = 512 * 2**20, ttl = None, provisional_ttl = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = {**TTL, **(ttl or {})}
+        self.provisional_ttl = {**PROVISIONAL_TTL, **(provisional_ttl or {})}
+        self._lock = threading.Lock()
+        # Stages running side by side share the file, so wait for each other's writes
+        self._db = sqlite3.connect(path, timeout = 60, check_same_thread = False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS days (
+            key TEXT PRIMARY KEY, endpoint TEXT, hourly_time INTEGER, daily_time INTEGER,
+            meta TEXT, data BLOB, size INTEGER, created REAL, accessed REAL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS days_accessed ON days (accessed)")
+        self._db.commit()
+
+    def get(self, endpoint, keys):
+        """
+        Return {key: row} for the keys that are cached and not expired. A day
+        cached within PROVISIONAL_DAYS of its own date also expires after the
+        endpoint's provisional TTL.
+        """
+        ttl = self.ttl.get(endpoint)
+        provisional_ttl = self.provisional_ttl.get(endpoint)
+        now = time.time()
+        oldest = -np.inf if ttl is None else now - ttl
+        oldest_provisional = -np.inf if provisional_ttl is None else now - provisional_ttl
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, hourly_time, daily_time, meta, data FROM days "
+                    f"WHERE key IN ({','.join('?' * len(part))}) AND created >= ? "
+                    f"AND (created >= ? OR MAX(hourly_time, daily_time) < created - ?)",
+                    part + [oldest, oldest_provisional, PROVISIONAL_DAYS * 86400])
+                for key, hourly_time, daily_time, meta, data in rows:
+                    found[key] = (hourly_time, daily_time, meta, data)
+            now = time.time()
+            self._db.executemany("UPDATE days SET accessed = ? WHERE key = ?", [(now, key) for key in found])
+            self._db.commit()
+        return found
+
+    def put(self, endpoint, rows):
+        """Store (key, hourly_time, daily_time, meta, data) rows, then evict down to max_bytes."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(key, endpoint, hourly_time, daily_time, meta, data, len(data), now, now)
+                 for key, hourly_time, daily_time, meta, data in rows])
+            evicted = self._evict()
+            self._db.commit()
+        return evicted
+
+    def delete(self, keys):
+        """Drop the given keys, so they are fetched again on the next request."""
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                self._db.execute(f"DELETE FROM days WHERE key IN ({','.join('?' * len(part))})", part)
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM days").fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM days ORDER BY accessed LIMIT 1000").fetchall()
+            if not rows:
+                break
+            drop = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                drop.append((key,))
+                total -= size
+            self._db.executemany("DELETE FROM days WHERE key = ?", drop)
+            evicted += len(drop)
+        return evicted
+
+    def size(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM days").fetchone()
+
+################################################################################
+# CACHING CLIENT
+################################################################################
+
+class CachedClient:
+    """
+    Wraps an openmeteo_requests.Client so requests are served from the cache
+    one day at a time.
+
+    weather_api() takes the same url and params as the real client and
+    returns one response-like object per site. Only the days missing from the
+    cache are requested, as one call covering every site that needs them.
+    Ensemble and multi-model requests go straight to the client (see UNCACHED).
+    A site whose cached days were fetched with another UTC offset than the
+    new ones has its whole range fetched again.
+    """
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'requests': 0, 'bytes_read': 0, 'bytes_written': 0, 'evictions': 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def _keys(self, endpoint, params, latitude, longitude, days):
+        request = {k: v for k, v in params.items() if k not in RANGE_PARAMS}
+        base = json.dumps([endpoint, round(float(latitude), 4), round(float(longitude), 4), request], sort_keys = True, default = str)
+        return [hashlib.sha1(f"{base}|{day}".encode()).hexdigest() for day in days]
+
+    def weather_api(self, url, params, **kwargs):
+        endpoint = endpoint_name(url)
+        # Several models give several responses per site, which the day rows cannot hold
+        if endpoint in UNCACHED or len(_as_list(params.get('models', []))) > 1:
+            self._count(requests = 1)
+            return self.client.weather_api(url, params = params, **kwargs)
+        start_date, end_date = request_range(params)
+        days = [d.strftime('%Y-%m-%d') for d in pd.date_range(start_date, end_date, freq = 'D')]
+        hourly_names = _as_list(params.get('hourly', []))
+        daily_names = _as_list(params.get('daily', []))
+        sites = list(zip(_as_list(params['latitude']), _as_list(params['longitude'])))
+        keys = [self._keys(endpoint, params, lat, lon, days) for lat, lon in sites]
+
+        found = self.cache.get(endpoint, [key for site_keys in keys for key in site_keys])
+        responses = [self._assemble(site_keys, found, len(hourly_names), len(daily_names)) for site_keys in keys]
+        hits = sum(key in found for site_keys in keys for key in site_keys)
+        self._count(hits = hits, misses = len(days) * len(sites) - hits)
+
+        # Fetch the span of missing days once for every site that is missing any
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if missing:
+            missing_days = [j for i in missing for j, key in enumerate(keys[i]) if key not in found]
+            first, last = (min(missing_days), max(missing_days)) if missing_days else (0, len(days) - 1)
+            found.update(self._fetch(url, params, kwargs, [sites[i] for i in missing], [keys[i] for i in missing],
+                                     days, first, last, hourly_names, daily_names))
+            for i in missing:
+                responses[i] = self._assemble(keys[i], found, len(hourly_names), len(daily_names))
+
+        # The new days came back with another UTC offset than the cached ones,
+        # e.g. across a DST change, so they do not line up. Those sites' whole
+        # range is fetched again, which always assembles.
+        stale = [i for i in missing if responses[i] is None]
+        if stale:
+            self.cache.delete([key for i in stale for key in keys[i]])
+            found.update(self._fetch(url, params, kwargs, [sites[i] for i in stale], [keys[i] for i in stale],
+                                     days, 0, len(days) - 1, hourly_names, daily_names))
+            for i in stale:
+                responses[i] = self._assemble(keys[i], found, len(hourly_names), len(daily_names))
+        return responses
+
+    def _fetch(self, url, params, kwargs, sites, keys, days, first, last, hourly_names, daily_names):
+        """Fetch days[first:last + 1] for the given sites in one call, cache them and return {key: row}."""
+        request = {k: v for k, v in params.items() if k not in ('past_days', 'forecast_days')}
+        request.update(latitude = [lat for lat, _ in sites], longitude = [lon for _, lon in sites],
+                       start_date = days[first], end_date = days[last])
+        fetched = self.client.weather_api(url, params = request, **kwargs)
+        self._count(requests = 1)
+
+        rows = []
+        for site_keys, response in zip(keys, fetched):
+            rows += self._split(response, site_keys[first:last + 1], hourly_names, daily_names)
+        self._count(bytes_written = sum(len(row[4]) for row in rows),
+                    evictions = self.cache.put(endpoint_name(url), rows))
+        return {row[0]: row[1:] for row in rows}
+
+    def forget(self, url, params):
+        """Drop the cached days a request covers, so the next request fetches them again."""
+        endpoint = endpoint_name(url)
+        start_date, end_date = request_range(params)
+        days = [d.strftime('%Y-%m-%d') for d in pd.date_range(start_date, end_date, freq = 'D')]
+        sites = zip(_as_list(params['latitude']), _as_list(params['longitude']))
+        self.cache.delete([key for lat, lon in sites for key in self._keys(endpoint, params, lat, lon, days)])
+
+    def _split(self, response, keys, hourly_names, daily_names):
+        """Cut a fetched response into one cache row per day."""
+        meta = json.dumps({'latitude': response.Latitude(), 'longitude': response.Longitude(),
+                           'elevation': response.Elevation(), 'utc_offset': response.UtcOffsetSeconds(),
+                           'timezone': (response.Timezone() or b'').decode(),
+                           'abbreviation': (response.TimezoneAbbreviation() or b'').decode()})
+        n = len(keys)
+        hourly_time = daily_time = 0
+        hourly = np.empty((len(hourly_names), n * 24), dtype = np.float32)
+        daily = np.empty((len(daily_names), n), dtype = np.float32)
+        if hourly_names:
+            section = response.Hourly()
+            hourly_time = section.Time()
+            for j in range(len(hourly_names)):
+                hourly[j] = section.Variables(j).ValuesAsNumpy()
+        if daily_names:
+            section = response.Daily()
+            daily_time = section.Time()
+            for j in range(len(daily_names)):
+                daily[j] = section.Variables(j).ValuesAsNumpy()
+
+        hourly = hourly.reshape(len(hourly_names), n, 24)
+        return [(key, hourly_time + k * 86400, daily_time + k * 86400, meta,
+                 np.concatenate([hourly[:, k].ravel(), daily[:, k]]).tobytes())
+                for k, key in enumerate(keys)]
+
+    def _assemble(self, keys, found, n_hourly, n_daily):
+        """Rebuild a site's response from cached days, or None if any day is missing or they do not line up."""
+        if not all(key in found for key in keys):
+            return None
+        rows = [found[key] for key in keys]
+        hourly_times = np.array([row[0] for row in rows], dtype = np.int64)
+        # Days cached from requests with a different UTC offset do not line up
+        if np.any(np.diff(hourly_times) != 86400):
+            return None
+
+        data = np.frombuffer(b''.join(row[3] for row in rows), dtype = np.float32).reshape(len(rows), -1)
+        self._count(bytes_read = data.nbytes)
+        hourly = data[:, :n_hourly * 24].reshape(len(rows), n_hourly, 24).transpose(1, 0, 2).reshape(n_hourly, -1)
+        daily = np.ascontiguousarray(data[:, n_hourly * 24:].T)
+        meta = json.loads(rows[0][2])
+        return CachedResponse(meta, ArraySection(rows[0][0], 3600, hourly), ArraySection(rows[0][1], 86400, daily))
+
+################################################################################
+# SHARED HANDLES
+################################################################################
+
+_shared = {}
+
+_shared_lock = threading.Lock()
+
+
+def api_client():
+    """
+    The process's open-meteo client: one requests session that retries on
+    error, created on first use. openmeteo_requests is only imported then.
+    """
+    import openmeteo_requests
+    from retry_requests import retry
+
+    with _shared_lock:
+        if 'client' not in _shared:
+            _shared['client'] = openmeteo_requests.Client(session = retry(retries = 5, backoff_factor = 0.2))
+        return _shared['client']
+
+
+def shared_client(path = '.weather_cache.sqlite'):
+    """
+    A CachedClient over api_client() and one WeatherCache per cache file,
+    both shared by every caller in the process. Each call gets its own
+    counters, so a stage's stats() only count its own requests.
+    """
+    client = api_client()
+    with _shared_lock:
+        if path not in _shared:
+            _shared[path] = WeatherCache(path)
+        return CachedClient(client, _shared[path])
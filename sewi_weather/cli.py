@@ -0,0 +1,190 @@
+"""
+SEWI-WEATHER COMMAND
+
+One entry point for scheduled and manual runs, installed as 'sewi-weather'
+(or run as 'python -m sewi_weather'):
+
+    sewi-weather run                    every stage that is due (as the combiner script)
+    sewi-weather fetch [STAGE ...]      only the gatherers: historical, ytd, prediction, ensemble
+    sewi-weather combine                only validate, features, climatology, skill and combine
+    sewi-weather status                 which stages are current and which are due
+    sewi-weather poll                   the intraday forecast poller
+    sewi-weather serve                  the query API over the combined data
+    sewi-weather grid                   regional series from a grid over a bounding box
+
+-C FOLDER runs in the folder holding locations.csv and the saved data,
+like starting the scripts from there. The gatherers run from the package
+(see gather.py), so the folder needs no copies of the scripts.
+
+Each command imports only what it uses. Parsing the arguments and checking
+the stage fingerprints needs nothing beyond the standard library, so a
+cron job that runs every minute and finds nothing due adds about 50 ms to
+the interpreter's own start-up; pandas, pyarrow and the HTTP client are
+loaded by the stages that run. Stages run in one process share one HTTP session and
+cache connection (see cache.shared_client).
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import argparse
+import os
+import sys
+
+################################################################################
+# COMMANDS
+################################################################################
+
+def _run_stages(args, only = None):
+    from sewi_weather import profile
+    from sewi_weather.pipeline import format_report, run_stages
+    from sewi_weather.stages import pipeline_stages
+
+    report = run_stages(pipeline_stages('', args.first_year), '.pipeline_state.json',
+                        max_workers = args.max_workers, force = args.force, only = only)
+    print(format_report(report))
+    if any(row['status'] != 'skipped' for row in report):
+        profile.finish()
+    return 1 if any(row['status'] in ('failed', 'blocked') for row in report) else 0
+
+
+def run(args):
+    return _run_stages(args)
+
+
+def fetch(args):
+    from sewi_weather.stages import FETCH_STAGES
+
+    unknown = sorted(set(args.stages) - set(FETCH_STAGES))
+    if unknown:
+        raise SystemExit(f"Unknown stages {unknown}; choose from {FETCH_STAGES}")
+    return _run_stages(args, only = args.stages or FETCH_STAGES)
+
+
+def combine(args):
+    from sewi_weather.stages import COMBINE_STAGES
+
+    return _run_stages(args, only = COMBINE_STAGES)
+
+
+def status(args):
+    from sewi_weather.pipeline import format_report, plan
+    from sewi_weather.stages import pipeline_stages
+
+    print(format_report(plan(pipeline_stages('', args.first_year))))
+    return 0
+
+
+def poll(args):
+    import asyncio
+
+    from sewi_weather.cache import CachedClient, WeatherCache, api_client
+    from sewi_weather.locations import load_locations
+    from sewi_weather.poller import ForecastPoller
+
+    # Forecast days expire at once, so every poll sees the latest model run
+    client = CachedClient(api_client(), WeatherCache('.weather_cache.sqlite', ttl = {'forecast': 0}))
+    poller = ForecastPoller(client, load_locations(), interval = args.interval,
+                            batch_size = args.batch_size, first_year = args.first_year)
+    try:
+        asyncio.run(poller.run(args.polls))
+    except KeyboardInterrupt:
+        print("Forecast poller stopped")
+    return 0
+
+
+def serve(args):
+    from sewi_weather.query import WeatherQuery, make_server
+
+    query = WeatherQuery()
+    try:
+        info = query.info()
+        print(f"Serving {info['rows']} rows for {len(info['locations'])} locations "
+              f"({info['first_date']} to {info['last_date']}) on http://{args.host}:{args.port}/weather")
+    except FileNotFoundError as error:
+        print(f"{error}. Serving on http://{args.host}:{args.port}/weather, with 503 until it is saved")
+
+    server = make_server(query, args.host, args.port, verbose = args.verbose)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Query API stopped")
+    finally:
+        server.server_close()
+    return 0
+
+
+def grid(args):
+    from sewi_weather import profile
+    from sewi_weather.grid import COUNTIES, update_grid
+
+    df = update_grid(bounds = tuple(args.bounds), resolution = args.resolution, start_date = args.start_date,
+                     end_date = args.end_date, batch_size = args.batch_size, max_workers = args.max_workers,
+                     counties = None if args.no_counties else COUNTIES)
+    print(f"Saved {df['date'].nunique()} days for {df['region'].nunique()} regions")
+    profile.finish()
+    return 0
+
+################################################################################
+# ARGUMENTS
+################################################################################
+
+def parser():
+    """The argument parser of the sewi-weather command."""
+    main_parser = argparse.ArgumentParser(prog = 'sewi-weather', description = "Southeast Wisconsin weather data pipeline")
+    main_parser.add_argument('-C', '--folder', default = '.', help = "folder with locations.csv and the data (default: current)")
+    commands = main_parser.add_subparsers(dest = 'command', required = True)
+
+    def add(name, function, help, first_year = True):
+        command = commands.add_parser(name, help = help, description = help)
+        command.set_defaults(function = function)
+        if first_year:
+            command.add_argument('--first-year', type = int, default = 1940, help = "first year of history (default: 1940)")
+        return command
+
+    def add_run_options(command):
+        command.add_argument('--force', action = 'store_true', help = "run the stages even when their inputs are unchanged")
+        command.add_argument('--max-workers', type = int, default = 3, help = "stages that may run at the same time (default: 3)")
+
+    add_run_options(add('run', run, "run every pipeline stage that is due"))
+
+    command = add('fetch', fetch, "run the gatherer stages that are due")
+    command.add_argument('stages', nargs = '*', metavar = 'STAGE', help = "historical, ytd, prediction or ensemble (default: all four)")
+    add_run_options(command)
+
+    add_run_options(add('combine', combine, "run the validate, features, climatology, skill and combine stages that are due"))
+
+    add('status', status, "list which stages are current and which are due")
+
+    command = add('poll', poll, "poll the forecast and refresh the prediction rows when it changes")
+    command.add_argument('--interval', type = float, default = 900, help = "seconds between polls (default: 900)")
+    command.add_argument('--polls', type = int, default = None, help = "polls before stopping (default: until stopped)")
+    command.add_argument('--batch-size', type = int, default = 50, help = "sites per API request (default: 50)")
+
+    command = add('serve', serve, "serve slices of the combined data over HTTP", first_year = False)
+    command.add_argument('--host', default = '127.0.0.1', help = "address to listen on (default: 127.0.0.1)")
+    command.add_argument('--port', type = int, default = 8765, help = "port to listen on (default: 8765)")
+    command.add_argument('--verbose', action = 'store_true', help = "log every request")
+
+    command = add('grid', grid, "fetch a grid over a bounding box and save area-weighted regional series", first_year = False)
+    command.add_argument('--bounds', type = float, nargs = 4, default = [42.49, 43.54, -89.01, -87.79],
+                         metavar = ('SOUTH', 'NORTH', 'WEST', 'EAST'), help = "bounding box in degrees (default: Southeast Wisconsin)")
+    command.add_argument('--resolution', type = float, default = 0.1, help = "cell size in degrees (default: 0.1)")
+    command.add_argument('--start-date', help = "first day, YYYY-MM-DD (default: January 1)")
+    command.add_argument('--end-date', help = "last day, YYYY-MM-DD (default: three days ago)")
+    command.add_argument('--batch-size', type = int, default = 50, help = "cells per API request (default: 50)")
+    command.add_argument('--max-workers', type = int, default = 4, help = "requests in flight at once (default: 4)")
+    command.add_argument('--no-counties', action = 'store_true', help = "only the series over the whole grid")
+    return main_parser
+
+
+def main(argv = None):
+    """Run the sewi-weather command; returns the exit code."""
+    args = parser().parse_args(argv)
+    os.chdir(args.folder)
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+DAY-OF-YEAR CLIMATOLOGY
+
+A small side table with, for every site and day of the year, the mean,
+standard deviation and 10th/50th/90th percentiles of air and soil
+temperature, precipitation and the rolling features over all closed years.
+The dashboard joins it on location and day_of_year (or month and day) to
+tell whether this spring is running early or late, instead of scanning the
+whole history.
+
+Days are numbered as in a leap year, so March 1 is always day 61 and
+February 29 has a day of its own. Each site and day gets one row of a
+matrix with a slot per year, and every statistic is computed across those
+rows at once, so there is no Python loop over groups.
+
+The matrix is saved between runs (store.CLIMATOLOGY_STATE), so once a year
+closes only that year is read from the store and added to it.
+Percentiles interpolate linearly and the standard deviation uses n - 1, as
+in pandas.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.store import CLIMATOLOGY_FILE, CLIMATOLOGY_STATE
+from sewi_weather.features import WINDOWS
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+CLIMATOLOGY_COLUMNS = (['temperature_2m_mean', 'temperature_2m_max', 'temperature_2m_min',
+                        'soil_temperature_0_to_7cm_mean', 'soil_temperature_7_to_28cm_mean',
+                        'soil_temperature_28_to_100cm_mean', 'soil_temperature_100_to_255cm_mean',
+                        'precipitation_sum']
+                       + [name for name, _, _, _ in WINDOWS])
+
+PERCENTILES = [10, 50, 90]
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def day_of_year(dates):
+    """Day of the year numbered as in a leap year (1-366)."""
+    dates = pd.DatetimeIndex(dates)
+    return dates.dayofyear.to_numpy() + ((~dates.is_leap_year) & (dates.month > 2))
+
+
+def year_matrix(df, columns = CLIMATOLOGY_COLUMNS):
+    """
+    The rows of df as (names, years, values, present): the sorted location
+    names and years, a (location x day of the year x year x column) float32
+    array of the columns, NaN where there is no value, and a (location x
+    day x year) mask of the rows that are there.
+    """
+    codes, names = pd.factorize(df['location'])
+    # Sorted by name rather than category order, so matrices of different years line up
+    names = np.asarray(names).astype(str)
+    order = np.argsort(names, kind = 'stable')
+    codes = np.argsort(order)[codes]
+    names = names[order]
+    dates = pd.DatetimeIndex(df['date'])
+    years, year_slot = np.unique(dates.year, return_inverse = True)
+    day = day_of_year(dates) - 1
+    values = np.full((len(names), 366, len(years), len(columns)), np.nan, dtype = np.float32)
+    values[codes, day, year_slot] = df[list(columns)].to_numpy(dtype = np.float32)
+    present = np.zeros(values.shape[:3], dtype = bool)
+    present[codes, day, year_slot] = True
+    return names.tolist(), years, values, present
+
+
+def climatology_table(names, values, present, columns = CLIMATOLOGY_COLUMNS, percentiles = PERCENTILES):
+    """
+    One row per location and day of the year with '<column>_mean', '_std' and
+    '_p10'/'_p50'/'_p90' columns, plus 'years', the number of rows behind it,
+    from the arrays of year_matrix. Missing values are left out of every
+    statistic.
+    """
+    sites, days, n_years = present.shape
+    count = present.reshape(sites * days, n_years).sum(axis = 1)
+    rows = np.flatnonzero(count > 0)
+
+    reference = pd.Timestamp('2000-01-01') + pd.to_timedelta(rows % 366, unit = 'D')
+    out = {'location': np.asarray(names, dtype = object)[rows // 366], 'day_of_year': rows % 366 + 1,
+           'month': reference.month, 'day': reference.day, 'years': count[rows]}
+
+    # Every site and day is one row of a (groups x years) matrix; missing slots stay NaN
+    groups = np.arange(len(rows))
+    for j, column in enumerate(columns):
+        # Sorting each row puts its NaNs at the end
+        matrix = values[..., j].reshape(sites * days, n_years)[rows].astype(np.float64)
+        matrix.sort(axis = 1)
+        n = np.count_nonzero(~np.isnan(matrix), axis = 1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = np.nansum(matrix, axis = 1) / n
+            out[column + '_mean'] = mean
+            out[column + '_std'] = np.sqrt(np.nansum((matrix - mean[:, None]) ** 2, axis = 1) / (n - 1))
+        last = np.maximum(n - 1, 0)
+        for q in percentiles:
+            # Linear interpolation between the two nearest ranks of each row
+            rank = q / 100 * last
+            low = np.floor(rank).astype(np.int64)
+            lower = matrix[groups, low] if n_years else np.full(len(rows), np.nan)
+            upper = matrix[groups, np.minimum(low + 1, last)] if n_years else lower
+            out[f"{column}_p{q}"] = np.where(n > 0, lower + (rank - low) * (upper - lower), np.nan)
+
+    table = pd.DataFrame(out)
+    stats = [c for c in table.columns if c not in ('location', 'day_of_year', 'month', 'day', 'years')]
+    table[stats] = table[stats].astype(np.float32)
+    return table
+
+
+def build_climatology(df, columns = CLIMATOLOGY_COLUMNS, percentiles = PERCENTILES):
+    """The climatology_table of every row of a daily frame."""
+    names, _, values, present = year_matrix(df, columns)
+    return climatology_table(names, values, present, columns, percentiles)
+
+################################################################################
+# INCREMENTAL UPDATE
+################################################################################
+
+def load_state(path, columns = CLIMATOLOGY_COLUMNS):
+    """
+    The (names, years, versions, values, present) saved by save_state, or
+    None if there is none or it holds other columns.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        if saved['columns'].tolist() != list(columns):
+            return None
+        return (saved['names'].tolist(), saved['years'], saved['versions'].tolist(),
+                saved['values'], saved['present'])
+
+
+def save_state(path, names, years, versions, values, present, columns = CLIMATOLOGY_COLUMNS):
+    """Save the year matrix with the store version of each of its years as one .npz file."""
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, names = np.array(names, dtype = str), years = np.asarray(years, dtype = np.int64),
+                 versions = np.array(versions, dtype = str), columns = np.array(columns),
+                 values = values, present = present)
+    os.replace(path + '.tmp', path)
+
+
+def merge_years(old, new):
+    """
+    Join two (names, years, values, present) year matrices into one over the
+    union of their sites and years, sorted. Years in both come from new.
+    """
+    names = sorted(set(old[0]) | set(new[0]))
+    years = np.union1d(old[1], new[1]).astype(np.int64)
+    values = np.full((len(names), 366, len(years), old[2].shape[3]), np.nan, dtype = np.float32)
+    present = np.zeros(values.shape[:3], dtype = bool)
+    for part_names, part_years, part_values, part_present in (old, new):
+        site = np.searchsorted(names, part_names)[:, None]
+        slot = np.searchsorted(years, part_years)[None, :]
+        values[site, :, slot] = part_values.transpose(0, 2, 1, 3)
+        present[site, :, slot] = part_present.transpose(0, 2, 1)
+    return names, years, values, present
+
+
+def update_climatology(filepath = '', columns = CLIMATOLOGY_COLUMNS):
+    """
+    Save the climatology of every closed year in the store as a CSV next to
+    the combined data. Returns the table.
+
+    The values behind it are kept by site, day of the year and year in
+    store.CLIMATOLOGY_STATE, with the store version of each year. Only the
+    years that closed or were rewritten since the last run are read and
+    folded in; the statistics are then taken over the saved matrix.
+    """
+    windows = [name for name, _, _, _ in WINDOWS]
+    base = [column for column in columns if column not in windows]
+    feature_versions = store.year_versions('Features', filepath)
+    versions = {year: version + feature_versions.get(year, '')
+                for year, version in store.year_versions('Historical', filepath).items()}
+
+    state_path = filepath + CLIMATOLOGY_STATE
+    state = load_state(state_path, columns)
+    if state is None:
+        state = ([], np.array([], dtype = np.int64), [], np.empty((0, 366, 0, len(columns)), dtype = np.float32),
+                 np.empty((0, 366, 0), dtype = bool))
+    names, years, saved_versions, values, present = state
+
+    # Years that are gone or were rewritten are dropped, then new and rewritten years are read
+    keep = np.array([versions.get(int(year)) == version for year, version in zip(years, saved_versions)], dtype = bool)
+    todo = sorted(set(versions) - set(years[keep].tolist()))
+    matrix = (names, years[keep], values[:, :, keep], present[:, :, keep])
+    if todo:
+        df = store.read('Historical', filepath, columns = ['location'] + base, years = todo)
+        features = store.read('Features', filepath, columns = ['location'] + [c for c in columns if c in windows], years = todo)
+        df = pd.merge(df, features, on = ['location', 'date'], how = 'left')
+        matrix = merge_years(matrix, year_matrix(df, columns))
+    if todo or not keep.all():
+        names, years, values, present = matrix
+        save_state(state_path, names, years, [versions[int(year)] for year in years], values, present, columns)
+
+    table = climatology_table(matrix[0], matrix[2], matrix[3], columns)
+    table.to_csv(filepath + CLIMATOLOGY_FILE, index = False)
+    return table
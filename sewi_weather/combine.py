@@ -0,0 +1,154 @@
+"""
+COMBINING THE DATA SOURCES
+
+The historical, YTD and prediction data sets meet at seams (December 31 and
+a few days before today) where their dates can overlap or leave a gap. The
+combined frame keeps one row per location and date, taking each date from
+the highest priority source that has it, and is sorted by location and date.
+
+The combined frame is kept in a compact schema: labels (location, data
+source, weather description, relative date) are categoricals, WMO weather
+codes are int8 and looked up in a table instead of mapped row by row,
+measurements are float32 and dates datetime64.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import profile
+from sewi_weather.aggregate import day_number
+from sewi_weather.features import rolling_features
+from sewi_weather.store import COMBINED_FILE
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Measured data wins over forecasts where sources overlap
+SOURCE_PRIORITY = ['Historical', 'YTD', 'Prediction']
+
+# WMO weather interpretation codes
+WMO_CODES = {0 : 'Clear sky', 1 : 'Mainly clear', 2 : 'Partly cloudy', 3 : 'Overcast', 45 : 'Fog', 48 : 'Depositing rime fog',
+    51 : 'Drizzle: Light', 53 : 'Drizzle: Moderate', 55 : 'Drizzle: Dense intensity', 56 : 'Freezing Drizzle: Light',
+    57 : 'Freezing Drizzle: Dense intensity', 61 : 'Rain: Slight', 63 : 'Rain: Moderate', 65 : 'Rain: Heavy intensity',
+    66 : 'Freezing Rain: Light', 67 : 'Freezing Rain: Heavy intensity', 71 : 'Snow fall: Slight', 73 : 'Snow fall: Moderate',
+    75 : 'Snow fall: Heavy intensity', 77 : 'Snow grains', 80 : 'Rain showers: Slight', 81 : 'Rain showers: Moderate',
+    82 : 'Rain showers: Violent', 85 : 'Snow showers slight', 86 : 'Snow showers heavy', 95 : 'Thunderstorm: Slight or moderate',
+    96 : 'Thunderstorm with slight hail', 99 : 'Thunderstorm with heavy hail'}
+
+# Category number of every code from 0 to 99, -1 where the code has no label
+WMO_LOOKUP = np.full(100, -1, dtype = np.int8)
+WMO_LOOKUP[list(WMO_CODES)] = np.arange(len(WMO_CODES))
+
+RELATIVE_DATES = ['Historical', 'Current date', 'Prediction', 'Unknown']
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def combine_sources(frames, priority = SOURCE_PRIORITY, source_column = 'Data Source'):
+    """
+    Stack the frames and keep one row per location and date.
+
+    frames maps each source name in priority to its data frame. The source
+    name is added as source_column. Where sources share a date, the row from
+    the source listed first in priority is kept. Rows come back sorted by
+    location and date with a fresh index, and source_column is a
+    categorical.
+    """
+    present = [source for source in priority if source in frames]
+    parts = [frames[source] for source in present]
+    df = pd.concat(parts, ignore_index = True)
+    rank = np.repeat(np.arange(len(parts)), [len(part) for part in parts])
+
+    codes, _ = pd.factorize(df['location'], sort = True)
+    order = np.lexsort((rank, day_number(df['date']), codes))
+    keys = np.stack([codes[order], day_number(df['date'])[order]])
+    first = np.ones(len(order), dtype = bool)
+    first[1:] = np.any(keys[:, 1:] != keys[:, :-1], axis = 0)
+    df = df.take(order[first]).reset_index(drop = True)
+    # Placed after the first frame's columns, where a column added to each frame would land
+    df.insert(len(parts[0].columns), source_column, pd.Categorical.from_codes(rank[order[first]], categories = present))
+    return df
+
+
+def find_gaps(df):
+    """
+    Missing dates inside each location's range, as a frame of location, first
+    missing date and number of missing days.
+    """
+    days = day_number(df['date'])
+    codes, names = pd.factorize(df['location'], sort = True)
+    order = np.lexsort((days, codes))
+    days, codes = days[order], codes[order]
+    step = np.diff(days)
+    gap = np.flatnonzero((step > 1) & (codes[1:] == codes[:-1]))
+    return pd.DataFrame({'location': np.asarray(names)[codes[gap]],
+                         'first_missing': (days[gap] + 1).astype('datetime64[D]'),
+                         'days': step[gap] - 1})
+
+
+def weather_code_category(codes):
+    """WMO descriptions of weather codes as a categorical; NaN for missing or unknown codes."""
+    codes = pd.array(codes).astype('Int16').to_numpy(dtype = np.int16, na_value = -1)
+    known = (codes >= 0) & (codes < len(WMO_LOOKUP))
+    lookup = np.where(known, WMO_LOOKUP[np.where(known, codes, 0)], -1)
+    return pd.Categorical.from_codes(lookup, categories = list(WMO_CODES.values()))
+
+
+def relative_date(dates, today):
+    """'Historical', 'Current date' or 'Prediction' for each date relative to today, as a categorical."""
+    dates = np.asarray(dates).astype('datetime64[D]')
+    offset = np.sign((dates - np.datetime64(today, 'D')).astype(np.int64)) + 1
+    return pd.Categorical.from_codes(np.where(np.isnat(dates), 3, offset), categories = RELATIVE_DATES)
+
+
+def compact(df):
+    """
+    Cast the combined frame to its compact schema in place and return it:
+    categorical locations, nullable int8 weather codes, int8 month, int16
+    year and float32 measurements.
+    """
+    df['location'] = df['location'].astype('category')
+    if 'weather_code' in df.columns:
+        df['weather_code'] = df['weather_code'].astype('Int8')
+    if 'month' in df.columns:
+        df['month'] = df['month'].astype(np.int8)
+    if 'year' in df.columns:
+        df['year'] = df['year'].astype(np.int16)
+    floats = df.select_dtypes(include = 'float64').columns
+    df[floats] = df[floats].astype(np.float32)
+    return df
+
+
+def combined_frame(hist_df, ytd_df, pred_df, hist_features, tail):
+    """
+    The combined frame as the combiner saves it, except for relative_date,
+    which depends on the day it is written.
+
+    Rows come from combine_sources in the compact schema, with weather
+    descriptions and the rolling features: historical rows take theirs from
+    hist_features (the stored 'Features') and YTD and prediction rows are
+    computed on top of tail (the stored 'Feature State'). Returns (df, gaps),
+    with gaps from find_gaps.
+    """
+    with profile.stage('merge') as stage:
+        df = combine_sources({'Historical': hist_df, 'YTD': ytd_df, 'Prediction': pred_df})
+        gaps = find_gaps(df)
+        stage['rows'] = len(df)
+        stage['missing_days'] = int(gaps['days'].sum())
+
+    compact(df)
+    df['weather_code_category'] = weather_code_category(df['weather_code'])
+
+    with profile.stage('rolling_features', rows = len(df)):
+        is_hist = (df['Data Source'] == 'Historical').to_numpy()
+        hist_features = pd.merge(df.loc[is_hist, ['location', 'date']], hist_features, on = ['location', 'date'], how = 'left')
+        hist_features.index = df.index[is_hist]
+        recent_features, _ = rolling_features(df[~is_hist], tail = tail)
+        df = df.join(pd.concat([hist_features[recent_features.columns], recent_features]).astype(np.float32))
+    return df, gaps
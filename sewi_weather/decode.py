@@ -0,0 +1,67 @@
+"""
+DECODING OPEN-METEO RESPONSES
+
+Turns the hourly or daily section of a response into a data frame using the
+list of variables that was requested, instead of hand-indexed Variables(i)
+calls. The values are copied once into a preallocated 2-D float32 block,
+which then backs the data frame without another copy.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import numpy as np
+import pandas as pd
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def section_times(section):
+    """Unix timestamps (seconds) of every row in a section."""
+    return np.arange(section.Time(), section.TimeEnd(), section.Interval(), dtype = np.int64)
+
+
+def decode_block(section, variables, columns = None):
+    """
+    Copy a section's values into a (columns x rows) float32 block.
+
+    variables is the list sent in the request, in the same order, which is
+    how the API orders the response. columns picks which of them to keep and
+    in what order; it defaults to all of them. A stitched section (see
+    fetch.stitch) is filled chunk by chunk without joining the chunks first.
+    """
+    columns = list(variables) if columns is None else list(columns)
+    positions = [variables.index(column) for column in columns]
+    times = section_times(section)
+
+    block = np.empty((len(columns), len(times)), dtype = np.float32)
+    start = 0
+    for part in getattr(section, 'sections', [section]):
+        rows = (part.TimeEnd() - part.Time()) // part.Interval()
+        for row, position in enumerate(positions):
+            values = part.Variables(position).ValuesAsNumpy()
+            if len(values) != rows:
+                raise ValueError(f"{columns[row]} has {len(values)} values, expected {rows}")
+            block[row, start:start + rows] = values
+        start += rows
+    return times, block
+
+
+def decode_frame(section, variables, columns = None):
+    """
+    Decode a section into a data frame with a 'date' column followed by columns.
+
+    The frame's measurement columns are a view of the block from decode_block.
+    """
+    columns = list(variables) if columns is None else list(columns)
+    times, block = decode_block(section, variables, columns)
+    return block_frame(times, block, columns)
+
+
+def block_frame(times, block, columns):
+    """A data frame with a 'date' column followed by the rows of block, without copying block."""
+    df = pd.DataFrame(block.T, columns = columns, copy = False)
+    df.insert(0, 'date', pd.to_datetime(times, unit = 's'))
+    return df
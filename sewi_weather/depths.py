@@ -0,0 +1,102 @@
+"""
+SOIL DEPTH HARMONIZATION
+
+The archive reports soil temperature and moisture as averages over the
+layers 0-7, 7-28, 28-100 and 100-255 cm. The forecast reports temperature at
+the points 0, 6, 18 and 54 cm and moisture over the layers 0-1, 1-3, 3-9,
+9-27 and 27-81 cm. This maps the forecast onto the archive's layers so the
+prediction rows get the same soil columns as the historical and YTD rows.
+
+- Temperature is interpolated linearly between the forecast depths and
+  averaged over each archive layer.
+- Moisture is averaged over the forecast layers, weighted by how much of
+  each archive layer they overlap.
+
+Below the deepest forecast depth the deepest value is carried down, so the
+100-255 cm layer is an estimate. Both mappings are linear, so each layer is
+a weighted sum of the forecast columns, computed for every row at once.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import numpy as np
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Archive layers as (top, bottom) in cm
+ARCHIVE_LAYERS = [(0, 7), (7, 28), (28, 100), (100, 255)]
+
+# Forecast soil temperature columns and their depth in cm
+FORECAST_TEMPERATURE_DEPTHS = {'soil_temperature_0cm': 0, 'soil_temperature_6cm': 6,
+                               'soil_temperature_18cm': 18, 'soil_temperature_54cm': 54}
+
+# Forecast soil moisture columns and their (top, bottom) layer in cm
+FORECAST_MOISTURE_LAYERS = {'soil_moisture_0_to_1cm': (0, 1), 'soil_moisture_1_to_3cm': (1, 3),
+                            'soil_moisture_3_to_9cm': (3, 9), 'soil_moisture_9_to_27cm': (9, 27),
+                            'soil_moisture_27_to_81cm': (27, 81)}
+
+################################################################################
+# WEIGHTS
+################################################################################
+
+def layer_columns(prefix, layers = ARCHIVE_LAYERS):
+    """Archive column names, e.g. 'soil_temperature_0_to_7cm'."""
+    return [f"{prefix}_{top}_to_{bottom}cm" for top, bottom in layers]
+
+
+def point_weights(depths, layers = ARCHIVE_LAYERS):
+    """
+    (layers x depths) weights giving each layer's mean of the profile drawn
+    through values at depths, linear between depths and flat beyond them.
+    """
+    depths = np.asarray(depths, dtype = np.float64)
+    weights = np.zeros((len(layers), len(depths)))
+    for i, (top, bottom) in enumerate(layers):
+        # The profile is linear between these points, so the trapezoid rule is exact
+        x = np.unique(np.concatenate([[top, bottom], depths[(depths > top) & (depths < bottom)]]))
+        for j in range(len(depths)):
+            y = np.interp(x, depths, np.eye(len(depths))[j])
+            weights[i, j] = np.sum((y[1:] + y[:-1]) / 2 * np.diff(x)) / (bottom - top)
+    return weights
+
+
+def overlap_weights(source_layers, layers = ARCHIVE_LAYERS):
+    """
+    (layers x source layers) weights giving each layer's thickness-weighted
+    mean of the source layers, with the deepest source layer extended down.
+    """
+    tops = np.array([top for top, _ in source_layers], dtype = np.float64)
+    bottoms = np.array([bottom for _, bottom in source_layers], dtype = np.float64)
+    bottoms[np.argmax(bottoms)] = max(bottom for _, bottom in layers)
+    weights = np.zeros((len(layers), len(source_layers)))
+    for i, (top, bottom) in enumerate(layers):
+        weights[i] = np.clip(np.minimum(bottoms, bottom) - np.maximum(tops, top), 0, None) / (bottom - top)
+    return weights
+
+################################################################################
+# HARMONIZE
+################################################################################
+
+def harmonize_soil(df, temperature_depths = FORECAST_TEMPERATURE_DEPTHS,
+                   moisture_layers = FORECAST_MOISTURE_LAYERS, layers = ARCHIVE_LAYERS):
+    """
+    Add the archive's soil_temperature_* and soil_moisture_* layer columns to
+    a frame holding the forecast depth columns. A layer is NaN where any
+    depth it draws on is missing.
+    """
+    for prefix, columns, weights in (
+            ('soil_temperature', list(temperature_depths), point_weights(list(temperature_depths.values()), layers)),
+            ('soil_moisture', list(moisture_layers), overlap_weights(list(moisture_layers.values()), layers))):
+        values = df[columns].to_numpy(dtype = np.float32)
+        # Depths a layer does not use must not spread their NaNs into it
+        used = weights != 0
+        harmonized = np.full((len(df), len(layers)), np.nan, dtype = np.float32)
+        for i in range(len(layers)):
+            harmonized[:, i] = values[:, used[i]] @ weights[i, used[i]].astype(np.float32)
+        for name, column in zip(layer_columns(prefix, layers), harmonized.T):
+            df[name] = column
+    return df
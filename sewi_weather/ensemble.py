@@ -0,0 +1,253 @@
+"""
+ENSEMBLE FORECAST SPREAD
+
+The prediction gatherer takes one forecast model, which says nothing about
+how sure the forecast is. This fetches the members of several ensemble
+models for every site in one request per batch of sites and reduces them
+to daily statistics across the members: the ensemble mean, its spread
+(standard deviation), the lowest and highest member, and the share of
+members that cross the frost and soil temperature thresholds.
+
+Each response holds one model's members for one site, tagged with the
+site's LocationId and each variable's EnsembleMember. Members are decoded
+a chunk at a time into a (members x variables x hours) block, reduced to
+a (members x days x statistics) array of local days, and pushed into a
+SpreadReducer that keeps only running counts, sums, sums of squares,
+lows, highs and threshold hits per day. Memory depends on the chunk size
+and the number of days, not on how many members or models are requested.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import re
+
+import numpy as np
+import pandas as pd
+from openmeteo_sdk.Variable import Variable
+
+from sewi_weather import profile, store
+from sewi_weather.aggregate import run_starts
+from sewi_weather.cache import shared_client
+from sewi_weather.decode import section_times
+from sewi_weather.locations import batch_params, batches, load_locations, stack_locations
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+ENSEMBLE_URL = "https://ensemble-api.open-meteo.com/v1/ensemble"
+
+# Ensemble models and their members, control run included
+MODELS = {'icon_seamless': 40, 'gfs_seamless': 31, 'ecmwf_ifs025': 51}
+
+# Only some models have soil temperature; members without it are left out
+# of the soil statistics instead of counting as below the threshold
+HOURLY_VARIABLES = ["temperature_2m", "soil_temperature_0_to_10cm"]
+
+# Daily statistics of each member, as (hourly variable, 'mean', 'min' or 'max')
+STATISTICS = [('temperature_2m', 'min'), ('temperature_2m', 'mean'), ('temperature_2m', 'max'),
+              ('soil_temperature_0_to_10cm', 'mean')]
+
+COLUMNS = [f"{variable}_{how}" for variable, how in STATISTICS]
+
+# (name, statistic, 'above' or 'at_or_below', threshold in °F), as in events.EVENTS
+PROBABILITIES = [
+    ('frost', 'temperature_2m_min', 'at_or_below', 32),
+    ('soil_above_50F', 'soil_temperature_0_to_10cm_mean', 'above', 50),
+    ('soil_above_60F', 'soil_temperature_0_to_10cm_mean', 'above', 60),
+]
+
+PARAMS = {
+	"hourly": HOURLY_VARIABLES,
+	"models": list(MODELS),
+	"temperature_unit": "fahrenheit",
+	"timezone": "America/Chicago",
+	"forecast_days": 16
+}
+
+################################################################################
+# DECODING
+################################################################################
+
+def variable_key(name):
+    """
+    (Variable, altitude, depth, depth_to) the API tags a variable's values
+    with, from its name, e.g. 'temperature_2m' or 'soil_temperature_0_to_10cm'.
+    """
+    match = re.fullmatch(r'(\w+?)_(\d+)m', name)
+    if match:
+        return getattr(Variable, match[1]), int(match[2]), 0, 0
+    match = re.fullmatch(r'(\w+?)_(\d+)_to_(\d+)cm', name)
+    if match:
+        return getattr(Variable, match[1]), 0, int(match[2]), int(match[3])
+    return getattr(Variable, name), 0, 0, 0
+
+
+def decode_members(section, variables, member_chunk = 64):
+    """
+    Yield (times, block) for every chunk of member_chunk members, with block
+    a (members x variables x hours) float32 array. Variables a member does
+    not have are NaN.
+    """
+    keys = {variable_key(name): i for i, name in enumerate(variables)}
+    times = section_times(section)
+    entries = []
+    for k in range(section.VariablesLength()):
+        variable = section.Variables(k)
+        i = keys.get((variable.Variable(), variable.Altitude(), variable.Depth(), variable.DepthTo()))
+        if i is not None:
+            entries.append((variable.EnsembleMember(), i, k))
+    if not entries:
+        return
+    entries.sort()
+    members = entries[-1][0] + 1
+
+    block, first = None, 0
+    for member, i, k in entries:
+        if block is None or member >= first + len(block):
+            if block is not None:
+                yield times, block
+            first = member - member % member_chunk
+            block = np.full((min(member_chunk, members - first), len(variables), len(times)), np.nan, dtype = np.float32)
+        block[member - first, i] = section.Variables(k).ValuesAsNumpy()
+    yield times, block
+
+
+def member_days(times, block, utc_offset, variables = HOURLY_VARIABLES, statistics = STATISTICS):
+    """
+    Local day numbers and a (members x days x statistics) float32 array of
+    each member's daily statistics, from a block of decode_members.
+    """
+    days = ((times + utc_offset) // 86400).astype(np.int32)
+    starts = run_starts(days)
+    valid = ~np.isnan(block)
+    counts = np.add.reduceat(valid, starts, axis = 2, dtype = np.int32)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        reduced = {'mean': np.add.reduceat(np.where(valid, block, 0), starts, axis = 2, dtype = np.float64) / counts,
+                   'min': np.fmin.reduceat(block, starts, axis = 2),
+                   'max': np.fmax.reduceat(block, starts, axis = 2)}
+    values = np.stack([reduced[how][:, variables.index(variable)] for variable, how in statistics], axis = 2)
+    return days[starts], values.astype(np.float32)
+
+################################################################################
+# REDUCER
+################################################################################
+
+class SpreadReducer:
+    """
+    Daily ensemble mean, spread, low, high and threshold probabilities over
+    members pushed a chunk at a time.
+
+    push() takes day numbers and a (members x days x columns) array as
+    member_days returns; chunks may cover different days. Members without a
+    value for a day and column are left out of its statistics.
+    """
+
+    def __init__(self, columns = COLUMNS, probabilities = PROBABILITIES):
+        self.columns = list(columns)
+        self.probabilities = list(probabilities)
+        self._positions = np.array([self.columns.index(column) for _, column, _, _ in self.probabilities], dtype = np.intp)
+        self._above = np.array([how == 'above' for _, _, how, _ in self.probabilities])
+        self._limits = np.array([limit for _, _, _, limit in self.probabilities], dtype = np.float32)
+        self.days = np.empty(0, dtype = np.int32)
+        self._state = self._empty(0)
+
+    def _empty(self, n_days):
+        shape = (n_days, len(self.columns))
+        return {'count': np.zeros(shape, dtype = np.int32), 'sum': np.zeros(shape), 'squares': np.zeros(shape),
+                'low': np.full(shape, np.nan, dtype = np.float32), 'high': np.full(shape, np.nan, dtype = np.float32),
+                'hits': np.zeros((n_days, len(self.probabilities)), dtype = np.int32)}
+
+    def _align(self, days):
+        """Positions of days in the accumulators, adding days not seen before."""
+        if not np.isin(days, self.days).all():
+            union = np.union1d(self.days, days)
+            state = self._empty(len(union))
+            positions = np.searchsorted(union, self.days)
+            for name, values in self._state.items():
+                state[name][positions] = values
+            self.days, self._state = union, state
+        return np.searchsorted(self.days, days)
+
+    def push(self, days, values):
+        positions = self._align(days)
+        state = self._state
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0).astype(np.float64)
+        state['count'][positions] += valid.sum(axis = 0, dtype = np.int32)
+        state['sum'][positions] += filled.sum(axis = 0)
+        state['squares'][positions] += (filled * filled).sum(axis = 0)
+        state['low'][positions] = np.fmin(state['low'][positions], np.fmin.reduce(values, axis = 0))
+        state['high'][positions] = np.fmax(state['high'][positions], np.fmax.reduce(values, axis = 0))
+        # NaN compares False either way, so members without a value never count as a hit
+        with np.errstate(invalid = 'ignore'):
+            checked = values[:, :, self._positions]
+            hits = np.where(self._above, checked > self._limits, checked <= self._limits)
+        state['hits'][positions] += hits.sum(axis = 0, dtype = np.int32)
+
+    def finish(self):
+        """One row per day with a datetime64 'date', the statistics and a 'members' count."""
+        state = self._state
+        count = state['count'].astype(np.float64)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = state['sum'] / count
+            # Sample standard deviation, like pandas; NaN with fewer than two members
+            variance = (state['squares'] - state['sum'] * mean) / (count - 1)
+            spread = np.sqrt(np.clip(variance, 0, None))
+            probability = state['hits'] / count[:, self._positions]
+        daily = {}
+        for j, column in enumerate(self.columns):
+            daily[column] = mean[:, j].astype(np.float32)
+            daily[column + '_spread'] = np.where(count[:, j] > 1, spread[:, j], np.nan).astype(np.float32)
+            daily[column + '_low'] = state['low'][:, j]
+            daily[column + '_high'] = state['high'][:, j]
+        for k, (name, _, _, _) in enumerate(self.probabilities):
+            daily[name + '_probability'] = probability[:, k].astype(np.float32)
+        daily = pd.DataFrame(daily)
+        daily.insert(0, 'members', state['count'].max(axis = 1, initial = 0))
+        daily.insert(0, 'date', self.days.astype('datetime64[D]').astype('datetime64[s]'))
+        return daily
+
+################################################################################
+# FETCH AND SAVE
+################################################################################
+
+def ensemble_spread(client, locations, params = PARAMS, batch_size = 50, member_chunk = 64):
+    """
+    Daily ensemble statistics for every site in the registry, keyed by a
+    categorical 'location' column and 'date'.
+
+    Every model of a batch of sites comes back from one request. A batch's
+    responses are reduced before the next batch is fetched.
+    """
+    variables = list(params['hourly'])
+    reducers = []
+    with profile.stage('fetch_reduce', sites = len(locations)) as stage:
+        for batch in batches(locations, batch_size):
+            batch_reducers = [SpreadReducer() for _ in range(len(batch))]
+            for response in client.weather_api(ENSEMBLE_URL, params = batch_params(params, batch)):
+                reducer = batch_reducers[response.LocationId()]
+                for times, block in decode_members(response.Hourly(), variables, member_chunk):
+                    reducer.push(*member_days(times, block, response.UtcOffsetSeconds(), variables))
+            reducers += batch_reducers
+        df = stack_locations(locations['name'], [reducer.finish() for reducer in reducers])
+        stage['rows'] = len(df)
+        stage['members'] = int(df['members'].max()) if len(df) else 0
+    return df
+
+
+def update_ensemble(filepath = '', client = None, batch_size = 50):
+    """
+    Fetch the ensemble forecast for every site in locations.csv and save its
+    daily statistics to the 'Ensemble' data set and CSV side table.
+    """
+    client = client or shared_client(filepath + '.weather_cache.sqlite')
+    df = ensemble_spread(client, load_locations(filepath), batch_size = batch_size)
+    df['year'] = df['date'].dt.year
+
+    with profile.stage('write', rows = len(df)):
+        store.write(df, 'Ensemble', filepath)
+        df.to_csv(filepath + store.ENSEMBLE_FILE, index = False)
+    return df
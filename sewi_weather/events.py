@@ -0,0 +1,180 @@
+"""
+PLANTING THRESHOLD EVENTS
+
+A small index of the dates gardeners look for each year: when the 7 day
+average soil temperature first stays above 50°F and 60°F, and the last
+spring and first fall frost. There is one row per site, year and event, so
+the dashboard reads a few thousand rows instead of rescanning every day of
+every year.
+
+Events are found with run-length and crossing detection on the rows of all
+years and sites at once. A 'first' event is the first day of the first run
+of at least min_days consecutive days meeting its condition, and a 'last'
+event is the last day meeting it, both inside the event's season.
+
+For the current year the forecast rows count too, so an event they reach is
+marked 'projected'. Each site and year is stored with a checksum of the rows
+it was found from, and only the site-years whose rows changed (in practice
+the current year, when new days or a new forecast arrive) are evaluated
+again.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.store import EVENTS_FILE
+from sewi_weather.aggregate import day_number, run_starts
+from sewi_weather.climatology import day_of_year
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# (event, column, 'above' or 'at_or_below', threshold in °F, 'first' or 'last',
+#  minimum run in days, season as first and last day of the year)
+# Days of the year are numbered as in a leap year, so 183 is always July 1.
+EVENTS = [
+    ('soil_above_50F', 'soil_temperature_0_to_7cm_7dayavg', 'above', 50, 'first', 7, (1, 366)),
+    ('soil_above_60F', 'soil_temperature_0_to_7cm_7dayavg', 'above', 60, 'first', 7, (1, 366)),
+    ('last_spring_frost', 'temperature_2m_min', 'at_or_below', 32, 'last', 1, (1, 182)),
+    ('first_fall_frost', 'temperature_2m_min', 'at_or_below', 32, 'first', 1, (183, 366)),
+]
+
+INDEX_COLUMNS = ['location', 'year', 'event', 'date', 'day_of_year', 'status']
+
+################################################################################
+# EVENT DETECTION
+################################################################################
+
+def _checksums(df, order, starts, events):
+    # Sum of row hashes per site-year, offset by a hash of the event settings
+    columns = list(dict.fromkeys(column for _, column, _, _, _, _, _ in events))
+    if 'Data Source' in df.columns:
+        columns.append('Data Source')
+    rows = pd.util.hash_pandas_object(df[['date'] + columns], index = False).to_numpy()[order]
+    settings = np.uint64(int(hashlib.sha1(repr(events).encode()).hexdigest()[:16], 16))
+    with np.errstate(over = 'ignore'):
+        sums = np.add.reduceat(rows, starts) + settings if len(rows) else rows
+    return sums.view(np.int64)
+
+
+def find_events(df, events = EVENTS):
+    """
+    One row per location, year and event.
+
+    df needs 'location', 'date' and every event column, with at most one row
+    per location and date; a 'Data Source' column marks forecast rows
+    ('Prediction'). status is 'observed', 'projected' (reached only in the
+    forecast), 'provisional' (a 'last' event whose season is not over yet),
+    'pending' (not reached and the season is not over) or 'not reached'.
+    """
+    codes, names = pd.factorize(df['location'], sort = True)
+    days = day_number(df['date'])
+    order = np.lexsort((days, codes))
+    codes, days = codes[order], days[order]
+    dates = pd.DatetimeIndex(df['date'].to_numpy()[order])
+    years = dates.year.to_numpy()
+    doy = day_of_year(dates)
+
+    starts = run_starts(codes, years)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(codes))))
+    forecast = np.zeros(len(codes), dtype = bool)
+    if 'Data Source' in df.columns:
+        forecast = (df['Data Source'].to_numpy() == 'Prediction')[order]
+    # Last day of the year covered by measured rows, 0 when there are none
+    measured_through = np.zeros(len(starts), dtype = np.int64)
+    np.maximum.at(measured_through, group[~forecast], doy[~forecast])
+    # Consecutive rows of one site and year one day apart
+    follows = np.zeros(len(codes), dtype = bool)
+    follows[1:] = (group[1:] == group[:-1]) & (np.diff(days) == 1)
+
+    parts = []
+    for event, column, comparison, threshold, which, min_days, (season_start, season_end) in events:
+        values = df[column].to_numpy(dtype = np.float64)[order]
+        with np.errstate(invalid = 'ignore'):
+            hit = values > threshold if comparison == 'above' else values <= threshold
+        hit &= (doy >= season_start) & (doy <= season_end)
+
+        if which == 'first':
+            # Runs of hits; a run is long enough at its min_days-th row
+            run_start = hit & ~(np.roll(hit, 1) & follows)
+            start_row = np.maximum.accumulate(np.where(run_start, np.arange(len(hit)), 0))
+            done = np.flatnonzero(hit & (np.arange(len(hit)) - start_row == min_days - 1))
+            # The first long enough run of each group
+            done = done[np.unique(group[done], return_index = True)[1]]
+            event_row, decided_row = start_row[done], done
+        else:
+            rows = np.flatnonzero(hit)
+            last = np.append(group[rows][1:] != group[rows][:-1], True)
+            event_row = decided_row = rows[last]
+        found_group = group[event_row]
+
+        date = np.full(len(starts), np.datetime64('NaT'), dtype = 'datetime64[ns]')
+        date[found_group] = dates.to_numpy()[event_row]
+        season_over = measured_through >= season_end
+        status = np.where(season_over, 'not reached', 'pending').astype(object)
+        status[found_group] = np.where(forecast[decided_row], 'projected',
+                                       np.where((which == 'last') & ~season_over[found_group], 'provisional', 'observed'))
+
+        parts.append(pd.DataFrame({'location': np.asarray(names)[codes[starts]], 'year': years[starts],
+                                   'event': event, 'date': date, 'status': status}))
+
+    out = pd.concat(parts, ignore_index = True)
+    out['day_of_year'] = pd.Series(day_of_year(out['date'].fillna(pd.Timestamp('2000-01-01'))),
+                                   dtype = 'Int16').where(out['date'].notna())
+    return out.sort_values(['location', 'year', 'event'], ignore_index = True)[INDEX_COLUMNS]
+
+################################################################################
+# PERSISTED INDEX
+################################################################################
+
+def update_events(df, filepath = '', events = EVENTS):
+    """
+    Bring the stored event index up to date with df and save it as a CSV.
+
+    Only site-years whose rows changed since they were last evaluated are
+    searched again. Site-years the store has but df does not are kept.
+    Returns the whole index.
+    """
+    codes, _ = pd.factorize(df['location'], sort = True)
+    order = np.lexsort((day_number(df['date']), codes))
+    years = df['date'].dt.year.to_numpy()[order]
+    starts = run_starts(codes[order], years)
+    checks = pd.DataFrame({'location': df['location'].to_numpy()[order][starts].astype(str),
+                           'year': years[starts], 'checksum': _checksums(df, order, starts, events)})
+
+    stored = None
+    if store.exists('Events', filepath):
+        stored = store.read('Events', filepath)
+        stored['location'] = stored['location'].astype(str)
+        stored['year'] = stored['year'].astype(np.int64)
+    if stored is not None and len(stored):
+        seen = stored[['location', 'year', 'checksum']].drop_duplicates()
+        checks = checks.merge(seen, on = ['location', 'year', 'checksum'], how = 'left', indicator = True)
+        checks = checks[checks['_merge'] == 'left_only'].drop(columns = '_merge')
+
+    if stored is not None and not len(checks):
+        found = stored
+    else:
+        # Rows of the site-years that changed
+        changed = pd.MultiIndex.from_frame(checks[['location', 'year']])
+        keys = pd.MultiIndex.from_arrays([df['location'].astype(str), df['date'].dt.year])
+        found = find_events(df[keys.isin(changed)], events)
+        found['location'] = found['location'].astype(str)
+        found = found.merge(checks, on = ['location', 'year'])
+
+        if stored is not None:
+            kept = ~pd.MultiIndex.from_frame(stored[['location', 'year']]).isin(changed)
+            found = pd.concat([stored[kept], found], ignore_index = True)
+        store.write(found, 'Events', filepath)
+
+    found = found.sort_values(['location', 'year', 'event'], ignore_index = True)[INDEX_COLUMNS + ['checksum']]
+    found.drop(columns = 'checksum').to_csv(filepath + EVENTS_FILE, index = False)
+    return found
@@ -0,0 +1,188 @@
+"""
+ROLLING WINDOW FEATURES
+
+Computes the 7 and 14 day averages and sums in one vectorized pass. Each
+source column gets one cumulative sum (and one cumulative count of missing
+values) that every window over that column shares, so a window sum is the
+difference of two cumulative sums instead of a separate rolling pass.
+
+Windows cover calendar days, not rows: the 7 day window for a date is that
+date and the 6 days before it, found by a binary search on day numbers. A
+window is only filled in when every one of its days is present and has a
+value, so a missing day makes the windows that cover it NaN instead of
+stretching them over an extra day. Without gaps this is the same as
+rolling(7) over the rows, and in general it matches
+rolling('7D', on = 'date', min_periods = 7).
+
+The historical part of the features is saved in the store ('Features')
+together with the last rows of each site ('Feature State'). A run only
+computes rows the store does not have yet, starting from that saved tail,
+and the YTD and prediction rows are computed on top of it. The results match
+computing the whole data set in one go.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.aggregate import day_number, run_starts
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# (feature column, source column, window in days, 'mean' or 'sum')
+WINDOWS = [
+    ('temperature_2m_7dayavg', 'temperature_2m_mean', 7, 'mean'),
+    ('temperature_2m_14dayavg', 'temperature_2m_mean', 14, 'mean'),
+    ('soil_temperature_0_to_7cm_7dayavg', 'soil_temperature_0_to_7cm_mean', 7, 'mean'),
+    ('soil_temperature_7_to_28cm_7dayavg', 'soil_temperature_7_to_28cm_mean', 7, 'mean'),
+    ('soil_temperature_28_to_100cm_7dayavg', 'soil_temperature_28_to_100cm_mean', 7, 'mean'),
+    ('soil_temperature_100_to_255cm_7dayavg', 'soil_temperature_100_to_255cm_mean', 7, 'mean'),
+    ('soil_temperature_0_to_7cm_14dayavg', 'soil_temperature_0_to_7cm_mean', 14, 'mean'),
+    ('soil_temperature_7_to_28cm_14dayavg', 'soil_temperature_7_to_28cm_mean', 14, 'mean'),
+    ('soil_temperature_28_to_100cm_14dayavg', 'soil_temperature_28_to_100cm_mean', 14, 'mean'),
+    ('soil_temperature_100_to_255cm_14dayavg', 'soil_temperature_100_to_255cm_mean', 14, 'mean'),
+    ('precipitation_sum_7day', 'precipitation_sum', 7, 'sum'),
+    ('rain_sum_7day', 'rain_sum', 7, 'sum'),
+    ('snow_sum_7day', 'snowfall_sum', 7, 'sum'),
+]
+
+################################################################################
+# FEATURE ENGINE
+################################################################################
+
+def sources(windows = WINDOWS):
+    """Source columns the windows read, in first-use order."""
+    return list(dict.fromkeys(source for _, source, _, _ in windows))
+
+
+def rolling_features(df, windows = WINDOWS, tail = None):
+    """
+    Window features for every row of df.
+
+    df needs 'location' and 'date' columns, with at most one row per
+    location and date; rows may come in any order. tail is the state
+    returned by an earlier call for the dates just before df; its rows feed
+    the windows but get no features of their own.
+
+    Returns (features, tail): features has one column per window and df's
+    index, and tail holds the last rows of each location needed to continue.
+    """
+    columns = sources(windows)
+    carried = ['location', 'date'] + columns
+    keep = max(window for _, _, window, _ in windows) - 1
+
+    parts = [df[carried]]
+    if tail is not None and len(tail):
+        parts.insert(0, tail[carried])
+    rows = pd.concat(parts, ignore_index = True)
+    first = len(rows) - len(df)
+
+    # One sortable key per row: location in the high bits, day in the low bits.
+    # Rows already in key order (the usual case without a tail) stay put.
+    codes, _ = pd.factorize(rows['location'])
+    days = day_number(rows['date'])
+    n = len(codes)
+    keys = codes.astype(np.int64) << 32 | (days.astype(np.int64) - int(days.min(initial = 0)))
+    order = None
+    if np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind = 'stable')
+        keys = keys[order]
+        codes = codes[order]
+    if np.any(keys[1:] == keys[:-1]):
+        raise ValueError("rolling_features needs at most one row per location and date")
+    starts = run_starts(codes)
+    lengths = np.diff(np.append(starts, n))
+
+    # First row of each window length, shared by every source column
+    firsts = {window: np.searchsorted(keys, keys - (window - 1))
+              for window in {window for _, _, window, _ in windows}}
+
+    out = {}
+    for column in columns:
+        values = rows[column].to_numpy(dtype = np.float64)
+        if order is not None:
+            values = values[order]
+        missing = np.isnan(values)
+        total = np.concatenate([[0.0], np.cumsum(np.where(missing, 0.0, values))])
+        gaps = np.concatenate([[0], np.cumsum(missing)])
+        for name, source, window, how in windows:
+            if source != column:
+                continue
+            # Sum of rows first .. i is total[i + 1] - total[first]; the window is
+            # complete when it spans window rows, one per day, none missing
+            first_row = firsts[window]
+            result = total[1:] - total[first_row]
+            if how == 'mean':
+                result /= window
+            full = (np.arange(1, n + 1) - first_row == window) & (gaps[1:] == gaps[first_row])
+            result[~full] = np.nan
+            out[name] = result
+
+    # Back to the original row order, dropping the tail rows
+    if order is None:
+        rows_for_df = slice(first, None)
+    else:
+        unsorted = np.empty(n, dtype = np.int64)
+        unsorted[order] = np.arange(n)
+        rows_for_df = unsorted[first:]
+    features = pd.DataFrame({name: out[name][rows_for_df] for name, _, _, _ in windows}, index = df.index)
+
+    from_end = np.repeat(starts + lengths, lengths) - np.arange(n) - 1
+    in_tail = np.flatnonzero(from_end < keep)
+    new_tail = rows.iloc[in_tail if order is None else order[in_tail]].reset_index(drop = True)
+    return features, new_tail
+
+################################################################################
+# PERSISTED HISTORY
+################################################################################
+
+def update_history_features(filepath = '', windows = WINDOWS):
+    """
+    Bring the stored historical features up to date and return the tail state.
+
+    Only historical rows after each location's last stored feature row are
+    read and computed. Everything is recomputed if the history was rebuilt
+    (a location's history ends before its stored features do) or the set of
+    windows changed.
+    """
+    columns = ['location'] + sources(windows)
+    hist_marks = store.watermarks('Historical', filepath)
+
+    rebuild = not (store.exists('Features', filepath) and store.exists('Feature State', filepath))
+    if not rebuild:
+        feature_marks = store.watermarks('Features', filepath)
+        tail = store.read('Feature State', filepath)
+        stored_columns = store.read('Features', filepath, years = []).columns
+        rebuild = (bool((feature_marks > hist_marks.reindex(feature_marks.index)).any())
+                   or any(name not in stored_columns for name, _, _, _ in windows)
+                   or any(column not in tail.columns for column in columns))
+
+    if rebuild:
+        tail = None
+        new = store.read('Historical', filepath, columns = columns)
+    else:
+        start = feature_marks.reindex(hist_marks.index)
+        todo = start.isna() | (start < hist_marks)
+        if not todo.any():
+            return tail
+        # Locations new to the history need every year
+        years = None if start[todo].isna().any() else range(start[todo].min().year, hist_marks.max().year + 1)
+        new = store.read('Historical', filepath, columns = columns, years = years)
+        cutoff = new['location'].astype(str).map(start.rename(index = str))
+        new = new[cutoff.isna() | (new['date'] > cutoff)]
+
+    features, tail = rolling_features(new, windows, tail)
+    features.insert(0, 'date', new['date'])
+    features.insert(0, 'location', new['location'])
+    features['year'] = features['date'].dt.year
+    store.write(features, 'Features', filepath, mode = 'overwrite' if rebuild else 'append')
+
+    tail['year'] = tail['date'].dt.year
+    store.write(tail, 'Feature State', filepath)
+    return tail
@@ -0,0 +1,161 @@
+"""
+CHUNKED FETCHING FROM THE OPEN-METEO API
+
+Long archive requests are split into year or decade chunks that are fetched
+concurrently on a small thread pool. Only chunks that fail are retried.
+Chunks can be consumed one at a time in date order, or stitched back
+together so they read like a single response covering the whole range.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import profile
+
+################################################################################
+# DATE CHUNKS
+################################################################################
+
+def date_chunks(start_date, end_date, years = 1):
+    """
+    Split an inclusive date range into (start_date, end_date) string pairs.
+
+    Chunks break on January 1 of every years-th year (1940, 1950, ... for
+    years = 10) so repeated runs ask for the same chunks.
+    """
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date)
+    chunks = []
+    while start <= end:
+        next_year = (start.year // years + 1) * years
+        chunk_end = end if next_year > end.year else pd.Timestamp(next_year, 1, 1) - pd.Timedelta(days = 1)
+        chunks.append((start.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d')))
+        start = chunk_end + pd.Timedelta(days = 1)
+    return chunks
+
+
+def request_range(params, today = None):
+    """
+    Inclusive local (start_date, end_date) a request covers.
+
+    Requests without start_date and end_date are forecasts, which cover
+    past_days before today through forecast_days - 1 days after it.
+    """
+    if 'start_date' in params:
+        return params['start_date'], params['end_date']
+    today = pd.Timestamp(today or pd.Timestamp.today().normalize())
+    start = today - pd.Timedelta(days = params.get('past_days', 0))
+    end = today + pd.Timedelta(days = params.get('forecast_days', 7) - 1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+################################################################################
+# FETCH
+################################################################################
+
+def fetch_chunk(openmeteo, url, params, retries = 3, backoff_factor = 1.0):
+    """
+    Fetch one chunk, retrying it up to retries more times if it raises.
+
+    Waits backoff_factor * 2^n seconds before the n-th retry. Retries are
+    printed when profile.DEBUG is set; the last failure is raised.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return openmeteo.weather_api(url, params = params)
+        except Exception as error:
+            if attempt == retries:
+                raise RuntimeError(f"Chunk {params['start_date']}..{params['end_date']} still failing "
+                                   f"after {retries} retries") from error
+            if profile.DEBUG:
+                print(f"Retrying chunk {params['start_date']}..{params['end_date']}: {error}")
+            time.sleep(backoff_factor * 2 ** attempt)
+
+
+def iter_chunked(openmeteo, url, params, chunk_years = 10, max_workers = 4, retries = 3, backoff_factor = 1.0):
+    """
+    Fetch params['start_date'] to params['end_date'] in concurrent chunks.
+
+    Yields ((start_date, end_date), responses) for each chunk in date order.
+    At most max_workers chunks are in flight or waiting to be consumed, so a
+    caller that decodes and drops each chunk never holds the whole range. A
+    failing chunk is retried on its own; chunks that succeeded are never
+    fetched again.
+    """
+    chunks = date_chunks(params['start_date'], params['end_date'], chunk_years)
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        futures = deque()
+        submitted = 0
+        for chunk in chunks:
+            while submitted < len(chunks) and len(futures) < max_workers:
+                start_date, end_date = chunks[submitted]
+                futures.append(pool.submit(fetch_chunk, openmeteo, url,
+                                           {**params, 'start_date': start_date, 'end_date': end_date},
+                                           retries, backoff_factor))
+                submitted += 1
+            yield chunk, futures.popleft().result()
+
+
+def fetch_chunked(openmeteo, url, params, chunk_years = 10, max_workers = 4, retries = 3, backoff_factor = 1.0):
+    """Like iter_chunked, but returns the list of every chunk's responses in date order."""
+    return [responses for _, responses in iter_chunked(openmeteo, url, params, chunk_years, max_workers, retries, backoff_factor)]
+
+################################################################################
+# STITCH
+################################################################################
+
+class StitchedVariable:
+    """One variable joined across chunks. Mirrors VariableWithValues."""
+
+    def __init__(self, variables):
+        self._variables = variables
+
+    def ValuesAsNumpy(self):
+        return np.concatenate([v.ValuesAsNumpy() for v in self._variables])
+
+    def ValuesInt64AsNumpy(self):
+        return np.concatenate([v.ValuesInt64AsNumpy() for v in self._variables])
+
+
+class StitchedVariables:
+    """One section (Hourly or Daily) joined across chunks. Mirrors VariablesWithTime."""
+
+    def __init__(self, sections):
+        self.sections = sections
+
+    def Time(self):
+        return self.sections[0].Time()
+
+    def TimeEnd(self):
+        return self.sections[-1].TimeEnd()
+
+    def Interval(self):
+        return self.sections[0].Interval()
+
+    def VariablesLength(self):
+        return self.sections[0].VariablesLength()
+
+    def Variables(self, j):
+        return StitchedVariable([s.Variables(j) for s in self.sections])
+
+
+def stitch(chunk_responses, section, location = 0):
+    """
+    Join a section ('Hourly' or 'Daily') of one location across chunk responses.
+
+    Raises ValueError if consecutive chunks leave a gap or overlap in time.
+    """
+    sections = [getattr(responses[location], section)() for responses in chunk_responses]
+    for previous, current in zip(sections, sections[1:]):
+        if previous.TimeEnd() != current.Time():
+            raise ValueError(f"{section} chunks are not contiguous: "
+                             f"{pd.to_datetime(previous.TimeEnd(), unit = 's')} != "
+                             f"{pd.to_datetime(current.Time(), unit = 's')}")
+    return StitchedVariables(sections)
@@ -0,0 +1,98 @@
+"""
+FORECAST REQUEST AND DAILY SUMMARY
+
+The forecast request and the steps that turn its responses into daily rows,
+shared by the prediction gatherer and the intraday forecast poller so both
+write the same 'Prediction' data set.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+
+import pandas as pd
+
+from sewi_weather import profile
+from sewi_weather.aggregate import DEGREE_HOUR_BASES, daily_means, local_dates
+from sewi_weather.decode import decode_block
+from sewi_weather.depths import harmonize_soil, layer_columns
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Make sure all required weather variables are listed here
+# Responses are decoded by looking up each variable's position in these lists
+HOURLY_VARIABLES = ["temperature_2m", "soil_temperature_0cm", "soil_temperature_6cm", "soil_temperature_18cm", "soil_temperature_54cm", "soil_moisture_0_to_1cm", "soil_moisture_1_to_3cm", "soil_moisture_3_to_9cm", "soil_moisture_9_to_27cm", "soil_moisture_27_to_81cm"]
+
+DAILY_VARIABLES = ["weather_code", "temperature_2m_max", "temperature_2m_min", "daylight_duration", "uv_index_max", "precipitation_sum", "rain_sum", "showers_sum", "snowfall_sum", "precipitation_probability_max"]
+
+URL = "https://api.open-meteo.com/v1/forecast"
+
+# Coordinates are filled in for each batch of sites from locations.csv
+PARAMS = {
+	"hourly": HOURLY_VARIABLES,
+	"daily": DAILY_VARIABLES,
+	"temperature_unit": "fahrenheit",
+	"wind_speed_unit": "mph",
+	"precipitation_unit": "inch",
+	"timezone": "America/Chicago",
+	"past_days": 2
+}
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def forecast_digest(names, sections, hourly_variables = HOURLY_VARIABLES, daily_variables = DAILY_VARIABLES):
+    """
+    Hash of the decoded values and times of every site's (hourly, daily)
+    sections. It only changes when a new model run changes the numbers or the
+    forecast window moves on.
+    """
+    digest = hashlib.sha1()
+    for name, (hourly, daily) in zip(names, sections):
+        digest.update(str(name).encode())
+        for section, variables in ((hourly, hourly_variables), (daily, daily_variables)):
+            times, block = decode_block(section, variables)
+            digest.update(times[:1].tobytes() + times[-1:].tobytes())
+            digest.update(block.tobytes())
+    return digest.hexdigest()
+
+
+def summarize_forecast(hourly_df, daily_df, utc_offset = 0):
+    """
+    Daily prediction rows from decoded forecast frames: the daily variables
+    with month and year, the forecast soil depths mapped onto the archive's
+    layers, daily means of the hourly values, soil temperature min and max,
+    degree hours (see aggregate.DEGREE_HOUR_BASES), and showers added to rain.
+    utc_offset is the responses' UtcOffsetSeconds(), so rows are local days.
+    """
+    # Dates stay datetime64. Hourly rows are grouped on integer day numbers,
+    # so no per-row Python date or time objects are created.
+    daily_df['date'] = local_dates(daily_df['date'], utc_offset)
+    daily_df['month'] = daily_df['date'].dt.month
+    daily_df['year'] = daily_df['date'].dt.year
+
+    # Map the forecast soil depths onto the archive's 0-7, 7-28, 28-100 and 100-255cm
+    # layers, so prediction rows get the same soil columns as the historical rows
+    with profile.stage('harmonize', rows = len(hourly_df)):
+        hourly_df = harmonize_soil(hourly_df)
+
+    soiltemp = layer_columns('soil_temperature')
+    soilmoist = layer_columns('soil_moisture')
+
+    with profile.stage('aggregate') as stage:
+        avgdaily = daily_means(hourly_df, ['temperature_2m'] + soiltemp + soilmoist, extremes = soiltemp,
+                               degree_hours = DEGREE_HOUR_BASES, utc_offset = utc_offset)
+        stage['rows'] = len(avgdaily)
+
+    with profile.stage('merge') as stage:
+        daily_df = pd.merge(daily_df, avgdaily, on = ['location', 'date'])
+        stage['rows'] = len(daily_df)
+
+    daily_df['rain_sum'] = daily_df['rain_sum'] + daily_df['showers_sum']
+    daily_df.drop('showers_sum', axis = 1, inplace = True)
+    return daily_df
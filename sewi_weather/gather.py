@@ -0,0 +1,294 @@
+"""
+DATA GATHERERS
+
+The bodies of the historical, YTD and prediction gatherers, so the
+pipeline stages (see stages.py) run them from the installed package in
+any folder. The gatherer scripts are thin wrappers that set their
+parameters and call these.
+
+historical() appends the closed archive days after each site's watermark,
+fetching long ranges in concurrent chunks and reducing each chunk to daily
+statistics as it arrives. ytd() saves this year's archive days, and
+prediction() the forecast days, which are also kept as a snapshot for
+backtesting (see archive.py).
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import os
+from datetime import date
+
+import pandas as pd
+
+from sewi_weather import fetch, forecast, observed, profile, store
+from sewi_weather.aggregate import DEGREE_HOUR_BASES, daily_means, local_dates, stat_columns
+from sewi_weather.archive import archive_forecast
+from sewi_weather.cache import shared_client
+from sewi_weather.locations import batch_params, batches, decode_locations, load_locations, reduce_locations
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# First day of the archive. SEWI_WEATHER_START_DATE moves it, e.g. for shorter benchmark runs.
+FIRST_DAY = "1940-01-01"
+
+################################################################################
+# REQUESTS
+################################################################################
+
+def fetch_sections(openmeteo, url, params, locations, batch_size = 50, debug = False):
+    """
+    One request per batch of sites. Responses come back in the same order as
+    the coordinates. Returns the site names, their (hourly, daily) sections
+    and the UTC offset of the responses, which share the request's timezone.
+    """
+    names = []
+    sections = []
+    utc_offset = 0
+    for batch in batches(locations, batch_size):
+        responses = openmeteo.weather_api(url, params = batch_params(params, batch))
+        for name, response in zip(batch['name'], responses):
+            if debug:
+                print(f"{name}: Coordinates {response.Latitude()}°E {response.Longitude()}°N")
+                print(f"Elevation {response.Elevation()} m asl")
+                print(f"Timezone {response.Timezone()} {response.TimezoneAbbreviation()}")
+                print(f"Timezone difference to GMT+0 {response.UtcOffsetSeconds()} s")
+            names.append(name)
+            sections.append((response.Hourly(), response.Daily()))
+            utc_offset = response.UtcOffsetSeconds()
+    return names, sections, utc_offset
+
+################################################################################
+# HISTORICAL
+################################################################################
+
+def historical(filepath = '', refresh_mode = 'incremental', start_date = None, chunk_years = 10, max_workers = 4,
+               batch_size = 50, extreme_variables = observed.EXTREME_VARIABLES, degree_hours = DEGREE_HOUR_BASES,
+               save_hourly = False, debug = profile.DEBUG):
+    """
+    Append the archive days after each site's watermark to the 'Historical'
+    store, up to the end of last year (see observed.last_history_day).
+
+    refresh_mode 'incremental' appends only the days after the watermark,
+    'full' re-pulls everything from start_date. The date range is fetched in
+    chunks of chunk_years, max_workers at a time. save_hourly also keeps the
+    hourly soil data in the 'Historical Hourly' store as memory-mappable
+    Arrow files (about 4 MB per site and decade); turning it on pulls the
+    full history once, from the cache where it can. Returns the rows
+    written, or None when every site is up to date.
+    """
+    start_date = start_date or os.environ.get('SEWI_WEATHER_START_DATE', FIRST_DAY)
+
+    # The archive holds every closed year; the current year is covered by ytd().
+    # Early in January the last days of the year are not in the archive yet, and
+    # the watermark must not pass them, or they would never be fetched.
+    end_date = observed.last_history_day().strftime('%Y-%m-%d')
+
+    # Find watermarks
+    locations = load_locations(filepath)
+
+    append = refresh_mode == 'incremental' and store.exists('Historical', filepath)
+
+    # Daily statistics added since the store was written, or an hourly store that
+    # was not kept so far, need the whole history again
+    if append:
+        stored_columns = store.read('Historical', filepath, years = []).columns
+        append = (all(column in stored_columns for column in stat_columns([], extreme_variables, degree_hours))
+                  and (store.exists('Historical Hourly', filepath) or not save_hourly))
+
+    # Each site starts the day after its own watermark. Sites new to locations.csv start at start_date.
+    locations['start_date'] = start_date
+    if append:
+        watermarks = store.watermarks('Historical', filepath)
+        next_day = (watermarks + pd.Timedelta(days = 1)).dt.strftime('%Y-%m-%d')
+        locations['start_date'] = locations['name'].map(next_day).fillna(start_date)
+
+    locations = locations[locations['start_date'] <= end_date]
+
+    if debug:
+        for name, start in zip(locations['name'], locations['start_date']):
+            print(f"{name}: fetching {start} to {end_date}")
+
+    if locations.empty:
+        print("Historical data is up to date")
+        return None
+
+    # Setup the Open-Meteo API client with retry on error and a day-granular cache
+    # Settled archive days never expire, the last week of archive days expires after six hours
+    # and forecast days after an hour (see sewi_weather.cache.TTL and PROVISIONAL_TTL)
+    # Stages run together share one HTTP session and cache connection
+    openmeteo = shared_client(filepath + '.weather_cache.sqlite')
+
+    # Coordinates are filled in for each batch of sites from locations.csv
+    params = {**observed.PARAMS, "start_date": start_date, "end_date": end_date}
+
+    # Sites that share a watermark are fetched together, one batch of sites at a time.
+    # Each chunk of years is reduced to daily soil statistics (and saved hourly, if
+    # asked) as soon as it arrives, so the hourly archive is never held in memory all at once.
+    # Fetching, decoding and aggregating overlap, so they are timed as one stage;
+    # bytes_received counts the decoded values fetched from the API, not cache hits.
+    hourly_mode = 'append' if append else 'overwrite'
+
+    def save_hourly_chunk(hourly_chunk):
+        """Write one chunk of hourly rows for a batch of sites to the hourly store."""
+        nonlocal hourly_mode
+        hourly_chunk['year'] = hourly_chunk['date'].dt.year
+        store.write(hourly_chunk, 'Historical Hourly', filepath, mode = hourly_mode, format = 'ipc')
+        hourly_mode = 'append'
+
+    daily_frames = []
+    mean_frames = []
+    with profile.stage('fetch_aggregate', sites = len(locations)) as stage:
+        for start, group in locations.groupby('start_date', sort = False):
+            for batch in batches(group, batch_size):
+                batch_request = {**batch_params(params, batch), 'start_date': start}
+                chunk_stream = fetch.iter_chunked(openmeteo, observed.URL, batch_request, chunk_years = chunk_years,
+                                                  max_workers = max_workers)
+                batch_daily, batch_means = reduce_locations(batch['name'], chunk_stream, observed.HOURLY_VARIABLES,
+                                                            observed.DAILY_VARIABLES, extremes = extreme_variables,
+                                                            degree_hours = degree_hours,
+                                                            hourly_sink = save_hourly_chunk if save_hourly else None)
+                daily_frames.append(batch_daily)
+                mean_frames.append(batch_means)
+
+        daily_df = pd.concat(daily_frames, ignore_index = True)
+        avgsoil = pd.concat(mean_frames, ignore_index = True)
+        daily_df['location'] = pd.Categorical(daily_df['location'], categories = locations['name'])
+        avgsoil['location'] = pd.Categorical(avgsoil['location'], categories = locations['name'])
+        stage['rows'] = len(daily_df)
+        stage['bytes_received'] = openmeteo.stats()['bytes_written']
+        stage['cache'] = openmeteo.stats()
+
+    if debug:
+        print(daily_df)
+
+    # Dates stay datetime64, so no per-row Python date objects are created. They
+    # are local midnights already (see reduce_locations).
+    daily_df['month'] = daily_df['date'].dt.month
+    daily_df['year'] = daily_df['date'].dt.year
+
+    with profile.stage('merge') as stage:
+        daily_df = pd.merge(daily_df, avgsoil, on = ['location', 'date'])
+        stage['rows'] = len(daily_df)
+
+    with profile.stage('write', rows = len(daily_df)):
+        store.write(daily_df, 'Historical', filepath, mode = 'append' if append else 'overwrite')
+    return daily_df
+
+################################################################################
+# YEAR TO DATE
+################################################################################
+
+def ytd(filepath = '', batch_size = 50, save_hourly = False, debug = profile.DEBUG):
+    """
+    Save this year's archive days up to observed.last_archive_day(), which
+    the archive has caught up with, to the 'YTD' store. save_hourly also
+    keeps the hourly soil data in the 'YTD Hourly' store. Returns the rows
+    written, or None early in January, before the archive has a day of
+    this year.
+    """
+    start_date = date.today().replace(month = 1, day = 1)
+    end_date = observed.last_archive_day()
+
+    # From January 1 to 3 the archive has no day of this year yet. The YTD rows
+    # saved last year are kept; the history takes over their days.
+    if start_date > end_date:
+        print("No archive days of this year yet")
+        return None
+
+    # Setup the Open-Meteo API client with retry on error and a day-granular cache
+    # (see sewi_weather.cache.TTL and PROVISIONAL_TTL)
+    openmeteo = shared_client(filepath + '.weather_cache.sqlite')
+
+    # Coordinates are filled in for each batch of sites from locations.csv
+    params = {**observed.PARAMS, "start_date": start_date.strftime('%Y-%m-%d'), "end_date": end_date.strftime('%Y-%m-%d')}
+    locations = load_locations(filepath)
+
+    # bytes_received counts the decoded values fetched from the API, not cache hits.
+    with profile.stage('fetch', sites = len(locations)) as stage:
+        names, sections, utc_offset = fetch_sections(openmeteo, observed.URL, params, locations, batch_size, debug)
+        stage['bytes_received'] = openmeteo.stats()['bytes_written']
+        stage['cache'] = openmeteo.stats()
+
+    # Decode every site in parallel into long-format frames keyed by location
+    with profile.stage('decode') as stage:
+        hourly_df, daily_df = decode_locations(names, sections, observed.HOURLY_VARIABLES, observed.DAILY_VARIABLES)
+        stage['rows'] = len(hourly_df) + len(daily_df)
+
+    if debug:
+        print(hourly_df)
+        print(daily_df)
+
+    # Dates stay datetime64. Hourly rows are grouped on integer local day numbers
+    # below, so no per-row Python date or time objects are created.
+    daily_df['date'] = local_dates(daily_df['date'], utc_offset)
+    daily_df['month'] = daily_df['date'].dt.month
+    daily_df['year'] = daily_df['date'].dt.year
+
+    # Calculate mean daily soil temps and moisture, soil temperature min and max
+    # and growing degree hours (see sewi_weather.aggregate.DEGREE_HOUR_BASES) in one pass
+    with profile.stage('aggregate') as stage:
+        avgsoil = daily_means(hourly_df, observed.HOURLY_VARIABLES, extremes = observed.EXTREME_VARIABLES,
+                              degree_hours = DEGREE_HOUR_BASES, utc_offset = utc_offset)
+        stage['rows'] = len(avgsoil)
+
+    if save_hourly:
+        with profile.stage('write_hourly', rows = len(hourly_df)):
+            hourly_df['year'] = hourly_df['date'].dt.year
+            store.write(hourly_df, 'YTD Hourly', filepath, format = 'ipc')
+
+    with profile.stage('merge') as stage:
+        daily_df = pd.merge(daily_df, avgsoil, on = ['location', 'date'])
+        stage['rows'] = len(daily_df)
+
+    with profile.stage('write', rows = len(daily_df)):
+        store.write(daily_df, 'YTD', filepath)
+    return daily_df
+
+################################################################################
+# PREDICTION
+################################################################################
+
+def prediction(filepath = '', batch_size = 50, debug = profile.DEBUG):
+    """
+    Save the forecast days to the 'Prediction' store and add a snapshot of
+    them to the forecast archive, unless the forecast is unchanged since
+    the last one. Returns the rows written.
+    """
+    # Setup the Open-Meteo API client with retry on error and a day-granular cache
+    # (see sewi_weather.cache.TTL)
+    openmeteo = shared_client(filepath + '.weather_cache.sqlite')
+
+    locations = load_locations(filepath)
+
+    # bytes_received counts the decoded values fetched from the API, not cache hits.
+    with profile.stage('fetch', sites = len(locations)) as stage:
+        names, sections, utc_offset = fetch_sections(openmeteo, forecast.URL, forecast.PARAMS, locations, batch_size, debug)
+        stage['bytes_received'] = openmeteo.stats()['bytes_written']
+        stage['cache'] = openmeteo.stats()
+
+    # Decode every site in parallel into long-format frames keyed by location
+    with profile.stage('decode') as stage:
+        hourly_df, daily_df = decode_locations(names, sections, forecast.HOURLY_VARIABLES, forecast.DAILY_VARIABLES)
+        stage['rows'] = len(hourly_df) + len(daily_df)
+
+    if debug:
+        print(hourly_df)
+        print(daily_df)
+
+    # Map the forecast soil depths onto the archive's soil layers, calculate mean
+    # daily air temp, soil temps and moisture, soil temperature min and max and
+    # growing degree hours, and merge them with the daily data (see sewi_weather.forecast)
+    daily_df = forecast.summarize_forecast(hourly_df, daily_df, utc_offset)
+
+    with profile.stage('write', rows = len(daily_df)):
+        store.write(daily_df, 'Prediction', filepath)
+
+    # Keep a snapshot of this forecast for backtesting, unless it is unchanged
+    # since the last one (see sewi_weather.archive)
+    with profile.stage('snapshot') as stage:
+        stage['rows'] = archive_forecast(daily_df, filepath)
+    return daily_df
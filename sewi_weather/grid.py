@@ -0,0 +1,237 @@
+"""
+REGIONAL GRID AGGREGATION
+
+The gatherers sample the sites in locations.csv, which by default is one
+point near Oconomowoc. This samples a latitude/longitude grid over a
+bounding box instead, Southeast Wisconsin by default, and reduces it to
+regional daily series: the area-weighted mean over the whole box and over
+each county.
+
+Grid cells are fetched like sites, many coordinates per request, with
+several batches in flight at once. Each cell's daily values and the daily
+means of its hourly soil data are written into one (cell x day x
+variable) float32 array, which is saved as a single file instead of one
+CSV per point. The regional series are then one weighted sum over the
+cell axis for every region at once: the weights are the cell areas
+(which shrink with the cosine of the latitude) times a (region x cell)
+mask. Cells without a value for a day and variable, like cells over Lake
+Michigan for the soil variables, are left out of that day's mean.
+
+County masks are the counties' bounding boxes, which is close for the
+mostly rectangular counties of the region; a cell counts toward a county
+when its center is inside the box.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import profile, store
+from sewi_weather.aggregate import reduce_runs, run_starts, stat_columns
+from sewi_weather.cache import shared_client
+from sewi_weather.decode import decode_block
+from sewi_weather.fetch import fetch_chunk
+from sewi_weather.locations import batch_params, batches
+from sewi_weather.observed import URL
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# (south, north, west, east) in degrees
+BOUNDS = (42.49, 43.54, -89.01, -87.79)
+
+# Spacing of the grid cells in degrees; the archive's land model has 0.1° cells
+RESOLUTION = 0.1
+
+# Approximate county bounding boxes as (south, north, west, east)
+COUNTIES = {
+    'Dodge': (43.19, 43.64, -89.01, -88.40),
+    'Jefferson': (42.84, 43.19, -89.01, -88.54),
+    'Kenosha': (42.49, 42.67, -88.31, -87.80),
+    'Milwaukee': (42.84, 43.19, -88.07, -87.83),
+    'Ozaukee': (43.19, 43.54, -88.04, -87.79),
+    'Racine': (42.67, 42.84, -88.31, -87.76),
+    'Walworth': (42.49, 42.84, -88.78, -88.31),
+    'Washington': (43.19, 43.54, -88.42, -88.04),
+    'Waukesha': (42.84, 43.19, -88.54, -88.07),
+}
+
+# Name of the series over every cell of the grid
+REGION = 'Southeast Wisconsin'
+
+HOURLY_VARIABLES = ["soil_temperature_0_to_7cm", "soil_temperature_7_to_28cm", "soil_temperature_28_to_100cm", "soil_temperature_100_to_255cm",
+                    "soil_moisture_0_to_7cm", "soil_moisture_7_to_28cm", "soil_moisture_28_to_100cm", "soil_moisture_100_to_255cm"]
+
+# Weather codes are left out, since they cannot be averaged
+DAILY_VARIABLES = ["temperature_2m_max", "temperature_2m_min", "temperature_2m_mean", "precipitation_sum", "rain_sum", "snowfall_sum"]
+
+COLUMNS = DAILY_VARIABLES + stat_columns(HOURLY_VARIABLES)
+
+# Cells over the lake keep their own values instead of moving to the nearest land cell
+PARAMS = {
+	"hourly": HOURLY_VARIABLES,
+	"daily": DAILY_VARIABLES,
+	"temperature_unit": "fahrenheit",
+	"wind_speed_unit": "mph",
+	"precipitation_unit": "inch",
+	"timezone": "America/Chicago",
+	"cell_selection": "nearest"
+}
+
+# Kilometers per degree of latitude
+KM_PER_DEGREE = 111.32
+
+################################################################################
+# CELLS AND MASKS
+################################################################################
+
+def grid_cells(bounds = BOUNDS, resolution = RESOLUTION):
+    """
+    The grid's cells, one row each with a name, the latitude and longitude
+    of its center and its area in km², row by row from the south west.
+    """
+    south, north, west, east = bounds
+    latitudes = np.round(np.arange(south + resolution / 2, north, resolution), 4)
+    longitudes = np.round(np.arange(west + resolution / 2, east, resolution), 4)
+    latitude, longitude = (grid.ravel() for grid in np.meshgrid(latitudes, longitudes, indexing = 'ij'))
+    cells = pd.DataFrame({'name': [f"{lat:.4f},{lon:.4f}" for lat, lon in zip(latitude, longitude)],
+                          'latitude': latitude, 'longitude': longitude})
+    cells['area_km2'] = (KM_PER_DEGREE * resolution) ** 2 * np.cos(np.radians(latitude))
+    return cells
+
+
+def county_masks(cells, counties = COUNTIES):
+    """A (county x cell) boolean array, true where the cell's center is in the county's box."""
+    boxes = np.array(list(counties.values()), dtype = np.float64).reshape(-1, 4)
+    latitude = cells['latitude'].to_numpy()[None, :]
+    longitude = cells['longitude'].to_numpy()[None, :]
+    return ((latitude >= boxes[:, [0]]) & (latitude < boxes[:, [1]])
+            & (longitude >= boxes[:, [2]]) & (longitude < boxes[:, [3]]))
+
+################################################################################
+# FETCH AND REDUCE
+################################################################################
+
+def decode_cell(response, params = PARAMS):
+    """
+    Local day numbers and a (days x variables) float32 array of one cell's
+    daily values followed by the daily means of its hourly values.
+    """
+    offset = response.UtcOffsetSeconds()
+    daily_times, daily = decode_block(response.Daily(), params['daily'])
+    hourly_times, hourly = decode_block(response.Hourly(), params['hourly'])
+    hourly_days = ((hourly_times + offset) // 86400).astype(np.int32)
+    starts = run_starts(hourly_days)
+    days = ((daily_times + offset) // 86400).astype(np.int32)
+    if not np.array_equal(days, hourly_days[starts]):
+        raise ValueError(f"Daily and hourly data of {response.Latitude()}, {response.Longitude()} cover different days")
+    return days, np.concatenate([daily, reduce_runs(hourly, starts, params['hourly'])]).T
+
+
+def fetch_grid(client, cells, params = PARAMS, batch_size = 50, max_workers = 4):
+    """
+    Day numbers and a (cell x day x variable) float32 array of every cell,
+    with the variables in COLUMNS order for the default params.
+
+    Up to max_workers batches are fetched at once; each batch is decoded
+    into the array as it arrives, in order.
+    """
+    parts = batches(cells, batch_size)
+    days, values = None, None
+    with profile.stage('fetch_reduce', cells = len(cells)) as stage:
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            futures = [pool.submit(fetch_chunk, client, URL, batch_params(params, batch)) for batch in parts]
+            first = 0
+            for future in futures:
+                for offset, response in enumerate(future.result()):
+                    cell_days, cell_values = decode_cell(response, params)
+                    if values is None:
+                        days = cell_days
+                        values = np.full((len(cells), len(days), cell_values.shape[1]), np.nan, dtype = np.float32)
+                    elif not np.array_equal(cell_days, days):
+                        raise ValueError(f"Cell {cells['name'].iloc[first + offset]} covers different days")
+                    values[first + offset] = cell_values
+                first += batch_size
+        stage['days'] = 0 if days is None else len(days)
+    return days, values
+
+
+def regional_series(cells, days, values, columns = COLUMNS, counties = COUNTIES):
+    """
+    Area-weighted mean of every variable per region and day, keyed by a
+    categorical 'region' column (REGION for the whole grid, then the
+    counties that have cells) and 'date', with the number of cells behind
+    each region. counties = None gives only the whole grid.
+    """
+    masks = np.ones((1, len(cells)), dtype = bool)
+    regions = [REGION]
+    if counties:
+        county_mask = county_masks(cells, counties)
+        keep = county_mask.any(axis = 1)
+        masks = np.concatenate([masks, county_mask[keep]])
+        regions += [name for name, kept in zip(counties, keep) if kept]
+    weights = masks * cells['area_km2'].to_numpy()
+
+    # Missing values add nothing to the sums and no weight to the totals
+    valid = ~np.isnan(values)
+    sums = np.tensordot(weights, np.where(valid, values, 0), axes = 1)
+    totals = np.tensordot(weights, valid, axes = 1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        means = (sums / totals).astype(np.float32)
+
+    df = pd.DataFrame(means.reshape(-1, len(columns)), columns = list(columns))
+    df.insert(0, 'cells', np.repeat(masks.sum(axis = 1), len(days)))
+    df.insert(0, 'date', np.tile(days, len(regions)).astype('datetime64[D]').astype('datetime64[s]'))
+    df.insert(0, 'region', pd.Categorical.from_codes(np.repeat(np.arange(len(regions)), len(days)), categories = regions))
+    return df
+
+################################################################################
+# SAVE AND LOAD
+################################################################################
+
+def save_grid(path, cells, days, values, columns = COLUMNS):
+    """Save the cells, day numbers and (cell x day x variable) array as one .npz file."""
+    np.savez(path, latitude = cells['latitude'].to_numpy(), longitude = cells['longitude'].to_numpy(),
+             area_km2 = cells['area_km2'].to_numpy(), days = days, values = values, columns = np.array(columns))
+
+
+def load_grid(path):
+    """The (cells, days, values, columns) that save_grid saved."""
+    with np.load(path) as saved:
+        cells = pd.DataFrame({'latitude': saved['latitude'], 'longitude': saved['longitude'], 'area_km2': saved['area_km2']})
+        cells.insert(0, 'name', [f"{lat:.4f},{lon:.4f}" for lat, lon in zip(cells['latitude'], cells['longitude'])])
+        return cells, saved['days'], saved['values'], saved['columns'].tolist()
+
+
+def update_grid(filepath = '', client = None, bounds = BOUNDS, resolution = RESOLUTION, start_date = None, end_date = None,
+                batch_size = 50, max_workers = 4, counties = COUNTIES):
+    """
+    Fetch the grid from start_date to end_date (by default this year to
+    date, as the YTD gatherer), save the cell array and the regional series
+    to the 'Regional' data set and CSV side table.
+    """
+    client = client or shared_client(filepath + '.weather_cache.sqlite')
+    today = date.today()
+    params = {**PARAMS, 'start_date': start_date or f"{today.year}-01-01",
+              'end_date': end_date or (today - timedelta(days = 3)).strftime('%Y-%m-%d')}
+    cells = grid_cells(bounds, resolution)
+    days, values = fetch_grid(client, cells, params, batch_size, max_workers)
+
+    with profile.stage('aggregate', cells = len(cells)) as stage:
+        df = regional_series(cells, days, values, counties = counties)
+        stage['rows'] = len(df)
+    df['year'] = df['date'].dt.year
+
+    with profile.stage('write', rows = len(df)) as stage:
+        save_grid(filepath + store.GRID_FILE, cells, days, values)
+        store.write(df, 'Regional', filepath)
+        df.to_csv(filepath + store.REGIONAL_FILE, index = False)
+        stage['grid_mb'] = round(values.nbytes / 2**20, 1)
+    return df
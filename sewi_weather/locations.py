@@ -0,0 +1,102 @@
+"""
+LOCATION REGISTRY AND BATCHED REQUESTS
+
+Sites are listed in 'locations.csv' (name, latitude, longitude). The API takes
+a list of coordinates in one request and returns one response per coordinate
+in the same order, so sites are fetched in batches and the responses are
+decoded in parallel into long-format data frames keyed by 'location'.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather.aggregate import DailyReducer, local_dates
+from sewi_weather.decode import block_frame, decode_block, decode_frame
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def load_locations(filepath = ''):
+    """Read the location registry as a data frame with name, latitude and longitude."""
+    locations = pd.read_csv(filepath + 'locations.csv', dtype = {'name': str})
+    if locations['name'].duplicated().any():
+        raise ValueError(f"Duplicate location names in {filepath}locations.csv")
+    return locations.reset_index(drop = True)
+
+
+def batches(locations, batch_size = 50):
+    """Split the registry into data frames of at most batch_size sites."""
+    return [locations.iloc[i:i + batch_size] for i in range(0, len(locations), batch_size)]
+
+
+def batch_params(params, batch):
+    """Copy of params asking for every site in the batch in one request."""
+    return {**params, 'latitude': batch['latitude'].tolist(), 'longitude': batch['longitude'].tolist()}
+
+
+def stack_locations(names, frames):
+    """Stack one frame per site under a leading categorical 'location' column."""
+    df = pd.concat(frames, ignore_index = True)
+    codes = np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])
+    df.insert(0, 'location', pd.Categorical.from_codes(codes, categories = list(names)))
+    return df
+
+
+def decode_locations(names, sections, hourly_variables, daily_variables, max_workers = 8):
+    """
+    Decode each site's (hourly, daily) sections in parallel.
+
+    The variable lists are the ones sent in the request. The frames of all
+    sites are stacked with a leading categorical 'location' column, in the
+    order given.
+    """
+    def decode(pair):
+        hourly, daily = pair
+        return decode_frame(hourly, hourly_variables), decode_frame(daily, daily_variables)
+
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        results = list(pool.map(decode, sections))
+
+    return [stack_locations(names, [result[position] for result in results]) for position in (0, 1)]
+
+
+def reduce_locations(names, chunk_stream, hourly_variables, daily_variables, extremes = (), degree_hours = None,
+                     hourly_sink = None):
+    """
+    Daily data and daily statistics of hourly data for every site, chunk by chunk.
+
+    chunk_stream yields (chunk, responses) in date order, as fetch.iter_chunked
+    does, with one response per site in names. Each chunk's hourly values are
+    decoded and reduced to daily means (and the min, max and degree hours
+    asked for, see aggregate.stat_columns) before the next chunk is read, so
+    the full hourly archive is never held in memory. hourly_sink, if given,
+    is called with each chunk's hourly rows for all sites, keyed like the
+    results. Returns (daily_df, means_df), both keyed by a categorical
+    'location' column and the local 'date' at midnight.
+    """
+    names = list(names)
+    reducers = [DailyReducer(hourly_variables, extremes = extremes, degree_hours = degree_hours) for _ in names]
+    daily_parts = [[] for _ in names]
+    for _, responses in chunk_stream:
+        hourly_parts = []
+        for site, response in enumerate(responses):
+            times, block = decode_block(response.Hourly(), hourly_variables)
+            if hourly_sink is not None:
+                hourly_parts.append(block_frame(times, block, hourly_variables))
+            reducers[site].push(times, block, response.UtcOffsetSeconds())
+            daily = decode_frame(response.Daily(), daily_variables)
+            daily['date'] = local_dates(daily['date'], response.UtcOffsetSeconds())
+            daily_parts[site].append(daily)
+        if hourly_sink is not None:
+            hourly_sink(stack_locations(names, hourly_parts))
+
+    daily_df = stack_locations(names, [pd.concat(parts, ignore_index = True) for parts in daily_parts])
+    means_df = stack_locations(names, [reducer.finish() for reducer in reducers])
+    return daily_df, means_df
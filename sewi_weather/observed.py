@@ -0,0 +1,85 @@
+"""
+ARCHIVE REQUEST
+
+The request for observed weather from the open-meteo archive, shared by
+the historical and YTD gatherers and the validation's refetch (see
+validate.py), so all three ask for the same variables and units. The
+cache keys a day by these parameters, so a refetch only drops the cached
+days the gatherers will read if the requests match exactly.
+
+The archive lags a few days behind today, so the gatherers stop at
+last_archive_day(). Only the standard library is imported up front, so the
+pipeline's stage keys can use these dates without loading pandas.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+from datetime import date, timedelta
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Make sure all required weather variables are listed here
+# Responses are decoded by looking up each variable's position in these lists
+HOURLY_VARIABLES = ["soil_temperature_0_to_7cm", "soil_temperature_7_to_28cm", "soil_temperature_28_to_100cm", "soil_temperature_100_to_255cm", "soil_moisture_0_to_7cm", "soil_moisture_7_to_28cm", "soil_moisture_28_to_100cm", "soil_moisture_100_to_255cm"]
+
+DAILY_VARIABLES = ["weather_code", "temperature_2m_max", "temperature_2m_min", "temperature_2m_mean", "precipitation_sum", "rain_sum", "snowfall_sum"]
+
+# Daily min and max of these hourly columns, and growing degree hours (see
+# aggregate.DEGREE_HOUR_BASES), are saved next to the daily means
+EXTREME_VARIABLES = ["soil_temperature_0_to_7cm", "soil_temperature_7_to_28cm", "soil_temperature_28_to_100cm", "soil_temperature_100_to_255cm"]
+
+URL = "https://archive-api.open-meteo.com/v1/archive"
+
+# Days the archive lags behind today. Newer days are missing or provisional.
+ARCHIVE_LAG_DAYS = 3
+
+# Dates are added by each request, and coordinates for each batch of sites from locations.csv
+PARAMS = {
+	"hourly": HOURLY_VARIABLES,
+	"daily": DAILY_VARIABLES,
+	"temperature_unit": "fahrenheit",
+	"wind_speed_unit": "mph",
+	"precipitation_unit": "inch",
+	"timezone": "America/Chicago"
+}
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def last_archive_day(today = None):
+    """The newest day the archive has caught up with, ARCHIVE_LAG_DAYS before today."""
+    return (today or date.today()) - timedelta(days = ARCHIVE_LAG_DAYS)
+
+
+def last_history_day(today = None):
+    """
+    The last day the history holds: December 31 of last year, or
+    last_archive_day() early in January, before the archive has caught up
+    with the end of the year.
+    """
+    today = today or date.today()
+    return min(date(today.year - 1, 12, 31), last_archive_day(today))
+
+
+def daily_rows(names, responses):
+    """Daily rows of archive responses, one per site and day, with the columns the YTD gatherer saves."""
+    import pandas as pd
+
+    from sewi_weather.aggregate import DEGREE_HOUR_BASES, daily_means, local_dates
+    from sewi_weather.locations import decode_locations
+
+    # The sites share the request's timezone
+    utc_offset = responses[0].UtcOffsetSeconds() if len(responses) else 0
+    hourly_df, daily_df = decode_locations(names, [(response.Hourly(), response.Daily()) for response in responses],
+                                           HOURLY_VARIABLES, DAILY_VARIABLES)
+    daily_df['date'] = local_dates(daily_df['date'], utc_offset)
+    daily_df['month'] = daily_df['date'].dt.month
+    daily_df['year'] = daily_df['date'].dt.year
+    means = daily_means(hourly_df, HOURLY_VARIABLES, extremes = EXTREME_VARIABLES, degree_hours = DEGREE_HOUR_BASES,
+                        utc_offset = utc_offset)
+    return pd.merge(daily_df, means, on = ['location', 'date'])
@@ -0,0 +1,276 @@
+"""
+PIPELINE RUNNER
+
+Runs the pipeline as explicit stages with dependencies. Stages whose
+dependencies have finished run concurrently on a thread pool, so the
+independent fetches overlap. A failed stage only blocks the stages that
+depend on it.
+
+Each stage has a fingerprint built from its input files, an optional key
+(e.g. today's date for the YTD fetch) and the fingerprints of the stages it
+depends on. When the fingerprint matches the last successful run and the
+stage's outputs exist, the stage is skipped. Every stage that runs is
+timed and profiled (see profile.py).
+
+A run holds the pipeline lock (LOCK_FILE) while it runs, and the forecast
+poller takes the same lock before it reads or rewrites the stores, so the
+two never write the same data set at once.
+
+Only the standard library is imported here, and stages import what they
+need when they run, so a scheduled run where every stage is skipped
+finishes in a fraction of a second.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    import msvcrt
+    fcntl = None
+
+from sewi_weather import profile
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Lock file shared by pipeline runs and the forecast poller, next to the state file
+LOCK_FILE = '.pipeline.lock'
+
+################################################################################
+# STAGES
+################################################################################
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    run is called with no arguments. depends names the stages that must
+    finish first. inputs are files whose contents feed the fingerprint,
+    outputs are files or folders that must exist for the stage to be
+    skipped, and key is a callable returning any extra string that should
+    invalidate the stage when it changes.
+    """
+
+    def __init__(self, name, run, depends = (), inputs = (), outputs = (), key = None):
+        self.name = name
+        self.run = run
+        self.depends = list(depends)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.key = key
+
+################################################################################
+# FINGERPRINTS
+################################################################################
+
+def fingerprint(stage, dependency_prints = ()):
+    """Hash of a stage's name, input file contents, key and dependency fingerprints."""
+    digest = hashlib.sha1(stage.name.encode())
+    for path in stage.inputs:
+        digest.update(path.encode())
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha1(f.read()).digest())
+    if stage.key is not None:
+        digest.update(str(stage.key()).encode())
+    for dependency_print in dependency_prints:
+        digest.update(dependency_print.encode())
+    return digest.hexdigest()
+
+
+def _load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(path, state):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent = 1, sort_keys = True)
+    os.replace(path + '.tmp', path)
+
+################################################################################
+# LOCK
+################################################################################
+
+@contextmanager
+def pipeline_lock(path = LOCK_FILE):
+    """
+    Hold an exclusive lock on path while the block runs, waiting for any
+    other process (a pipeline run or the forecast poller) that holds it.
+    The lock is released when the process ends, even if it crashes.
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # LK_LOCK gives up after 10 seconds, so keep trying
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+################################################################################
+# RUNNER
+################################################################################
+
+def _check(stages):
+    names = {stage.name for stage in stages}
+    if len(names) != len(stages):
+        raise ValueError("Stage names must be unique")
+    for stage in stages:
+        unknown = set(stage.depends) - names
+        if unknown:
+            raise ValueError(f"Stage {stage.name!r} depends on unknown stages {sorted(unknown)}")
+
+    # Kahn's algorithm; anything left over is part of a cycle
+    remaining = {stage.name: set(stage.depends) for stage in stages}
+    while remaining:
+        ready = [name for name, depends in remaining.items() if not depends]
+        if not ready:
+            raise ValueError(f"Stages {sorted(remaining)} have a dependency cycle")
+        for name in ready:
+            del remaining[name]
+        for depends in remaining.values():
+            depends.difference_update(ready)
+
+
+def _timed(name, run):
+    # Steps the stage records itself show up in the run report as 'name/step'
+    start = time.perf_counter()
+    with profile.stage(name):
+        run()
+    return time.perf_counter() - start
+
+
+def _current(stage, state, stage_print):
+    return state.get(stage.name) == stage_print and all(os.path.exists(output) for output in stage.outputs)
+
+
+def plan(stages, state_path = '.pipeline_state.json'):
+    """
+    Which stages the next run would start, without running any: one dict
+    per stage with its name and status ('current' or 'due').
+    """
+    _check(stages)
+    by_name = {stage.name: stage for stage in stages}
+    state = _load_state(state_path)
+    prints = {}
+
+    def print_of(name):
+        if name not in prints:
+            stage = by_name[name]
+            prints[name] = fingerprint(stage, [print_of(d) for d in stage.depends])
+        return prints[name]
+
+    return [{'stage': stage.name, 'status': 'current' if _current(stage, state, print_of(stage.name)) else 'due'}
+            for stage in stages]
+
+
+def run_stages(stages, state_path = '.pipeline_state.json', max_workers = 4, force = False, only = None):
+    """
+    Run stages in dependency order and return one dict per stage, holding
+    the pipeline lock next to state_path.
+
+    Each dict has the stage, its status ('ran', 'skipped', 'failed' or
+    'blocked'), wall time in seconds and any error. force runs every stage
+    even when its fingerprint is unchanged. only names the stages to run;
+    the others are left as they are, their dependents use what they saved
+    last, and they are not in the result.
+    """
+    _check(stages)
+    if only is not None:
+        unknown = set(only) - {stage.name for stage in stages}
+        if unknown:
+            raise ValueError(f"Unknown stages {sorted(unknown)}")
+    by_name = {stage.name: stage for stage in stages}
+    prints = {}
+    results = {}
+    pending = [stage.name for stage in stages]
+    running = {}
+
+    def finish(name, status, seconds = 0.0, error = ''):
+        results[name] = {'stage': name, 'status': status, 'seconds': round(seconds, 3), 'error': error}
+
+    # No forecast poller or other run writes the stores while this one runs
+    with pipeline_lock(os.path.join(os.path.dirname(state_path), LOCK_FILE)):
+        state = _load_state(state_path)
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            while pending or running:
+                # Start or resolve every stage whose dependencies are done
+                ready = [name for name in pending if all(d in results for d in by_name[name].depends)]
+                for name in ready:
+                    pending.remove(name)
+                    stage = by_name[name]
+                    if any(results[d]['status'] in ('failed', 'blocked') for d in stage.depends):
+                        finish(name, 'blocked', error = 'a dependency failed')
+                        continue
+                    prints[name] = fingerprint(stage, [prints[d] for d in stage.depends])
+                    if only is not None and name not in only:
+                        # Dependents fingerprint what the stage saved last time it ran
+                        prints[name] = state.get(name, prints[name])
+                        finish(name, 'not selected')
+                        continue
+                    if not force and _current(stage, state, prints[name]):
+                        finish(name, 'skipped')
+                        continue
+                    print(f"Stage {name}: starting")
+                    running[pool.submit(_timed, name, stage.run)] = (name, time.perf_counter())
+                if ready or not running:
+                    continue
+
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    name, started = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        finish(name, 'ran', future.result())
+                        state[name] = prints[name]
+                        _save_state(state_path, state)
+                    else:
+                        traceback.print_exception(error)
+                        finish(name, 'failed', time.perf_counter() - started, repr(error))
+                    print(f"Stage {name}: {results[name]['status']} in {results[name]['seconds']} s")
+
+    return [results[stage.name] for stage in stages if results[stage.name]['status'] != 'not selected']
+
+
+def run_pipeline(stages, state_path = '.pipeline_state.json', max_workers = 4, force = False, only = None):
+    """run_stages() with the result as a data frame, one row per stage."""
+    import pandas as pd
+
+    return pd.DataFrame(run_stages(stages, state_path, max_workers = max_workers, force = force, only = only))
+
+
+def format_report(rows):
+    """run_stages() or plan() rows as a text table with right-aligned columns."""
+    if not rows:
+        return ''
+    table = [list(rows[0])] + [[str(value) for value in row.values()] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(table[0]))]
+    return '\n'.join(' '.join(value.rjust(width) for value, width in zip(line, widths)) for line in table)
@@ -0,0 +1,255 @@
+"""
+INTRADAY FORECAST POLLER
+
+A long-running asyncio service that keeps the forecast rows of the combined
+CSV current between pipeline runs, without rerunning the combiner. Every
+interval it fetches only the forecast endpoint and hashes the decoded values
+(forecast.forecast_digest). When the hash matches the last poll nothing is
+written. When a new model run changed it, the poller checks the forecast
+rows as the pipeline's validation does (validate.check) and rewrites the
+'Prediction' data set and its quality mask, adds a snapshot to the forecast archive, computes
+the rolling features of the prediction rows on top of the saved tail and
+the YTD rows, updates the planting events of the years the forecast
+covers, and rewrites the CSV and those years of the 'Combined' data set.
+
+The historical and YTD rows do not change between forecasts, so they are
+read and rendered as CSV text once, and again only when the pipeline
+rewrites their stores, the CSV is written by someone else, or the day
+changes. A refresh renders only the forecast rows and writes them after
+each site's settled rows, so it takes a fraction of a second instead of
+the combiner's full read and write.
+
+Fetches and refreshes run in worker threads, so the event loop stays free
+to keep the schedule. Loading and refreshing hold the pipeline lock
+(pipeline.pipeline_lock), so they wait for a pipeline run that is writing
+the same stores, and a run waits for them.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import asyncio
+import os
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import profile, store
+from sewi_weather.archive import archive_forecast
+from sewi_weather.combine import COMBINED_FILE, combine_sources, combined_frame, compact, relative_date, weather_code_category
+from sewi_weather.events import update_events
+from sewi_weather.features import rolling_features
+from sewi_weather.forecast import DAILY_VARIABLES, HOURLY_VARIABLES, PARAMS, URL, forecast_digest, summarize_forecast
+from sewi_weather.locations import batch_params, batches, decode_locations
+from sewi_weather.pipeline import LOCK_FILE, pipeline_lock
+from sewi_weather.validate import check, expected_range
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Data sets the settled rows are built from; the poller reloads when any changes
+SETTLED_STORES = ['Historical', 'YTD', 'Features', 'Feature State']
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def _stamp(filepath = ''):
+    return date.today(), [store.version(name, filepath) for name in SETTLED_STORES]
+
+
+def _mtime(path):
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def render_blocks(df):
+    """
+    CSV text of df without a header, as {location: text of its rows}. df must
+    be sorted by location, as the combined frame is.
+    """
+    lines = df.to_csv(index = False, header = False).splitlines(keepends = True)
+    names = df['location'].astype(str).to_numpy()
+    edges = np.flatnonzero(np.append(True, names[1:] != names[:-1]))
+    ends = np.append(edges[1:], len(names))
+    return {names[start]: ''.join(lines[start:end]) for start, end in zip(edges, ends)}
+
+################################################################################
+# POLLER
+################################################################################
+
+class ForecastPoller:
+    """
+    Polls the forecast and refreshes the prediction rows when it changes.
+
+    client has the weather_api method of openmeteo_requests.Client; wrap it
+    in a cache.CachedClient whose forecast days expire at once so every poll
+    sees the latest model run and the pipeline can reuse it. locations is
+    the registry from locations.load_locations. Sites are fetched in batches
+    of batch_size, concurrently.
+    """
+
+    def __init__(self, client, locations, filepath = '', interval = 900, batch_size = 50, first_year = 1940):
+        self.client = client
+        self.locations = locations
+        self.filepath = filepath
+        self.interval = interval
+        self.batch_size = batch_size
+        self.first_year = first_year
+        self.digest = None
+        self._stamp = None
+        self._written = None
+
+    def load(self):
+        """Read the settled rows, the feature tail after them, and render them as CSV text."""
+        filepath = self.filepath
+        years = range(self.first_year, date.today().year)
+        with profile.stage('load') as stage:
+            hist_df = store.read('Historical', filepath, years = years)
+            ytd_df = store.read('YTD', filepath)
+            pred_df = store.read('Prediction', filepath)
+            hist_features = store.read('Features', filepath, years = years)
+            tail = store.read('Feature State', filepath)
+
+            # The same frame the combiner saves, so the columns and types match
+            full_df, _ = combined_frame(hist_df, ytd_df, pred_df, hist_features, tail)
+            full_df['relative_date'] = relative_date(full_df['date'], date.today())
+            settled = full_df[(full_df['Data Source'] != 'Prediction').to_numpy()]
+            stage['rows'] = len(settled)
+
+            self.dtypes = full_df.dtypes
+            self.header = full_df.head(0).to_csv(index = False)
+            self.settled = settled
+            self.settled_keys = pd.MultiIndex.from_arrays([settled['location'].astype(str), settled['date']])
+            self.last_settled = settled.groupby(settled['location'].astype(str))['date'].max()
+            self.blocks = render_blocks(settled)
+            # Windows of forecast rows reach back into the YTD rows
+            _, self.tail = rolling_features(settled[(settled['Data Source'] == 'YTD').to_numpy()], tail = tail)
+            self._stamp = _stamp(filepath)
+
+    def locked(self, function, *args):
+        """Call function while holding the pipeline lock."""
+        with pipeline_lock(self.filepath + LOCK_FILE):
+            return function(*args)
+
+    def stale(self):
+        """True when the settled rows must be loaded again."""
+        return self._stamp != _stamp(self.filepath)
+
+    def fetch(self, batch):
+        """One forecast request for a batch of sites; returns their (hourly, daily) sections and UTC offset."""
+        responses = self.client.weather_api(URL, params = batch_params(PARAMS, batch))
+        return [(response.Hourly(), response.Daily()) for response in responses], responses[0].UtcOffsetSeconds()
+
+    def prediction_rows(self, pred_df):
+        """Combined-frame rows for the forecast days the settled rows do not have."""
+        keys = pd.MultiIndex.from_arrays([pred_df['location'].astype(str), pred_df['date']])
+        df = combine_sources({'Prediction': pred_df[~keys.isin(self.settled_keys)]})
+        compact(df)
+        df['weather_code_category'] = weather_code_category(df['weather_code'])
+        features, _ = rolling_features(df, tail = self.tail)
+        df = df.join(features.astype(np.float32))
+        df['relative_date'] = relative_date(df['date'], date.today())
+        return df.reindex(columns = self.dtypes.index).astype(self.dtypes.to_dict())
+
+    def refresh(self, names, sections, utc_offset = 0):
+        """
+        Rewrite the prediction data set, this year's events, the CSV and this
+        year's partition of the combined data set from new forecast sections
+        and their UTC offset. Call it while holding the pipeline lock (see locked).
+        """
+        filepath = self.filepath
+        with profile.stage('decode') as stage:
+            hourly_df, daily_df = decode_locations(names, sections, HOURLY_VARIABLES, DAILY_VARIABLES)
+            stage['rows'] = len(hourly_df) + len(daily_df)
+        daily_df = summarize_forecast(hourly_df, daily_df, utc_offset)
+
+        # The rows skip the pipeline's validation stage, so they are checked here
+        with profile.stage('validate', rows = len(daily_df)) as stage:
+            daily_df, quality, _ = check(daily_df, *expected_range('Prediction'))
+            stage['flagged'] = len(quality)
+
+        with profile.stage('write_prediction', rows = len(daily_df)):
+            store.write(daily_df, 'Prediction', filepath)
+            store.write(quality, 'Prediction Quality', filepath)
+            # Read back so the rows have the types the combiner reads
+            pred_df = store.read('Prediction', filepath)
+
+        with profile.stage('snapshot') as stage:
+            stage['rows'] = archive_forecast(pred_df, filepath)
+
+        rows = self.prediction_rows(pred_df)
+        last = self.last_settled.reindex(rows['location'].astype(str)).to_numpy()
+        if np.any(rows['date'].to_numpy() <= last):
+            # A forecast day fills a gap inside the settled rows; rebuild them with it
+            self.load()
+            rows = self.prediction_rows(pred_df)
+
+        # Events of the years the forecast covers; the other years are kept
+        with profile.stage('events', rows = len(rows)) as stage:
+            years = rows['date'].dt.year.unique()
+            current = self.settled[self.settled['date'].dt.year.isin(years).to_numpy()]
+            recent = pd.concat([current, rows], ignore_index = True)
+            stage['events'] = len(update_events(recent, filepath))
+
+        with profile.stage('write', rows = len(self.settled) + len(rows)):
+            forecast_blocks = render_blocks(rows)
+            path = filepath + COMBINED_FILE
+            with open(path + '.tmp', 'w', newline = '') as f:
+                f.write(self.header)
+                for name in sorted(set(self.blocks) | set(forecast_blocks)):
+                    f.write(self.blocks.get(name, ''))
+                    f.write(forecast_blocks.get(name, ''))
+            os.replace(path + '.tmp', path)
+            self._written = _mtime(path)
+            store.write(recent, 'Combined', filepath, mode = 'partitions')
+
+    async def poll(self):
+        """
+        Fetch the forecast once and refresh if it changed. Returns a record
+        with the poll time, status ('changed', 'unchanged' or 'failed'),
+        seconds and the profiler records of its steps.
+        """
+        started = time.perf_counter()
+        record = {'polled': datetime.now().isoformat(timespec = 'seconds')}
+        try:
+            # The pipeline rewrote the stores or the CSV since the last poll
+            if self._written != _mtime(self.filepath + COMBINED_FILE) or self.stale():
+                await asyncio.to_thread(self.locked, self.load)
+                self.digest = None
+
+            with profile.stage('fetch', sites = len(self.locations)):
+                parts = await asyncio.gather(*(asyncio.to_thread(self.fetch, batch)
+                                               for batch in batches(self.locations, self.batch_size)))
+            names = list(self.locations['name'])
+            sections = [section for part, _ in parts for section in part]
+            utc_offset = parts[0][1] if parts else 0
+            digest = await asyncio.to_thread(forecast_digest, names, sections)
+
+            if digest == self.digest:
+                record['status'] = 'unchanged'
+            else:
+                await asyncio.to_thread(self.locked, self.refresh, names, sections, utc_offset)
+                self.digest = digest
+                record['status'] = 'changed'
+        except Exception as error:
+            record.update(status = 'failed', error = repr(error))
+        record['seconds'] = round(time.perf_counter() - started, 3)
+        record['steps'] = profile.profiler.take()
+        return record
+
+    async def run(self, polls = None):
+        """Poll every interval seconds, polls times or forever, printing one line per poll."""
+        count = 0
+        while polls is None or count < polls:
+            started = time.monotonic()
+            record = await self.poll()
+            count += 1
+            steps = ', '.join(f"{step['stage']} {step['seconds']} s" for step in record['steps'])
+            print(f"{record['polled']} forecast {record['status']} in {record['seconds']} s"
+                  + (f" ({steps})" if steps else '') + (f": {record['error']}" if 'error' in record else ''))
+            if polls is None or count < polls:
+                await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
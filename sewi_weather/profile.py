@@ -0,0 +1,161 @@
+"""
+RUN PROFILING
+
+Records wall time and peak memory for each stage of a run, along with
+fields such as row counts and bytes received that the stage fills in, and
+writes them to one JSON report per run in the 'run_reports' folder.
+
+Stages nest: a stage opened while another is running in the same thread is
+named after it, e.g. 'ytd/fetch' inside the pipeline's 'ytd' stage. Memory
+is the resident size of the whole process, sampled in the background while
+any stage is open, so stages running side by side see each other's memory.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Print decoded frames and per-site details when SEWI_WEATHER_DEBUG is set
+DEBUG = os.environ.get('SEWI_WEATHER_DEBUG', '') not in ('', '0')
+
+REPORT_FOLDER = 'run_reports'
+
+################################################################################
+# MEMORY
+################################################################################
+
+def current_rss():
+    """Resident memory of this process in bytes, or the peak so far where that is all there is."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+################################################################################
+# PROFILER
+################################################################################
+
+class Profiler:
+    """Collects one record per stage for the current run."""
+
+    def __init__(self, interval = 0.02):
+        self.interval = interval
+        self.started = datetime.now()
+        self.records = []
+        self._clock = time.perf_counter()
+        self._open = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sampler = None
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                rss = current_rss()
+                for record in self._open:
+                    record['_peak'] = max(record['_peak'], rss)
+            time.sleep(self.interval)
+
+    def nested(self):
+        """True while a stage is open in this thread."""
+        return bool(getattr(self._local, 'prefix', ''))
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """
+        Time a stage and track its peak memory.
+
+        Yields the stage's record, a dict the caller can add fields to, such
+        as rows or bytes_received.
+        """
+        prefix = getattr(self._local, 'prefix', '')
+        rss = current_rss()
+        record = {'stage': prefix + name, 'status': 'ok', **fields, '_peak': rss}
+        start = time.perf_counter()
+        with self._lock:
+            self._open.append(record)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target = self._sample, daemon = True)
+                self._sampler.start()
+        self._local.prefix = record['stage'] + '/'
+        try:
+            yield record
+        except BaseException as error:
+            # sys.exit(0) is how a script says it had nothing to do
+            if not (isinstance(error, SystemExit) and error.code in (None, 0)):
+                record['status'] = 'failed'
+            raise
+        finally:
+            self._local.prefix = prefix
+            end = time.perf_counter()
+            with self._lock:
+                self._open.remove(record)
+                peak = max(record.pop('_peak'), current_rss())
+                record.update(start_s = round(start - self._clock, 3), seconds = round(end - start, 3),
+                              rss_start_mb = round(rss / 2**20, 1), peak_rss_mb = round(peak / 2**20, 1))
+                self.records.append(record)
+
+    def take(self):
+        """Return the records so far and start a new list, as a long-running service does after each poll."""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def report(self):
+        """The run report as a dict, with stages in the order they started."""
+        return {'started': self.started.isoformat(timespec = 'seconds'),
+                'finished': datetime.now().isoformat(timespec = 'seconds'),
+                'python': platform.python_version(),
+                'argv': sys.argv,
+                'stages': sorted(self.records, key = lambda record: record['start_s'])}
+
+    def write(self, folder):
+        """Write the run report to folder/run-<start time>.json and return its path."""
+        os.makedirs(folder, exist_ok = True)
+        path = os.path.join(folder, f"run-{self.started:%Y%m%d-%H%M%S}.json")
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent = 1, default = str)
+        return path
+
+
+profiler = Profiler()
+
+stage = profiler.stage
+
+
+def finish(filepath = ''):
+    """
+    Write the run report, unless this is a script running inside a pipeline
+    stage, in which case the pipeline writes one report for the whole run.
+    """
+    if profiler.nested():
+        return None
+    path = profiler.write(filepath + REPORT_FOLDER)
+    print(f"Run report saved to {path}")
+    return path
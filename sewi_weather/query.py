@@ -0,0 +1,304 @@
+"""
+QUERY API OVER THE COMBINED DATA
+
+Serves slices of the combined data set (the 'Combined' store the combiner
+and the forecast poller write next to the CSV) so consumers that need the
+last 30 days or one metric do not download and parse the whole CSV.
+
+WeatherQuery loads the store once and keeps it in memory sorted by location
+and date, with each location's rows as one block. A date range is found by
+a binary search on that location's day numbers, so a request costs a few
+microseconds per location plus the rows it returns. The store is loaded
+again when its files change (checked at most once a second).
+
+Every response carries an ETag built from the store version and the
+normalized request. A client that sends it back in If-None-Match gets a
+304 without a body while the data is unchanged, and rendered bodies are
+kept in a small LRU cache. Until the pipeline has saved the combined data
+set, requests get a 503 saying so.
+
+make_server wraps it in an HTTP service:
+
+    GET /weather?days=30&location=Milwaukee&columns=temperature_2m_mean&format=csv
+    GET /weather?start=2024-04-01&end=2024-05-31&location=Racine&location=Kenosha
+    GET /info
+
+start and end are inclusive dates, days counts back from today (or from
+end), columns are comma-separated and location may repeat. format is 'csv'
+(the default) or 'json'.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.aggregate import day_number
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Columns every response starts with
+KEY_COLUMNS = ['location', 'date']
+
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'json': 'application/json'}
+
+TEXT = {'Content-Type': 'text/plain; charset=utf-8'}
+
+# Seconds a client is asked to wait before trying again while there is no data
+RETRY_AFTER = 60
+
+################################################################################
+# IN-MEMORY INDEX
+################################################################################
+
+class Snapshot:
+    """The combined data set sorted by location and date, with each location's row range."""
+
+    def __init__(self, df, version):
+        codes, names = pd.factorize(df['location'].astype(str), sort = True)
+        days = day_number(df['date'])
+        order = np.lexsort((days, codes))
+        self.df = df.take(order).reset_index(drop = True)
+        self.days = days[order]
+        self.version = version
+        self.columns = KEY_COLUMNS + [c for c in self.df.columns if c not in KEY_COLUMNS]
+        edges = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        self.bounds = {name: (edges[i], edges[i + 1]) for i, name in enumerate(names)}
+
+
+class WeatherQuery:
+    """
+    Date-range, column and location queries over the combined data set.
+
+    filepath is where the pipeline saves its data sets. check_every is how
+    many seconds a loaded version is trusted before the store is checked
+    for changes, and cache_size how many rendered bodies are kept.
+    """
+
+    def __init__(self, filepath = '', check_every = 1.0, cache_size = 256):
+        self.filepath = filepath
+        self.check_every = check_every
+        self.cache_size = cache_size
+        self._snapshot = None
+        self._checked = -np.inf
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        The loaded data, loaded again first if the store changed. Raises
+        FileNotFoundError while the pipeline has not saved it yet.
+        """
+        with self._lock:
+            if self._snapshot is None and not store.exists('Combined', self.filepath):
+                raise FileNotFoundError(f"No combined data in '{store.store_path('Combined', self.filepath)}' yet; "
+                                        f"run the pipeline first")
+            if time.monotonic() - self._checked >= self.check_every:
+                version = store.version('Combined', self.filepath)
+                if self._snapshot is None or version != self._snapshot.version:
+                    try:
+                        self._snapshot = Snapshot(store.read('Combined', self.filepath), version)
+                    except Exception:
+                        # The pipeline may be rewriting the store; keep serving what was loaded
+                        if self._snapshot is None:
+                            raise
+                self._checked = time.monotonic()
+            return self._snapshot
+
+    def select(self, start = None, end = None, days = None, columns = None, locations = None, snapshot = None):
+        """
+        Rows of the combined data as a data frame with 'location', 'date' and
+        the columns asked for (all by default), sorted by location and date.
+
+        start and end are inclusive dates; days keeps that many days up to
+        end, or up to today when end is not given. locations defaults to all.
+        Unknown columns or locations raise ValueError. snapshot pins the data
+        to one loaded version.
+        """
+        snapshot = snapshot or self.snapshot()
+        first, last = _day_range(start, end, days)
+
+        names = list(snapshot.bounds) if locations is None else list(locations)
+        unknown = [name for name in names if name not in snapshot.bounds]
+        if unknown:
+            raise ValueError(f"Unknown locations {unknown}")
+        if columns is None:
+            columns = snapshot.columns
+        else:
+            unknown = [column for column in columns if column not in snapshot.columns]
+            if unknown:
+                raise ValueError(f"Unknown columns {unknown}")
+            columns = KEY_COLUMNS + [column for column in columns if column not in KEY_COLUMNS]
+
+        ranges = []
+        for name in names:
+            low, high = snapshot.bounds[name]
+            block = snapshot.days[low:high]
+            ranges.append(np.arange(low + np.searchsorted(block, first, 'left'),
+                                    low + np.searchsorted(block, last, 'right')))
+        rows = np.concatenate(ranges) if ranges else np.array([], dtype = np.int64)
+        positions = [snapshot.df.columns.get_loc(column) for column in columns]
+        return snapshot.df.iloc[rows, positions].reset_index(drop = True)
+
+    def respond(self, params, if_none_match = None):
+        """
+        (status, headers, body) for a /weather request, given its query
+        parameters as parse_qs returns them and its If-None-Match header.
+        """
+        try:
+            request, format = parse_request(params)
+        except ValueError as error:
+            return 400, TEXT, str(error).encode()
+
+        try:
+            snapshot = self.snapshot()
+        except FileNotFoundError as error:
+            return 503, {**TEXT, 'Retry-After': str(RETRY_AFTER)}, str(error).encode()
+        # days counts back from today, so the same request means other rows tomorrow
+        key = json.dumps([snapshot.version, str(date.today()), format, request], sort_keys = True)
+        etag = '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, headers, b''
+
+        with self._lock:
+            body = self._bodies.get(etag)
+            if body is not None:
+                self._bodies.move_to_end(etag)
+        if body is None:
+            try:
+                df = self.select(**request, snapshot = snapshot)
+            except ValueError as error:
+                return 400, TEXT, str(error).encode()
+            body = render(df, format)
+            with self._lock:
+                self._bodies[etag] = body
+                while len(self._bodies) > self.cache_size:
+                    self._bodies.popitem(last = False)
+        return 200, {**headers, 'Content-Type': FORMATS[format]}, body
+
+    def info(self):
+        """Locations, columns and date range of the loaded data."""
+        snapshot = self.snapshot()
+        dates = snapshot.df['date']
+        return {'locations': list(snapshot.bounds), 'columns': snapshot.columns, 'rows': len(snapshot.df),
+                'first_date': str(dates.min().date()) if len(dates) else None,
+                'last_date': str(dates.max().date()) if len(dates) else None,
+                'version': snapshot.version}
+
+    def respond_info(self):
+        """(status, headers, body) for an /info request."""
+        try:
+            return 200, {'Content-Type': FORMATS['json']}, json.dumps(self.info()).encode()
+        except FileNotFoundError as error:
+            return 503, {**TEXT, 'Retry-After': str(RETRY_AFTER)}, str(error).encode()
+
+################################################################################
+# REQUESTS
+################################################################################
+
+def _day_range(start, end, days):
+    # Inclusive first and last day numbers
+    first = np.iinfo(np.int32).min if start is None else int(day_number(np.datetime64(pd.Timestamp(start).date())))
+    last = np.iinfo(np.int32).max if end is None else int(day_number(np.datetime64(pd.Timestamp(end).date())))
+    if days is not None:
+        if start is not None:
+            raise ValueError("Give start or days, not both")
+        if days < 1:
+            raise ValueError("days must be at least 1")
+        anchor = last if end is not None else int(day_number(np.datetime64(date.today())))
+        first = anchor - days + 1
+    return first, last
+
+
+def parse_request(params):
+    """
+    select() keyword arguments and the format from /weather query parameters.
+    Raises ValueError for unknown parameters or values that do not parse.
+    """
+    unknown = set(params) - {'start', 'end', 'days', 'columns', 'location', 'format'}
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}")
+
+    def single(name):
+        values = params.get(name, [])
+        if len(values) > 1:
+            raise ValueError(f"{name} is given more than once")
+        return values[0] if values else None
+
+    request = {}
+    for name in ('start', 'end'):
+        if single(name) is not None:
+            try:
+                request[name] = str(pd.Timestamp(single(name)).date())
+            except ValueError:
+                raise ValueError(f"{name} must be a date like 2024-04-01") from None
+    if single('days') is not None:
+        if not single('days').isdigit():
+            raise ValueError("days must be a whole number")
+        request['days'] = int(single('days'))
+    if 'columns' in params:
+        request['columns'] = [column for value in params['columns'] for column in value.split(',') if column]
+    if 'location' in params:
+        request['locations'] = list(params['location'])
+    format = single('format') or 'csv'
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
+    _day_range(request.get('start'), request.get('end'), request.get('days'))
+    return request, format
+
+
+def render(df, format = 'csv'):
+    """Response body for a selection, with dates as YYYY-MM-DD."""
+    if format == 'json':
+        df = df.assign(date = df['date'].dt.strftime('%Y-%m-%d'))
+        return df.to_json(orient = 'records').encode()
+    return df.to_csv(index = False).encode()
+
+################################################################################
+# HTTP SERVICE
+################################################################################
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Routes GET /weather and GET /info to the server's WeatherQuery."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/weather':
+            status, headers, body = self.server.query.respond(parse_qs(url.query), self.headers.get('If-None-Match'))
+        elif url.path == '/info':
+            status, headers, body = self.server.query.respond_info()
+        else:
+            status, headers, body = 404, TEXT, b"Try /weather or /info"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(query, host = '127.0.0.1', port = 8765, verbose = False):
+    """A threaded HTTP server answering from query; call serve_forever() on it."""
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.query = query
+    server.verbose = verbose
+    return server
@@ -0,0 +1,199 @@
+"""
+PIPELINE STAGES
+
+The stages of the full pipeline run (see pipeline.py): the three gatherers
+(see gather.py), the ensemble forecast spread, the validation of each fetched data set,
+the forecast skill backtest, the historical features, the climatology and
+the combine step that saves the combined CSV, the planting events and the
+'Combined' data set. The combiner script and the sewi-weather command both
+run these.
+
+Building the stage list imports nothing beyond the standard library.
+Module files that feed a fingerprint are found by path instead of being
+imported, and each stage imports pandas, pyarrow and the modules it calls
+when it runs, so a run where every stage is skipped never loads them.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import os
+from datetime import date, datetime
+
+from sewi_weather import profile, store
+from sewi_weather.observed import last_history_day
+from sewi_weather.pipeline import Stage
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+PACKAGE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+FETCH_STAGES = ['historical', 'ytd', 'prediction', 'ensemble']
+
+COMBINE_STAGES = ['validate_historical', 'validate_ytd', 'validate_prediction', 'features', 'climatology', 'skill', 'combine']
+
+################################################################################
+# STAGE FUNCTIONS
+################################################################################
+
+def module_file(name):
+    """Path of a sewi_weather module, without importing it."""
+    return os.path.join(PACKAGE_FOLDER, name + '.py')
+
+
+def historical(filepath = ''):
+    """Append the archive days after each site's watermark to the history."""
+    from sewi_weather.gather import historical as gather_historical
+
+    gather_historical(filepath)
+
+
+def ytd(filepath = ''):
+    """Save this year's archive days."""
+    from sewi_weather.gather import ytd as gather_ytd
+
+    gather_ytd(filepath)
+
+
+def prediction(filepath = ''):
+    """Save the forecast days and keep a snapshot of them."""
+    from sewi_weather.gather import prediction as gather_prediction
+
+    gather_prediction(filepath)
+
+
+def ensemble(filepath = ''):
+    """Fetch the ensemble forecast and save its daily spread and probabilities."""
+    from sewi_weather.ensemble import update_ensemble
+
+    update_ensemble(filepath)
+
+
+def validate(filepath = '', name = 'Historical'):
+    """Check a fetched data set, fill short gaps and fetch missing archive days again."""
+    from sewi_weather.validate import validate_data_sets
+
+    validate_data_sets(filepath, [name])
+
+
+def skill(filepath = ''):
+    """Score the archived forecasts against the observed days."""
+    from sewi_weather.archive import update_skill
+
+    update_skill(filepath)
+
+
+def features(filepath = ''):
+    """Update the saved rolling features of the historical rows."""
+    from sewi_weather.features import update_history_features
+
+    update_history_features(filepath)
+
+
+def climatology(filepath = ''):
+    """Fold newly closed years into the day-of-year climatology side table."""
+    from sewi_weather.climatology import update_climatology
+
+    update_climatology(filepath)
+
+
+def combine(filepath = '', first_year = 1940):
+    """Combine the saved data sets, add rolling features and save the CSV."""
+    from sewi_weather.combine import combined_frame, relative_date
+    from sewi_weather.events import update_events
+
+    # Read in data, with the historical rolling features saved by the features stage
+    with profile.stage('read') as stage:
+        hist_df = store.read('Historical', filepath, years = range(first_year, date.today().year))
+
+        ytd_df = store.read('YTD', filepath)
+
+        pred_df = store.read('Prediction', filepath)
+
+        hist_features = store.read('Features', filepath, years = range(first_year, date.today().year))
+
+        tail = store.read('Feature State', filepath)
+        stage['rows'] = len(hist_df) + len(ytd_df) + len(pred_df)
+
+    # Combine data, one row per site and date. Where sources overlap the
+    # historical row wins over YTD, and YTD over prediction (SOURCE_PRIORITY).
+    # Labels are categoricals and measurements float32, weather codes are looked
+    # up in a table by number, and the rolling 7 and 14 calendar day averages and
+    # sums of YTD and prediction rows continue from the saved tail (see
+    # sewi_weather.combine.combined_frame and sewi_weather.features).
+    full_df, gaps = combined_frame(hist_df, ytd_df, pred_df, hist_features, tail)
+
+    if len(gaps):
+        print(f"{gaps['days'].sum()} days are missing; rolling windows that cover them are left empty")
+        if profile.DEBUG:
+            print(gaps)
+
+    # Planting threshold dates per site and year, projected with the forecast
+    # for this year (see sewi_weather.events). Unchanged site-years are kept.
+    with profile.stage('events', rows = len(full_df)) as stage:
+        stage['events'] = len(update_events(full_df, filepath))
+
+    full_df['relative_date'] = relative_date(full_df['date'], date.today())
+
+    # Save data as CSV, and to the store for the query API (see sewi_weather.query)
+    with profile.stage('write', rows = len(full_df)) as stage:
+        stage['memory_mb'] = round(full_df.memory_usage(deep = True).sum() / 2**20, 1)
+        full_df.to_csv(filepath + store.COMBINED_FILE, index=False)
+        store.write(full_df, 'Combined', filepath)
+
+################################################################################
+# STAGE LIST
+################################################################################
+
+def pipeline_stages(filepath = '', first_year = 1940):
+    """
+    The pipeline's stages. Each key decides how long a stage's output stays
+    current: the historical archive gains a year in the first days of
+    January, once the archive has caught up with December 31, YTD data a
+    day, forecasts every hour and the ensembles every six hours. The
+    forecast skill is scored once a day, and the historical features and
+    the climatology only change with the history. Each data set has its own
+    validation stage, so the hourly forecasts only reach the combine step.
+    """
+    locations_file = filepath + 'locations.csv'
+
+    gather_inputs = [locations_file, module_file('gather')]
+
+    validate_inputs = [module_file('validate'), module_file('observed')]
+
+    return [
+        Stage('historical', lambda: historical(filepath),
+              inputs = gather_inputs + [module_file('observed')], outputs = [store.store_path('Historical', filepath)],
+              key = lambda: last_history_day()),
+        Stage('ytd', lambda: ytd(filepath),
+              inputs = gather_inputs + [module_file('observed')], outputs = [store.store_path('YTD', filepath)],
+              key = lambda: date.today()),
+        Stage('prediction', lambda: prediction(filepath),
+              inputs = gather_inputs + [module_file('forecast')], outputs = [store.store_path('Prediction', filepath)],
+              key = lambda: datetime.now().strftime('%Y-%m-%d %H')),
+        Stage('ensemble', lambda: ensemble(filepath),
+              inputs = [locations_file, module_file('ensemble')],
+              outputs = [store.store_path('Ensemble', filepath), filepath + store.ENSEMBLE_FILE],
+              key = lambda: f"{date.today()} run {datetime.now().hour // 6}"),
+        Stage('validate_historical', lambda: validate(filepath, 'Historical'), depends = ['historical'],
+              inputs = validate_inputs, outputs = [filepath + store.QUALITY_STATE]),
+        Stage('validate_ytd', lambda: validate(filepath, 'YTD'), depends = ['ytd'],
+              inputs = validate_inputs, outputs = [filepath + store.QUALITY_STATE]),
+        Stage('validate_prediction', lambda: validate(filepath, 'Prediction'), depends = ['prediction'],
+              inputs = validate_inputs, outputs = [filepath + store.QUALITY_STATE]),
+        Stage('skill', lambda: skill(filepath), depends = ['validate_historical', 'validate_ytd'],
+              inputs = [module_file('archive')], outputs = [filepath + store.SKILL_FILE],
+              key = lambda: date.today()),
+        Stage('features', lambda: features(filepath), depends = ['validate_historical'],
+              inputs = [module_file('features')],
+              outputs = [store.store_path('Features', filepath), store.store_path('Feature State', filepath)]),
+        Stage('climatology', lambda: climatology(filepath), depends = ['features'],
+              inputs = [module_file('climatology')], outputs = [filepath + store.CLIMATOLOGY_FILE]),
+        Stage('combine', lambda: combine(filepath, first_year), depends = ['features', 'validate_ytd', 'validate_prediction'],
+              inputs = [module_file('stages'), module_file('combine'), module_file('events')],
+              outputs = [filepath + store.COMBINED_FILE, filepath + store.EVENTS_FILE, store.store_path('Combined', filepath)],
+              key = lambda: f"{date.today()} from {first_year}"),
+    ]
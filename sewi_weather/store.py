@@ -0,0 +1,182 @@
+"""
+COLUMNAR STORAGE FOR THE WEATHER DATA PIPELINE
+
+Each data set (Historical, YTD, Prediction) is saved as a directory of Parquet
+files partitioned by year, e.g. 'MKE Weather Data Historical/year=1940/'.
+Columns keep their types between steps, so dates come back as datetime64
+instead of strings, and readers can load only the columns and years they need.
+
+Hourly data sets can be saved as uncompressed Arrow IPC files instead
+(format = 'ipc'). They take more disk than Parquet but are read through a
+memory map, so only the pages of the columns and years asked for are loaded.
+
+pandas and pyarrow are imported on the first read or write, so checking
+paths and versions (as the pipeline does before skipping a stage) stays
+cheap for scheduled runs with nothing to do.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import hashlib
+import os
+import shutil
+import uuid
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+EXTENSIONS = {'parquet': '.parquet', 'ipc': '.arrow'}
+
+# CSV files the pipeline saves next to the store
+COMBINED_FILE = 'MKE Weather Data CUMULATIVE.csv'
+
+EVENTS_FILE = 'MKE Weather Data Events.csv'
+
+CLIMATOLOGY_FILE = 'MKE Weather Data Climatology.csv'
+
+ENSEMBLE_FILE = 'MKE Weather Data Ensemble.csv'
+
+SKILL_FILE = 'MKE Weather Data Forecast Skill.csv'
+
+REGIONAL_FILE = 'MKE Weather Data Regional.csv'
+
+# The grid's (cell x day x variable) array, see sewi_weather.grid
+GRID_FILE = 'MKE Weather Data Grid.npz'
+
+# Versions of the data sets the validation stage last checked, see sewi_weather.validate
+QUALITY_STATE = '.quality_state.json'
+
+# The climatology's values by site, day of the year and year, see sewi_weather.climatology
+CLIMATOLOGY_STATE = '.climatology_state.npz'
+
+# Rows are buffered into groups of at least this many per file. Frames sorted
+# by location would otherwise give each year file one small group per site,
+# which makes reading several times slower.
+MIN_ROWS_PER_GROUP = 2**16
+
+################################################################################
+# FUNCTIONS
+################################################################################
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([('year', pa.int32())]), flavor = 'hive')
+
+
+def store_path(name, filepath = ''):
+    """Return the directory holding the data set, e.g. 'MKE Weather Data YTD'."""
+    return filepath + 'MKE Weather Data ' + name
+
+
+def exists(name, filepath = ''):
+    """True when the data set has been written at least once."""
+    return os.path.isdir(store_path(name, filepath))
+
+
+def _format(path):
+    """'ipc' when the data set was saved as Arrow IPC files, else 'parquet'."""
+    for _, _, files in os.walk(path):
+        for file in files:
+            return 'ipc' if file.endswith(EXTENSIONS['ipc']) else 'parquet'
+    return 'parquet'
+
+
+def write(df, name, filepath = '', mode = 'overwrite', format = 'parquet'):
+    """
+    Save a daily or hourly data frame to the store.
+
+    mode = 'overwrite' replaces the whole data set, mode = 'append' adds new
+    files next to the existing ones and mode = 'partitions' replaces only the
+    years df has rows for. The frame needs 'date' and 'year'
+    columns; dates are saved as days unless they have times of day. format
+    is 'parquet' or 'ipc' (Arrow IPC, read through a memory map).
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    path = store_path(name, filepath)
+    if mode == 'overwrite' and os.path.isdir(path):
+        shutil.rmtree(path)
+
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+    df['year'] = df['year'].astype('int32')
+    daily = bool((df['date'] == df['date'].dt.normalize()).all())
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    if daily:
+        table = table.set_column(table.schema.get_field_index('date'), 'date',
+                                 table['date'].cast(pa.date32()))
+
+    ds.write_dataset(table, path, format = format, partitioning = _partitioning(),
+                     basename_template = 'part-' + uuid.uuid4().hex + '-{i}' + EXTENSIONS[format],
+                     min_rows_per_group = MIN_ROWS_PER_GROUP,
+                     existing_data_behavior = 'delete_matching' if mode == 'partitions' else 'overwrite_or_ignore')
+
+
+def read(name, filepath = '', columns = None, years = None):
+    """
+    Load a data set as a data frame.
+
+    columns limits which columns are read from disk and years limits which
+    year partitions are opened. Rows come back sorted by date.
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+
+    path = store_path(name, filepath)
+    dataset = ds.dataset(path, format = _format(path), partitioning = _partitioning(),
+                         filesystem = pafs.LocalFileSystem(use_mmap = True))
+
+    if columns is not None:
+        columns = list(dict.fromkeys(['date'] + list(columns)))
+    row_filter = None
+    if years is not None:
+        row_filter = ds.field('year').isin([int(y) for y in years])
+
+    table = dataset.to_table(columns = columns, filter = row_filter)
+    table = table.sort_by('date')
+    return table.to_pandas(date_as_object = False, split_blocks = True, self_destruct = True)
+
+
+def watermarks(name, filepath = ''):
+    """Return the last date stored for each location as a Series indexed by location."""
+    import pandas as pd
+
+    if not exists(name, filepath):
+        return pd.Series(dtype = 'datetime64[ms]')
+    df = read(name, filepath, columns = ['location'])
+    return df.groupby('location')['date'].max()
+
+
+def version(name, filepath = ''):
+    """
+    Hash of the data set's file names, sizes and modification times. It
+    changes with every write, without reading any data.
+    """
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(store_path(name, filepath))):
+        for file in sorted(files):
+            info = os.stat(os.path.join(root, file))
+            digest.update(f"{root}/{file}:{info.st_size}:{info.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def year_versions(name, filepath = ''):
+    """Like version, for each year partition on its own, as {year: hash}."""
+    versions = {}
+    for root, _, files in sorted(os.walk(store_path(name, filepath))):
+        folder = os.path.basename(root)
+        if not folder.startswith('year='):
+            continue
+        digest = hashlib.sha1()
+        for file in sorted(files):
+            info = os.stat(os.path.join(root, file))
+            digest.update(f"{file}:{info.st_size}:{info.st_mtime_ns}".encode())
+        versions[int(folder[len('year='):])] = digest.hexdigest()
+    return versions
@@ -0,0 +1,261 @@
+"""
+SYNTHETIC OPEN-METEO RESPONSES
+
+Builds FlatBuffers responses with the same layout the open-meteo API returns,
+so the fetch and decode code can be exercised without network access.
+Values are a deterministic function of the timestamp, which means a range
+fetched in chunks decodes to exactly the same numbers as one big request.
+
+Requests with several models get one response per site and model. Ensemble
+requests tag every variable with its name's Variable, altitude and depth
+and its member, as the ensemble API does, and each member drifts away from
+the control run as the lead time grows.
+
+The benchmarks also get random daily frames shaped like the gatherers'
+output here, for steps that start from the saved data sets.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import threading
+import time
+import zlib
+
+import flatbuffers
+import numpy as np
+import pandas as pd
+from openmeteo_requests import OpenMeteoRequestsError
+from openmeteo_sdk.Model import Model
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from sewi_weather.ensemble import MODELS, variable_key
+from sewi_weather.fetch import request_range
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Central Standard Time, the offset open-meteo reports for America/Chicago in winter
+UTC_OFFSET = -21600
+
+# Daily variables the API sends as int64 instead of float32
+INT64_VARIABLES = {'sunrise', 'sunset'}
+
+WEATHER_CODES = np.array([0, 1, 2, 3, 45, 51, 53, 61, 63, 71, 73, 80, 95], dtype = np.float32)
+
+# Columns of the synthetic daily frames, as the historical gatherer saves them
+DAILY_COLUMNS = ['weather_code', 'temperature_2m_max', 'temperature_2m_min', 'temperature_2m_mean',
+                 'precipitation_sum', 'rain_sum', 'snowfall_sum',
+                 'soil_temperature_0_to_7cm_mean', 'soil_temperature_7_to_28cm_mean',
+                 'soil_temperature_28_to_100cm_mean', 'soil_temperature_100_to_255cm_mean',
+                 'soil_moisture_0_to_7cm_mean', 'soil_moisture_7_to_28cm_mean',
+                 'soil_moisture_28_to_100cm_mean', 'soil_moisture_100_to_255cm_mean']
+
+################################################################################
+# SYNTHETIC VALUES
+################################################################################
+
+def synthetic_values(name, times):
+    """Plausible values for a variable at the given unix timestamps."""
+    t = times.astype(np.float64)
+    day_of_year = (t / 86400.0) % 365.25
+    season = -np.cos(2 * np.pi * day_of_year / 365.25)
+    hour = (t / 3600.0) % 24
+    noise = ((times * 2654435761) % 1000).astype(np.float64) / 1000.0 - 0.5
+    # Small per-variable offset so no two variables share the same values
+    checksum = zlib.crc32(name.encode())
+    seed = checksum % 7
+    tag = (checksum % 1000) / 1000.0
+
+    if name in INT64_VARIABLES:
+        return (times + (6 if name == 'sunrise' else 18) * 3600).astype(np.int64)
+    if name == 'weather_code':
+        return WEATHER_CODES[(times // 86400 + seed) % len(WEATHER_CODES)]
+    if name.startswith('soil_moisture'):
+        values = 0.3 + 0.05 * season + 0.02 * noise + tag / 100
+    elif name.startswith('precipitation_probability'):
+        values = 50 + 50 * noise
+    elif name.endswith('_sum') or name.startswith('uv_index') or name == 'daylight_duration':
+        values = np.clip(0.2 + noise, 0, None) * (1 + seed + tag)
+    elif name.startswith('soil_temperature'):
+        values = 45 + 20 * season + 2 * np.sin(2 * np.pi * hour / 24) / (1 + seed) + noise + tag
+    else:
+        values = 47 + 25 * season + 8 * np.sin(2 * np.pi * hour / 24) + 4 * noise + seed + tag
+    return values.astype(np.float32)
+
+
+def member_offset(model, member, times):
+    """Deterministic drift (°F) of an ensemble member from the control run, growing with lead time."""
+    if member == 0:
+        return np.zeros(len(times), dtype = np.float32)
+    z = zlib.crc32(f"{model}/{member}".encode()) % 2001 / 1000.0 - 1.0
+    return (z * 0.8 * (times - times[0]) / 86400.0).astype(np.float32)
+
+################################################################################
+# FLATBUFFERS BUILDER
+################################################################################
+
+def _build_section(builder, names, start, end, interval, model = None, members = None):
+    times = np.arange(start, end, interval, dtype = np.int64)
+    variables = []
+    for member in range(members or 1):
+        for name in names:
+            values = synthetic_values(name, times)
+            if members is not None:
+                values = values + member_offset(model, member, times)
+            vector = builder.CreateNumpyVector(values)
+            builder.StartObject(13)
+            if values.dtype == np.int64:
+                builder.PrependUOffsetTRelativeSlot(4, vector, 0)
+            else:
+                builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+            if members is not None:
+                variable, altitude, depth, depth_to = variable_key(name)
+                builder.PrependUint8Slot(0, variable, 0)
+                builder.PrependInt16Slot(5, altitude, 0)
+                builder.PrependInt16Slot(8, depth, 0)
+                builder.PrependInt16Slot(9, depth_to, 0)
+                builder.PrependInt16Slot(10, member, 0)
+            variables.append(builder.EndObject())
+
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    vector = builder.EndVector()
+
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, end, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+    return builder.EndObject()
+
+
+def build_response(latitude, longitude, start_date, end_date, hourly = (), daily = (), location_id = 0,
+                   model = None, members = None):
+    """
+    Return one length-prefixed FlatBuffers message, as found in the API body.
+
+    start_date and end_date are inclusive local dates ('YYYY-MM-DD'). model
+    is a model name, and members the number of ensemble members to send.
+    """
+    start = int(pd.Timestamp(start_date).timestamp()) - UTC_OFFSET
+    end = int((pd.Timestamp(end_date) + pd.Timedelta(days = 1)).timestamp()) - UTC_OFFSET
+
+    builder = flatbuffers.Builder(1024)
+    timezone = builder.CreateString('America/Chicago')
+    abbreviation = builder.CreateString('CST')
+    hourly_section = _build_section(builder, hourly, start, end, 3600, model, members) if hourly else None
+    daily_section = _build_section(builder, daily, start, end, 86400, model, members) if daily else None
+
+    builder.StartObject(15)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependFloat32Slot(2, 270.0, 0)
+    builder.PrependInt64Slot(4, location_id, 0)
+    if model is not None:
+        builder.PrependUint8Slot(5, getattr(Model, model), 0)
+    builder.PrependInt32Slot(6, UTC_OFFSET, 0)
+    builder.PrependUOffsetTRelativeSlot(7, timezone, 0)
+    builder.PrependUOffsetTRelativeSlot(8, abbreviation, 0)
+    if daily_section is not None:
+        builder.PrependUOffsetTRelativeSlot(10, daily_section, 0)
+    if hourly_section is not None:
+        builder.PrependUOffsetTRelativeSlot(11, hourly_section, 0)
+    builder.Finish(builder.EndObject())
+
+    message = bytes(builder.Output())
+    return len(message).to_bytes(4, byteorder = 'little') + message
+
+
+def parse_body(data):
+    """Split an API body into WeatherApiResponse objects, like openmeteo_requests does."""
+    responses = []
+    pos = 0
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], byteorder = 'little')
+        responses.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+        pos += length + 4
+    return responses
+
+################################################################################
+# STAND-IN CLIENT
+################################################################################
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+class SyntheticClient:
+    """
+    Local stand-in for openmeteo_requests.Client.
+
+    fail_first makes the first n calls raise OpenMeteoRequestsError, and
+    seconds_per_mb adds a transfer delay proportional to the response size.
+    members sets the member count of every ensemble model instead of
+    ensemble.MODELS. calls and bytes_received count what the client has served.
+    """
+
+    def __init__(self, fail_first = 0, seconds_per_mb = 0.0, members = None):
+        self.fail_first = fail_first
+        self.seconds_per_mb = seconds_per_mb
+        self.members = members
+        self.calls = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def body(self, url, params):
+        start_date, end_date = request_range(params)
+        latitudes = _as_list(params['latitude'])
+        longitudes = _as_list(params['longitude'])
+        models = _as_list(params['models']) if 'models' in params else [None]
+        ensemble = url.rstrip('/').endswith('/ensemble')
+        return b''.join(build_response(lat, lon, start_date, end_date,
+                                       hourly = params.get('hourly', ()), daily = params.get('daily', ()),
+                                       location_id = i, model = model,
+                                       members = (self.members or MODELS.get(model, 1)) if ensemble else None)
+                        for i, (lat, lon) in enumerate(zip(latitudes, longitudes)) for model in models)
+
+    def weather_api(self, url, params, **kwargs):
+        with self._lock:
+            self.calls += 1
+            fail = self.calls <= self.fail_first
+        if fail:
+            raise OpenMeteoRequestsError(f"failed to request {url!r}: synthetic failure")
+        data = self.body(url, params)
+        with self._lock:
+            self.bytes_received += len(data)
+        if self.seconds_per_mb:
+            time.sleep(self.seconds_per_mb * len(data) / 2**20)
+        return parse_body(data)
+
+################################################################################
+# SYNTHETIC DAILY DATA
+################################################################################
+
+def synthetic_daily(first_year, last_year, seed = 0):
+    """Daily frame shaped like the historical gatherer output."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(f'{first_year}-01-01', f'{last_year}-12-31', freq = 'D')
+    df = pd.DataFrame({'date': dates})
+    for column in DAILY_COLUMNS:
+        df[column] = rng.normal(50, 15, len(dates)).astype('float32')
+    df['weather_code'] = rng.choice([0, 1, 2, 3, 51, 61, 71], len(dates)).astype('float32')
+    df['month'] = dates.month
+    df['year'] = dates.year
+    return df
+
+
+def synthetic_sites(sites, first_year, last_year):
+    """Daily frames for several sites stacked, with a few missing values."""
+    frames = []
+    for i in range(sites):
+        site_df = synthetic_daily(first_year, last_year, seed = i)
+        site_df.insert(0, 'location', f"Site {i}")
+        site_df.loc[site_df.index[(i + 1) * 1000::7919], 'temperature_2m_mean'] = np.nan
+        frames.append(site_df)
+    full_df = pd.concat(frames, ignore_index = True)
+    full_df['location'] = full_df['location'].astype('category')
+    return full_df
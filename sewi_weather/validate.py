@@ -0,0 +1,353 @@
+"""
+DATA QUALITY VALIDATION AND GAP FILLING
+
+Runs between the gatherers and the combine step. Nothing else checks what
+the API returned, and a missing day, a run of NaN soil values or a
+response cut short before its end date would otherwise leave 7 to 14 days
+of rolling features empty in the combined data.
+
+check() takes a saved daily data set and, for all sites and columns at once:
+  - keeps the last of any rows that repeat a site and day
+  - adds the days missing between each site's first day and the expected
+    last day, which is how a truncated response shows up
+  - removes values outside the physical ranges in RANGES
+  - fills gaps of at most MAX_FILL_DAYS days inside a site's data by linear
+    interpolation
+and returns the clean rows, a quality mask of one uint8 per site, day and
+column (bits in FLAGS, only for days with any flag set) and the runs of
+days that are still missing. Values are placed in a dense (site x day x
+column) array, so each step is a handful of array operations whatever the
+number of sites.
+
+Within one response, time order is guaranteed by decoding rows as
+Time() + k * Interval() (see decode.section_times), and fetch.stitch rejects
+chunks that leave a gap or overlap.
+
+validate_data_sets() checks the 'Historical', 'YTD' and 'Prediction' data
+sets that changed since their last check. Archive days that are still
+missing are fetched again with the gatherers' request (see observed.py),
+only those date ranges and sites, after their cached copies are dropped.
+Data sets that were repaired are saved again (historical years only where
+something changed), and the mask is saved as '<name> Quality'.
+"""
+
+################################################################################
+# LOAD LIBRARIES
+################################################################################
+
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import profile, store
+from sewi_weather.aggregate import day_number, run_starts
+from sewi_weather.cache import shared_client
+from sewi_weather.locations import batch_params, load_locations
+from sewi_weather.observed import PARAMS, URL, daily_rows
+
+################################################################################
+# SET PARAMETERS
+################################################################################
+
+# Bits of the quality mask. A filled value is flagged both MISSING and FILLED.
+MISSING = 1        # no value from the API, or removed as out of range
+OUT_OF_RANGE = 2   # outside RANGES
+FILLED = 4         # filled by interpolation
+ADDED = 8          # the day was not in the data at all
+DUPLICATE = 16     # the day came more than once; the last row was kept
+REFETCHED = 32     # fetched again from the API by the validation
+
+FLAGS = {'missing': MISSING, 'out_of_range': OUT_OF_RANGE, 'filled': FILLED,
+         'added': ADDED, 'duplicate': DUPLICATE, 'refetched': REFETCHED}
+
+# (column pattern, lowest, highest) in the pipeline's units (°F, inches,
+# m³/m³); the first matching pattern applies
+RANGES = [
+    (r'.*_degree_hours_.*', 0, 24 * 100),
+    (r'temperature_2m.*', -60, 130),
+    (r'soil_temperature.*', -40, 130),
+    (r'soil_moisture.*', 0, 1),
+    (r'(precipitation|rain)_sum', 0, 20),
+    (r'snowfall_sum', 0, 60),
+    (r'precipitation_probability.*', 0, 100),
+    (r'uv_index.*', 0, 20),
+    (r'daylight_duration', 0, 86400),
+    (r'weather_code', 0, 99),
+]
+
+# Columns that are not measurements, and measurements that are not interpolated
+KEY_COLUMNS = ['location', 'date', 'month', 'year']
+
+NOT_FILLED = ['weather_code']
+
+# Longest gap, in days, that is filled by interpolation
+MAX_FILL_DAYS = 3
+
+# Most date ranges fetched again per data set and run
+REFETCH_LIMIT = 20
+
+# Data sets that are checked, and those whose missing days can be fetched again
+DATA_SETS = ['Historical', 'YTD', 'Prediction']
+
+REFETCH = ['Historical', 'YTD']
+
+_state_lock = threading.Lock()
+
+################################################################################
+# CHECKS
+################################################################################
+
+def column_range(column):
+    """(lowest, highest) allowed value of a column; infinite when RANGES has none."""
+    for pattern, low, high in RANGES:
+        if re.fullmatch(pattern, column):
+            return low, high
+    return -np.inf, np.inf
+
+
+def fill_gaps(values, max_days = MAX_FILL_DAYS):
+    """
+    Fill NaN runs of at most max_days along axis 1 of a (site x day) array
+    in place, by linear interpolation between the values on either side.
+    Runs at the start or end of a site are left alone. Returns the mask of
+    filled values.
+    """
+    span = values.shape[1]
+    valid = ~np.isnan(values)
+    index = np.arange(span, dtype = np.int32)[None, :]
+    before = np.maximum.accumulate(np.where(valid, index, -1), axis = 1)
+    after = np.minimum.accumulate(np.where(valid, index, span)[:, ::-1], axis = 1)[:, ::-1]
+    filled = ~valid & (before >= 0) & (after < span) & (after - before - 1 <= max_days)
+    if filled.any():
+        low = np.take_along_axis(values, np.clip(before, 0, span - 1), axis = 1)
+        high = np.take_along_axis(values, np.clip(after, 0, span - 1), axis = 1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            step = (index - before) / (after - before)
+        values[filled] = (low + (high - low) * step)[filled]
+    return filled
+
+
+def missing_runs(missing, names, first_day):
+    """
+    Runs of missing days in a (site x day) boolean array, as a frame with
+    'location', 'start' and 'end' dates, one row per run.
+    """
+    # A padding column between sites keeps runs from joining across them
+    padded = np.pad(missing, ((0, 0), (1, 1))).ravel().astype(np.int8)
+    change = np.diff(padded)
+    starts, ends = np.flatnonzero(change == 1), np.flatnonzero(change == -1) - 1
+    width = missing.shape[1] + 2
+    site = starts // width
+    to_date = lambda positions: (positions % width + first_day).astype('datetime64[D]').astype('datetime64[s]')
+    return pd.DataFrame({'location': pd.Categorical.from_codes(site, categories = names),
+                         'start': to_date(starts), 'end': to_date(ends)})
+
+
+def check(df, start = None, end = None, refetched = None, max_fill_days = MAX_FILL_DAYS):
+    """
+    Validate a daily data frame with 'location' and 'date' columns.
+
+    Each site should cover every day from its own first day (or start, if
+    earlier) to the last day of any site (or end, if later). Of rows that
+    repeat a site and day, the last one wins. refetched marks rows that
+    were fetched again; their days are flagged REFETCHED.
+
+    Returns (clean_df, quality, gaps): the clean rows sorted by site and day,
+    with 'month' and 'year', measurements as float32; the quality flags of
+    every column for days with any flag set; and the runs of days where a
+    column that is interpolated is still missing.
+    """
+    columns = [column for column in df.columns if column not in KEY_COLUMNS]
+    location = df['location'].astype('category').cat
+    names = [str(name) for name in location.categories]
+    code = location.codes.to_numpy(dtype = np.int64)
+    day = day_number(df['date'])
+
+    # Sort by site and day, keeping the input order within a day, so the
+    # last row of every site and day is the one kept
+    order = np.lexsort((np.arange(len(df)), day, code))
+    code, day = code[order], day[order]
+    kept = np.ones(len(order), dtype = bool)
+    kept[:-1] = (code[1:] != code[:-1]) | (day[1:] != day[:-1])
+    repeated = np.zeros(len(order), dtype = bool)
+    repeated[1:] = ~kept[:-1]
+    rows, code, day, repeated = order[kept], code[kept], day[kept], repeated[kept]
+
+    # Dense (site x day x column) arrays over every expected day
+    start_day = day_number(np.datetime64(pd.Timestamp(start).date())) if start is not None else None
+    end_day = day_number(np.datetime64(pd.Timestamp(end).date())) if end is not None else None
+    first_day = int(day.min()) if len(day) else (start_day or 0)
+    last_day = int(day.max()) if len(day) else (first_day - 1 if end_day is None else end_day)
+    if start_day is not None:
+        first_day = min(first_day, start_day)
+    if end_day is not None:
+        last_day = max(last_day, end_day)
+    span = last_day - first_day + 1
+
+    # Rows are sorted by site, so each site's first row holds its first day
+    site_first = np.full(len(names), last_day + 1, dtype = np.int64)
+    starts = run_starts(code)
+    site_first[code[starts]] = day[starts]
+    if start_day is not None:
+        site_first = np.where(site_first <= last_day, np.minimum(site_first, start_day), site_first)
+    expected = np.arange(first_day, last_day + 1)[None, :] >= site_first[:, None]
+
+    values = np.full((len(names), span, len(columns)), np.nan, dtype = np.float32)
+    values[code, day - first_day] = df[columns].to_numpy(dtype = np.float32)[rows]
+    flags = np.zeros(values.shape, dtype = np.uint8)
+    present = np.zeros((len(names), span), dtype = bool)
+    present[code, day - first_day] = True
+    flags[code[repeated], day[repeated] - first_day] |= DUPLICATE
+    flags[expected & ~present] |= ADDED
+    if refetched is not None:
+        again = np.asarray(refetched)[rows]
+        flags[code[again], day[again] - first_day] |= REFETCHED
+
+    lows, highs = np.array([column_range(column) for column in columns], dtype = np.float32).reshape(-1, 2).T
+    with np.errstate(invalid = 'ignore'):
+        outside = (values < lows) | (values > highs)
+    values[outside] = np.nan
+    flags[outside] |= OUT_OF_RANGE
+    flags[np.isnan(values)] |= MISSING
+
+    fill = [j for j, column in enumerate(columns) if column not in NOT_FILLED]
+    for j in fill:
+        flags[:, :, j][fill_gaps(values[:, :, j], max_fill_days)] |= FILLED
+    still_missing = np.isnan(values[:, :, fill]).any(axis = 2) & expected
+
+    site, offset = np.nonzero(expected)
+    dates = (offset + first_day).astype('datetime64[D]').astype('datetime64[s]')
+    clean_df = pd.DataFrame(values[site, offset], columns = columns, copy = False)
+    clean_df.insert(0, 'date', dates)
+    clean_df.insert(0, 'location', pd.Categorical.from_codes(site, categories = names))
+    clean_df['month'] = clean_df['date'].dt.month.astype(np.int32)
+    clean_df['year'] = clean_df['date'].dt.year.astype(np.int32)
+    # Columns in the input's order, so repaired years match the saved ones
+    clean_df = clean_df[[column for column in df.columns if column in clean_df.columns]
+                        + [column for column in clean_df.columns if column not in df.columns]]
+
+    mask = flags[site, offset]
+    flagged = mask.any(axis = 1)
+    quality = pd.DataFrame(mask[flagged], columns = columns, copy = False)
+    quality.insert(0, 'date', dates[flagged])
+    quality.insert(0, 'location', pd.Categorical.from_codes(site[flagged], categories = names))
+    quality['year'] = quality['date'].dt.year
+    return clean_df, quality, missing_runs(still_missing, names, first_day)
+
+
+def summarize(quality):
+    """Number of values carrying each flag, as a dict keyed like FLAGS."""
+    mask = quality.drop(columns = ['location', 'date', 'year']).to_numpy()
+    return {name: int(np.count_nonzero(mask & bit)) for name, bit in FLAGS.items()}
+
+################################################################################
+# REFETCH
+################################################################################
+
+def refetch(client, locations, gaps, limit = REFETCH_LIMIT):
+    """
+    Fetch the days of each gap again, one request per date range for every
+    site that misses it, after dropping those days from the cache. At most
+    limit date ranges are fetched. Sites no longer in locations are skipped.
+    """
+    sites = locations.set_index('name')
+    gaps = gaps[gaps['location'].astype(str).isin(sites.index)]
+    frames = []
+    for (start, end), group in list(gaps.groupby(['start', 'end']))[:limit]:
+        batch = sites.loc[group['location'].astype(str)].reset_index()
+        request = batch_params({**PARAMS, 'start_date': str(start.date()), 'end_date': str(end.date())}, batch)
+        if hasattr(client, 'forget'):
+            client.forget(URL, request)
+        frames.append(daily_rows(batch['name'], client.weather_api(URL, params = request)))
+    return pd.concat(frames, ignore_index = True) if frames else pd.DataFrame()
+
+################################################################################
+# VALIDATION STAGE
+################################################################################
+
+def expected_range(name, today = None):
+    """(start, end) every site of a data set should cover; None leaves it to the data."""
+    today = today or date.today()
+    if name == 'Historical':
+        return None, date(today.year - 1, 12, 31)
+    if name == 'YTD':
+        # As the YTD gatherer requests it
+        return date(today.year, 1, 1), today - timedelta(days = 3)
+    return None, None
+
+
+def validate_data_set(name, filepath = '', client = None, today = None):
+    """
+    Check one data set, fetch still missing archive days again and save the
+    repaired rows and the quality mask. Returns the flag counts.
+    """
+    start, end = expected_range(name, today)
+    with profile.stage('read') as stage:
+        df = store.read(name, filepath)
+        stage['rows'] = len(df)
+    with profile.stage('check', rows = len(df)) as stage:
+        clean_df, quality, gaps = check(df, start, end)
+        stage['gaps'] = len(gaps)
+
+    if name in REFETCH and len(gaps):
+        with profile.stage('refetch', ranges = min(len(gaps.groupby(['start', 'end'])), REFETCH_LIMIT)) as stage:
+            new = refetch(client or shared_client(filepath + '.weather_cache.sqlite'), load_locations(filepath), gaps)
+            stage['rows'] = len(new)
+        if len(new):
+            both = pd.concat([df, new], ignore_index = True)
+            refetched = np.arange(len(both)) >= len(df)
+            clean_df, quality, gaps = check(both, start, end, refetched = refetched)
+
+    counts = summarize(quality)
+    with profile.stage('write', rows = len(clean_df)) as stage:
+        repaired = quality.drop(columns = ['location', 'date', 'year']).to_numpy() & ~np.uint8(MISSING)
+        years = quality['year'][repaired.any(axis = 1)].unique()
+        if len(years) and name == 'Historical':
+            store.write(clean_df[clean_df['year'].isin(years)], name, filepath, mode = 'partitions')
+            # Saved features of repaired years would be stale, so the features stage rebuilds them
+            shutil.rmtree(store.store_path('Features', filepath), ignore_errors = True)
+        elif len(years):
+            store.write(clean_df, name, filepath)
+        store.write(quality, name + ' Quality', filepath)
+        stage['years'] = len(years)
+    print(f"{name}: {counts['duplicate']} duplicate days, {counts['added']} missing days, "
+          f"{counts['out_of_range']} values out of range, {counts['filled']} filled, "
+          f"{counts['refetched']} refetched, {len(gaps)} gaps left")
+    return counts
+
+
+def _read_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def validate_data_sets(filepath = '', names = DATA_SETS, client = None, today = None):
+    """
+    Validate the named data sets that changed since they were last checked,
+    as recorded in store.QUALITY_STATE. The validation stages of different
+    data sets run side by side and share the state file, so each only
+    updates its own entries.
+    """
+    state_path = filepath + store.QUALITY_STATE
+    checked = {}
+    for name in names:
+        if not store.exists(name, filepath) or _read_state(state_path).get(name, {}).get('version') == store.version(name, filepath):
+            continue
+        with profile.stage(name.lower()):
+            counts = validate_data_set(name, filepath, client, today)
+        checked[name] = {'version': store.version(name, filepath), 'checked': str(date.today()), **counts}
+
+    with _state_lock:
+        state = {**_read_state(state_path), **checked}
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(state, f, indent = 1, sort_keys = True)
+        os.replace(state_path + '.tmp', state_path)
+    return state
@@ -0,0 +1,223 @@
+"""
+Pandas reference implementations of the vectorized steps. The tests check
+the package against them, and the benchmarks time the package against them.
+The faults the validation has to find are injected here for both as well.
+"""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import ensemble, grid
+from sewi_weather.aggregate import local_dates
+from sewi_weather.climatology import PERCENTILES, day_of_year
+from sewi_weather.combine import WMO_CODES
+from sewi_weather.events import EVENTS
+from sewi_weather.features import WINDOWS
+
+################################################################################
+# DECODE
+################################################################################
+
+def decode_by_variable(section, variables):
+    """The decoding the gatherers used before sewi_weather.decode: one array and one dict entry per variable."""
+    data = {"date": pd.date_range(
+        start = pd.to_datetime(section.Time(), unit = "s"),
+        end = pd.to_datetime(section.TimeEnd(), unit = "s"),
+        freq = pd.Timedelta(seconds = section.Interval()),
+        inclusive = "left"
+    )}
+    for i, name in enumerate(variables):
+        data[name] = section.Variables(i).ValuesAsNumpy()
+    return pd.DataFrame(data = data)
+
+################################################################################
+# AGGREGATE
+################################################################################
+
+def means_by_date_objects(hourly_df, soiltemp, soilmoist):
+    """The aggregation the gatherers used before sewi_weather.aggregate, on UTC days."""
+    hourly_df = hourly_df.rename(columns = {'date' : 'datetime'})
+    hourly_df['date'] = pd.to_datetime(hourly_df['datetime']).dt.date
+    hourly_df['time'] = pd.to_datetime(hourly_df['datetime']).dt.time
+    avgsoiltemp = hourly_df.groupby(['location', 'date'])[soiltemp].mean().add_suffix('_mean')
+    avgsoilmoist = hourly_df.groupby(['location', 'date'])[soilmoist].mean().add_suffix('_mean')
+    return pd.merge(avgsoiltemp, avgsoilmoist, on = ['location', 'date']).reset_index()
+
+
+def stats_by_groupby(hourly_df, variables, extremes = (), degree_hours = None, utc_offset = 0):
+    """Daily mean, min, max and degree hours with a pandas groupby on local days."""
+    day = local_dates(hourly_df['date'], utc_offset)
+    grouped = hourly_df.groupby(['location', day], observed = True)
+    stats = [grouped[variables].mean().add_suffix('_mean')]
+    for column in extremes:
+        stats.append(grouped[column].agg(['min', 'max']).add_prefix(column + '_'))
+    for column, bases in (degree_hours or {}).items():
+        for base in bases:
+            excess = (hourly_df[column] - base).clip(lower = 0)
+            stats.append(excess.groupby([hourly_df['location'], day], observed = True).sum(min_count = 1)
+                         .rename(f"{column}_degree_hours_{base:g}F"))
+    return pd.concat(stats, axis = 1).reset_index()
+
+################################################################################
+# FEATURES
+################################################################################
+
+def features_by_rolling(full_df, windows = WINDOWS):
+    """The combiner's original features: one groupby rolling pass per feature, over rows."""
+    by_location = full_df.groupby('location', sort = False, observed = True)
+    features = pd.DataFrame(index = full_df.index)
+    for name, source, window, how in windows:
+        features[name] = by_location[source].transform(lambda s: getattr(s.rolling(window), how)())
+    return features
+
+
+
+def features_by_date_rolling(full_df, windows = WINDOWS):
+    """Features over calendar days: one rolling pass per feature on each location's dates."""
+    features = pd.DataFrame(index = full_df.index)
+    for name, source, window, how in windows:
+        parts = []
+        for _, site_df in full_df.sort_values('date').groupby('location', observed = True):
+            rolled = site_df.rolling(f"{window}D", on = 'date', min_periods = window)[source]
+            parts.append(getattr(rolled, how)().set_axis(site_df.index))
+        features[name] = pd.concat(parts)
+    return features
+
+################################################################################
+# COMBINE
+################################################################################
+
+def weather_code_category_by_map(codes):
+    """The combiner's original weather descriptions: a dictionary lookup per row."""
+    return pd.Series(codes).map(WMO_CODES)
+
+
+def relative_date_by_where(dates, today):
+    """The combiner's original relative dates as strings."""
+    return np.where(dates == today, "Current date",
+           np.where(dates > today, "Prediction",
+           np.where(dates < today, "Historical", "Unknown")))
+
+################################################################################
+# CLIMATOLOGY
+################################################################################
+
+def climatology_by_groupby(full_df, columns):
+    """Day-of-year statistics with a pandas groupby and one quantile call per percentile."""
+    grouped = full_df.assign(day_of_year = day_of_year(full_df['date'])).groupby(['location', 'day_of_year'], observed = True)[columns]
+    parts = {'mean': grouped.mean(), 'std': grouped.std()}
+    for q in PERCENTILES:
+        parts[f"p{q}"] = grouped.quantile(q / 100)
+    return pd.concat({stat: part for stat, part in parts.items()}, axis = 1)
+
+################################################################################
+# EVENTS
+################################################################################
+
+def events_by_groupby(full_df, events = EVENTS):
+    """Event dates with a pandas groupby per event, rescanning every row."""
+    full_df = full_df.assign(year = full_df['date'].dt.year, day_of_year = day_of_year(full_df['date']))
+    dates = {}
+    for event, column, comparison, threshold, which, min_days, (season_start, season_end) in events:
+        hit = full_df[column] > threshold if comparison == 'above' else full_df[column] <= threshold
+        hit &= full_df['day_of_year'].between(season_start, season_end)
+        by_year = full_df.assign(hit = hit.astype(int)).groupby(['location', 'year'], observed = True)
+        if which == 'first':
+            done = by_year['hit'].transform(lambda s: s.rolling(min_days).sum()) == min_days
+            dates[event] = full_df[done].groupby(['location', 'year'], observed = True)['date'].min() - pd.Timedelta(days = min_days - 1)
+        else:
+            dates[event] = full_df[hit].groupby(['location', 'year'], observed = True)['date'].max()
+    return pd.DataFrame(dates)
+
+################################################################################
+# QUERY
+################################################################################
+
+def select_by_filter(df, start, end, locations, columns):
+    """Rows of some locations and days, filtering the whole frame with boolean masks."""
+    rows = df[df['location'].isin(locations) & df['date'].between(start, end)]
+    return rows.sort_values(['location', 'date'])[['location', 'date'] + columns]
+
+################################################################################
+# ENSEMBLE
+################################################################################
+
+def spread_by_stacking(responses):
+    """Every member's daily statistics in one array, then reduced across members."""
+    parts = []
+    for response in responses:
+        for times, block in ensemble.decode_members(response.Hourly(), ensemble.HOURLY_VARIABLES, member_chunk = 10**6):
+            days, values = ensemble.member_days(times, block, response.UtcOffsetSeconds())
+            parts.append(values)
+    values = np.concatenate(parts).astype(np.float64)
+    daily = {'members': np.sum(~np.isnan(values), axis = 0).max(axis = 1)}
+    for j, column in enumerate(ensemble.COLUMNS):
+        daily[column] = np.nanmean(values[:, :, j], axis = 0)
+        daily[column + '_spread'] = np.nanstd(values[:, :, j], axis = 0, ddof = 1)
+        daily[column + '_low'] = np.nanmin(values[:, :, j], axis = 0)
+        daily[column + '_high'] = np.nanmax(values[:, :, j], axis = 0)
+    for name, column, how, limit in ensemble.PROBABILITIES:
+        column_values = values[:, :, ensemble.COLUMNS.index(column)]
+        hits = column_values > limit if how == 'above' else column_values <= limit
+        daily[name + '_probability'] = hits.sum(axis = 0) / np.sum(~np.isnan(column_values), axis = 0)
+    return pd.DataFrame(daily)
+
+################################################################################
+# SKILL
+################################################################################
+
+def skill_by_merge(archive_df, observed_df, columns, by_location = False):
+    """Forecast errors by lead with a merge on site and day, then a groupby."""
+    merged = archive_df.merge(observed_df[['location', 'date'] + columns], on = ['location', 'date'],
+                              suffixes = ('', '_observed'))
+    errors = pd.DataFrame({column: merged[column].astype(np.float64) - merged[column + '_observed']
+                           for column in columns})
+    keys = [merged['lead'], merged['location'].astype(str)] if by_location else [merged['lead']]
+    grouped = errors.groupby(keys)
+    skill = pd.concat({'n': grouped.count(), 'bias': grouped.mean(), 'mae': errors.abs().groupby(keys).mean(),
+                       'rmse': np.sqrt((errors ** 2).groupby(keys).mean())}, axis = 1)
+    names = ['lead', 'location', 'variable'] if by_location else ['lead', 'variable']
+    skill = skill.stack(level = 1, future_stack = True).rename_axis(names).reset_index()
+    return skill[skill['n'] > 0].reset_index(drop = True)
+
+################################################################################
+# GRID
+################################################################################
+
+def regional_by_groupby(cells, days, values, columns = grid.COLUMNS, counties = grid.COUNTIES):
+    """Regional series from one frame per cell, stacked and reduced with a weighted groupby."""
+    masks = np.concatenate([np.ones((1, len(cells)), dtype = bool), grid.county_masks(cells, counties)])
+    regions = [grid.REGION] + list(counties)
+    frames = []
+    for i, cell in enumerate(cells.itertuples()):
+        cell_df = pd.DataFrame(values[i], columns = columns)
+        cell_df.insert(0, 'date', days.astype('datetime64[D]').astype('datetime64[s]'))
+        for region in np.flatnonzero(masks[:, i]):
+            frames.append(cell_df.assign(region = regions[region], weight = cell.area_km2))
+    df = pd.concat(frames, ignore_index = True)
+    weights = df[columns].notna().mul(df['weight'], axis = 0)
+    sums = (df[columns].astype(np.float64) * weights).groupby([df['region'], df['date']]).sum()
+    totals = weights.groupby([df['region'], df['date']]).sum()
+    return (sums / totals).reset_index()
+
+################################################################################
+# VALIDATION
+################################################################################
+
+def inject_faults(df):
+    """
+    Copy of daily rows with a 2 day and a 10 day gap in one column of the
+    first site, an out-of-range value, a missing day and a repeated day at
+    the second site, and the last 5 days of the third site cut off.
+    """
+    df = df.copy()
+    names = df['location'].unique()
+    first = np.flatnonzero((df['location'] == names[0]).to_numpy())
+    df.loc[df.index[first[[100, 101]]], 'temperature_2m_mean'] = np.nan
+    df.loc[df.index[first[200:210]], 'temperature_2m_mean'] = np.nan
+    df.loc[df.index[first[300]], 'soil_moisture_0_to_7cm_mean'] = 5
+    second = np.flatnonzero((df['location'] == names[1]).to_numpy())
+    repeated = df.iloc[second[[50]]]
+    third = np.flatnonzero((df['location'] == names[2]).to_numpy())
+    dropped = np.concatenate([second[[150]], third[-5:]])
+    return pd.concat([df.drop(df.index[dropped]), repeated], ignore_index = True)
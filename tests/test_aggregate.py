@@ -0,0 +1,89 @@
+"""Hourly to daily reduction, streamed and in one batch, against a pandas groupby."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import fetch
+from sewi_weather.aggregate import DEGREE_HOUR_BASES, DailyReducer, daily_means, stat_columns
+from sewi_weather.locations import decode_locations, reduce_locations
+from sewi_weather.synthetic import UTC_OFFSET, SyntheticClient
+from tests.reference import means_by_date_objects, stats_by_groupby
+
+HOURLY = ["soil_temperature_0_to_7cm", "soil_moisture_0_to_7cm"]
+
+DAILY = ["temperature_2m_max"]
+
+PARAMS = {"latitude": [42.7261, 42.5847], "longitude": [-87.7829, -87.8212], "hourly": HOURLY, "daily": DAILY,
+          "timezone": "America/Chicago", "start_date": "2019-11-01", "end_date": "2021-02-28"}
+
+
+def streamed(params, chunk_years = 1, **options):
+    chunk_stream = fetch.iter_chunked(SyntheticClient(), "archive", params, chunk_years = chunk_years, max_workers = 2)
+    return reduce_locations(['Racine', 'Kenosha'], chunk_stream, HOURLY, DAILY, **options)
+
+
+def hourly_rows():
+    responses = SyntheticClient().weather_api("archive", PARAMS)
+    return decode_locations(['Racine', 'Kenosha'], [(r.Hourly(), r.Daily()) for r in responses], HOURLY, DAILY)[0]
+
+
+def test_days_are_local_and_match_a_groupby():
+    hourly_df = hourly_rows()
+    expected = stats_by_groupby(hourly_df, HOURLY, utc_offset = UTC_OFFSET)
+    batch = daily_means(hourly_df, HOURLY, utc_offset = UTC_OFFSET)
+    _, stream = streamed(PARAMS)
+
+    # Every local day has all 24 hours, so the first and last days are whole
+    assert len(expected) == 2 * len(pd.date_range(PARAMS['start_date'], PARAMS['end_date']))
+    for df in (batch, stream):
+        assert df['date'].iloc[0] == pd.Timestamp(PARAMS['start_date'])
+        np.testing.assert_allclose(df[expected.columns[2:]].to_numpy(), expected[expected.columns[2:]].to_numpy(), rtol = 1e-6)
+        assert np.array_equal(df['date'].to_numpy(), expected['date'].to_numpy())
+
+
+def test_append_from_local_midnight_matches_a_full_pull():
+    daily_full, means_full = streamed(PARAMS)
+    daily_tail, means_tail = streamed({**PARAMS, 'start_date': '2020-07-01'})
+    for full, tail in ((daily_full, daily_tail), (means_full, means_tail)):
+        full = full[full['date'] >= pd.Timestamp('2020-07-01')].reset_index(drop = True)
+        pd.testing.assert_frame_equal(full, tail.reset_index(drop = True))
+
+
+def test_min_max_and_degree_hours_match_a_groupby():
+    hourly_df = hourly_rows()
+    # Missing hours, and a whole local day missing at one site
+    hourly_df.loc[hourly_df.index[::13], HOURLY] = np.nan
+    hourly_df.loc[(hourly_df['location'] == 'Kenosha') & (hourly_df['date'] >= '2020-03-03 06:00')
+                  & (hourly_df['date'] < '2020-03-04 06:00'), HOURLY] = np.nan
+    options = dict(extremes = HOURLY[:1], degree_hours = DEGREE_HOUR_BASES)
+    expected = stats_by_groupby(hourly_df, HOURLY, utc_offset = UTC_OFFSET, **options)
+    columns = stat_columns(HOURLY, **options)
+    assert expected[columns].isna().all(axis = 1).sum() == 1
+
+    batch = daily_means(hourly_df, HOURLY, utc_offset = UTC_OFFSET, **options)
+    pushed = []
+    for _, site_df in hourly_df.groupby('location', observed = True, sort = False):
+        reducer = DailyReducer(HOURLY, **options)
+        # Pushed in uneven pieces, so days are split across pushes
+        for piece in np.array_split(np.arange(len(site_df)), 7):
+            piece_df = site_df.iloc[piece]
+            reducer.push(piece_df['date'].to_numpy().astype('datetime64[s]').astype(np.int64),
+                         piece_df[HOURLY].to_numpy(np.float32).T, UTC_OFFSET)
+        pushed.append(reducer.finish())
+    pushed = pd.concat(pushed, ignore_index = True)
+    for df in (batch, pushed):
+        np.testing.assert_allclose(df[columns].to_numpy(np.float64), expected[columns].to_numpy(np.float64),
+                                   rtol = 1e-5, equal_nan = True)
+
+    # And as the gatherers stream it, chunk by chunk from the API
+    _, stream = streamed(PARAMS, **options)
+    expected = stats_by_groupby(hourly_rows(), HOURLY, utc_offset = UTC_OFFSET, **options)
+    np.testing.assert_allclose(stream[columns].to_numpy(np.float64), expected[columns].to_numpy(np.float64), rtol = 1e-5)
+
+
+def test_means_match_grouping_on_date_objects():
+    hourly_df = hourly_rows()
+    expected = means_by_date_objects(hourly_df, HOURLY[:1], HOURLY[1:])
+    means = daily_means(hourly_df, HOURLY)
+    assert means['date'].dt.date.tolist() == expected['date'].tolist()
+    np.testing.assert_allclose(means[expected.columns[2:]].to_numpy(), expected[expected.columns[2:]].to_numpy(), rtol = 1e-6)
@@ -0,0 +1,80 @@
+"""Forecast snapshots in the archive, and their skill against a merge and groupby."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import archive, store
+from sewi_weather.archive import archive_forecast, forecast_skill, read_archive
+from tests.reference import skill_by_merge
+
+COLUMNS = ['temperature_2m_max', 'temperature_2m_min', 'precipitation_sum']
+
+
+def observed_days(first_day = '2024-01-01', last_day = '2024-06-30', sites = ('Racine', 'Kenosha', 'Waukesha')):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(first_day, last_day)
+    df = pd.DataFrame({'location': np.repeat(sites, len(dates)), 'date': np.tile(dates, len(sites))})
+    for column in COLUMNS:
+        df[column] = rng.normal(50, 15, len(df)).astype(np.float32)
+    return df
+
+
+def forecast(observed_df, issued, days = 10, seed = 0):
+    """A forecast issued on one day: the observed values plus noise growing with the lead."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(issued, periods = days)
+    pred_df = observed_df.set_index(['location', 'date']).reindex(
+        pd.MultiIndex.from_product([observed_df['location'].unique(), dates], names = ['location', 'date'])).reset_index()
+    lead = np.tile(np.arange(days), len(pred_df) // days)
+    for column in COLUMNS:
+        pred_df[column] = (pred_df[column] + rng.normal(0.5, 1, len(pred_df)) * (1 + lead)).astype(np.float32)
+    return pred_df
+
+
+def test_skill_matches_a_merge_and_groupby():
+    observed_df = observed_days()
+    archive_df = pd.concat([archive.snapshot(forecast(observed_df, issued, seed = i), issued, COLUMNS)
+                            for i, issued in enumerate(pd.date_range('2024-03-01', '2024-06-25'))], ignore_index = True)
+    # Missing forecast values, and days the archive has not observed yet
+    archive_df.loc[archive_df.index[::97], 'precipitation_sum'] = np.nan
+    assert archive_df['date'].max() > observed_df['date'].max()
+
+    for by_location in (False, True):
+        skill = forecast_skill(archive_df, observed_df, COLUMNS, by_location = by_location)
+        expected = skill_by_merge(archive_df, observed_df, COLUMNS, by_location = by_location)
+        keys = ['lead', 'location', 'variable'] if by_location else ['lead', 'variable']
+        skill, expected = (df.astype({key: str for key in keys[1:]}).sort_values(keys).reset_index(drop = True)
+                           for df in (skill, expected))
+        pd.testing.assert_frame_equal(skill[keys], expected[keys], check_dtype = False)
+        assert (skill['n'].to_numpy() == expected['n'].to_numpy()).all()
+        for column in ['bias', 'mae', 'rmse']:
+            np.testing.assert_allclose(skill[column], expected[column], rtol = 1e-5, err_msg = column)
+
+
+def test_snapshots_are_kept_once_and_compacted(tmp_path, monkeypatch):
+    filepath = str(tmp_path) + '/'
+    observed_df = observed_days()
+    monkeypatch.setattr(archive, 'COMPACT_FILES', 3)
+
+    first = forecast(observed_df, '2024-03-01')
+    assert archive_forecast(first, filepath, issued = '2024-03-01', variables = COLUMNS) == 30
+    assert archive_forecast(first, filepath, issued = '2024-03-01', variables = COLUMNS) == 0
+
+    # A later run of the same day replaces the earlier snapshot when read
+    later = forecast(observed_df, '2024-03-01', seed = 1)
+    archive_forecast(later, filepath, issued = '2024-03-01', variables = COLUMNS)
+    df = read_archive(filepath)
+    assert len(df) == 30
+    np.testing.assert_allclose(df.sort_values(['location', 'date'])['temperature_2m_max'],
+                               later.sort_values(['location', 'date'])['temperature_2m_max'])
+
+    for issued in pd.date_range('2024-03-02', '2024-03-04'):
+        archive_forecast(forecast(observed_df, issued), filepath, issued = issued, variables = COLUMNS)
+    # The fourth file pushed the partition past COMPACT_FILES, so it was rewritten as one; the fifth was added to it
+    folder = os.path.join(store.store_path('Forecast Archive', filepath), 'year=2024')
+    assert len(os.listdir(folder)) == 2
+    df = read_archive(filepath)
+    assert len(df) == 4 * 30 and df['issued'].nunique() == 4
+    assert (df['lead'] == (df['date'] - df['issued']).dt.days).all()
@@ -0,0 +1,67 @@
+"""Expiry and reassembly of cached archive days."""
+
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import synthetic
+from sewi_weather.cache import PROVISIONAL_DAYS, CachedClient, WeatherCache
+from sewi_weather.decode import section_times
+from sewi_weather.synthetic import SyntheticClient, synthetic_values
+
+
+def archive_params(today, days = 40):
+    return {"latitude": [42.9675], "longitude": [-88.54972222],
+            "hourly": ["soil_temperature_0_to_7cm"], "daily": ["temperature_2m_max"], "timezone": "America/Chicago",
+            "start_date": str((today - pd.Timedelta(days = days)).date()),
+            "end_date": str((today - pd.Timedelta(days = 2)).date())}
+
+
+def test_only_provisional_archive_days_expire(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    params = archive_params(pd.Timestamp.today().normalize())
+    days = len(pd.date_range(params['start_date'], params['end_date']))
+
+    first = CachedClient(SyntheticClient(), WeatherCache(path))
+    first.weather_api("archive", params)
+    first.weather_api("archive", params)
+    assert first.stats()['hits'] == days
+
+    # With the provisional days already expired, only they are fetched again
+    again = CachedClient(SyntheticClient(), WeatherCache(path, provisional_ttl = {'archive': -1}))
+    again.weather_api("archive", params)
+    assert again.stats()['requests'] == 1
+    assert 0 < again.stats()['misses'] <= PROVISIONAL_DAYS
+    assert again.stats()['hits'] == days - again.stats()['misses']
+
+
+class OffsetClient(SyntheticClient):
+    """SyntheticClient that answers with the UTC offset in offsets[0], then offsets[1], and so on."""
+
+    def __init__(self, offsets):
+        super().__init__()
+        self.offsets = list(offsets)
+
+    def weather_api(self, url, params, **kwargs):
+        with patch.object(synthetic, 'UTC_OFFSET', self.offsets[min(self.calls, len(self.offsets) - 1)]):
+            return super().weather_api(url, params, **kwargs)
+
+
+def test_days_with_another_utc_offset_are_fetched_again(tmp_path):
+    client = CachedClient(OffsetClient([-21600, -18000]), WeatherCache(str(tmp_path / 'cache.sqlite')))
+    params = {**archive_params(pd.Timestamp('2020-06-01')), 'start_date': '2020-01-01', 'end_date': '2020-03-01'}
+    client.weather_api("archive", params)
+
+    # Cached days are in CST, the days added after them come back in CDT
+    params['end_date'] = '2020-04-01'
+    response, = client.weather_api("archive", params)
+    assert response is not None and response.UtcOffsetSeconds() == -18000
+    assert client.stats()['requests'] == 3
+
+    times = section_times(response.Hourly())
+    assert len(times) == 24 * len(pd.date_range(params['start_date'], params['end_date']))
+    assert times[0] == pd.Timestamp('2020-01-01').timestamp() + 18000
+    assert np.array_equal(response.Hourly().Variables(0).ValuesAsNumpy(), synthetic_values(params['hourly'][0], times))
+    daily_times = section_times(response.Daily())
+    assert np.array_equal(response.Daily().Variables(0).ValuesAsNumpy(), synthetic_values(params['daily'][0], daily_times))
@@ -0,0 +1,66 @@
+"""Argument parsing and dispatch of the sewi-weather command."""
+
+import subprocess
+import sys
+
+import pytest
+
+from sewi_weather import cli, pipeline
+from sewi_weather.stages import COMBINE_STAGES, FETCH_STAGES
+
+# Parses and runs a status check, then lists the heavy modules it loaded
+COLD_START = """
+import sys
+from sewi_weather import cli
+cli.main(['-C', sys.argv[1], 'status'])
+print(sorted(name for name in ('pandas', 'numpy', 'pyarrow', 'openmeteo_requests') if name in sys.modules))
+"""
+
+
+@pytest.fixture
+def stages_run(monkeypatch):
+    """Records the stages each run was limited to instead of running them."""
+    calls = []
+
+    def run_stages(stages, state_path = '.pipeline_state.json', max_workers = 4, force = False, only = None):
+        calls.append({'only': only, 'max_workers': max_workers, 'force': force})
+        return [{'stage': name, 'status': 'skipped'} for name in only or [stage.name for stage in stages]]
+
+    monkeypatch.setattr(pipeline, 'run_stages', run_stages)
+    return calls
+
+
+def test_each_command_dispatches_to_its_function():
+    parser = cli.parser()
+    for argv, function in [(['run'], cli.run), (['fetch'], cli.fetch), (['combine'], cli.combine),
+                           (['status'], cli.status), (['poll'], cli.poll), (['serve'], cli.serve), (['grid'], cli.grid)]:
+        assert parser.parse_args(argv).function is function
+
+    args = parser.parse_args(['-C', 'data', 'grid', '--bounds', '42', '43', '-89', '-88', '--no-counties'])
+    assert args.folder == 'data' and args.bounds == [42, 43, -89, -88] and args.no_counties
+    with pytest.raises(SystemExit):
+        parser.parse_args([])
+
+
+def test_fetch_and_combine_run_only_their_stages(tmp_path, monkeypatch, stages_run):
+    monkeypatch.chdir(tmp_path)
+    assert cli.main(['fetch', 'ytd', 'prediction', '--force']) == 0
+    assert cli.main(['fetch']) == 0
+    assert cli.main(['combine', '--max-workers', '1']) == 0
+    assert cli.main(['run']) == 0
+    assert stages_run == [{'only': ['ytd', 'prediction'], 'max_workers': 3, 'force': True},
+                          {'only': FETCH_STAGES, 'max_workers': 3, 'force': False},
+                          {'only': COMBINE_STAGES, 'max_workers': 1, 'force': False},
+                          {'only': None, 'max_workers': 3, 'force': False}]
+
+    with pytest.raises(SystemExit, match = "Unknown stages"):
+        cli.main(['fetch', 'forecast'])
+
+
+def test_status_runs_in_the_folder_without_loading_pandas(tmp_path):
+    result = subprocess.run([sys.executable, '-c', COLD_START, str(tmp_path)], capture_output = True, text = True,
+                            env = {'PYTHONPATH': ':'.join(sys.path)})
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert any(line.split() == ['historical', 'due'] for line in lines)
+    assert lines[-1] == '[]'
@@ -0,0 +1,57 @@
+"""The climatology against a pandas groupby, and incremental updates against a full rebuild."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import climatology, store
+from sewi_weather.features import WINDOWS
+from tests.reference import climatology_by_groupby
+
+
+def write_years(filepath, first_year, last_year, seed = 0):
+    """Historical and feature rows for two sites, one year partition per year."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(f"{first_year}-01-01", f"{last_year}-12-31")
+    df = pd.DataFrame({'location': pd.Categorical(np.repeat(['Racine', 'Kenosha'], len(dates))),
+                       'date': np.tile(dates, 2)})
+    windows = [name for name, _, _, _ in WINDOWS]
+    for column in climatology.CLIMATOLOGY_COLUMNS:
+        df[column] = rng.normal(50, 10, len(df)).astype(np.float32)
+    df['year'] = df['date'].dt.year
+    store.write(df.drop(columns = windows), 'Historical', filepath, mode = 'partitions')
+    store.write(df[['location', 'date', 'year'] + windows], 'Features', filepath, mode = 'partitions')
+    return df
+
+
+def test_table_matches_a_groupby(tmp_path):
+    df = write_years(str(tmp_path) + '/', 2001, 2012)
+    # A few missing values and a missing day
+    df.loc[df.index[[3, 400, 5000]], 'temperature_2m_mean'] = np.nan
+    df = df.drop(df.index[800])
+    columns = climatology.CLIMATOLOGY_COLUMNS
+    table = climatology.build_climatology(df)
+    expected = climatology_by_groupby(df, columns)
+    assert len(table) == len(expected) == 2 * 366
+    assert table['location'].tolist() == expected.index.get_level_values('location').astype(str).tolist()
+    for stat, column in expected.columns:
+        np.testing.assert_allclose(table[f"{column}_{stat}"], expected[(stat, column)].to_numpy(np.float32), rtol = 1e-5)
+
+
+def full_table(filepath):
+    df = store.read('Historical', filepath)
+    features = store.read('Features', filepath)
+    return climatology.build_climatology(pd.merge(df, features, on = ['location', 'date']))
+
+
+def test_new_and_rewritten_years_match_a_rebuild(tmp_path):
+    filepath = str(tmp_path) + '/'
+    write_years(filepath, 2001, 2004)
+    first = climatology.update_climatology(filepath)
+    pd.testing.assert_frame_equal(first, full_table(filepath))
+
+    # A year closes, and an earlier year is written again with other values
+    write_years(filepath, 2005, 2005, seed = 1)
+    write_years(filepath, 2002, 2002, seed = 2)
+    updated = climatology.update_climatology(filepath)
+    pd.testing.assert_frame_equal(updated, full_table(filepath))
+    assert climatology.load_state(filepath + store.CLIMATOLOGY_STATE)[1].tolist() == [2001, 2002, 2003, 2004, 2005]
@@ -0,0 +1,99 @@
+"""Merging the data sets: source priority, gaps, the windows across sources and the compact schema."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather.combine import WMO_CODES, combine_sources, combined_frame, compact, find_gaps, relative_date, weather_code_category
+from sewi_weather.features import WINDOWS, rolling_features, sources
+from tests.reference import relative_date_by_where, weather_code_category_by_map
+
+NAMES = [name for name, _, _, _ in WINDOWS]
+
+
+def source_rows(first_day, last_day, value, sites = ('Racine', 'Kenosha')):
+    """Daily rows for a few sites with every measurement set to value."""
+    dates = pd.date_range(first_day, last_day)
+    df = pd.DataFrame({'location': np.repeat(sites, len(dates)), 'date': np.tile(dates, len(sites)),
+                       'weather_code': 3.0})
+    for column in sources():
+        df[column] = float(value)
+    df['month'] = df['date'].dt.month
+    df['year'] = df['date'].dt.year
+    return df
+
+
+def test_overlapping_days_come_from_the_first_source_in_priority():
+    # Handed over in the reverse order on purpose
+    df = combine_sources({'Prediction': source_rows('2024-01-14', '2024-01-20', 3),
+                          'YTD': source_rows('2024-01-08', '2024-01-15', 2),
+                          'Historical': source_rows('2024-01-01', '2024-01-10', 1)})
+
+    assert len(df) == 2 * 20
+    assert df['Data Source'].cat.categories.tolist() == ['Historical', 'YTD', 'Prediction']
+    assert df.columns.get_loc('Data Source') == len(source_rows('2024-01-01', '2024-01-01', 0).columns)
+    # Sorted by location and date, one row each
+    assert df['location'].tolist() == ['Kenosha'] * 20 + ['Racine'] * 20
+    assert (df.groupby('location')['date'].diff().dropna() == pd.Timedelta(days = 1)).all()
+
+    racine = df[df['location'] == 'Racine'].set_index('date')
+    assert (racine.loc[:'2024-01-10', 'Data Source'] == 'Historical').all()
+    assert (racine.loc['2024-01-11':'2024-01-15', 'Data Source'] == 'YTD').all()
+    assert (racine.loc['2024-01-16':, 'Data Source'] == 'Prediction').all()
+    assert (racine['temperature_2m_mean'].to_numpy() == np.repeat([1, 2, 3], [10, 5, 5])).all()
+
+
+def test_missing_days_are_listed_as_gaps():
+    df = source_rows('2024-01-01', '2024-01-31', 1)
+    df = df[~((df['location'] == 'Kenosha') & df['date'].between('2024-01-05', '2024-01-07'))]
+    df = df[~((df['location'] == 'Racine') & (df['date'] == '2024-01-20'))]
+    gaps = find_gaps(df)
+    assert gaps['location'].tolist() == ['Kenosha', 'Racine']
+    assert gaps['first_missing'].tolist() == [pd.Timestamp('2024-01-05'), pd.Timestamp('2024-01-20')]
+    assert gaps['days'].tolist() == [3, 1]
+
+
+def test_windows_roll_across_sources_as_over_one_data_set():
+    rng = np.random.default_rng(0)
+    hist_df, ytd_df, pred_df = (source_rows('2023-01-01', '2023-12-31', 0), source_rows('2023-12-20', '2024-03-10', 0),
+                                source_rows('2024-03-05', '2024-03-25', 0))
+    for df in (hist_df, ytd_df, pred_df):
+        for column in sources():
+            df[column] = rng.normal(50, 15, len(df))
+    hist_features, tail = rolling_features(hist_df)
+    hist_features = pd.concat([hist_df[['location', 'date']], hist_features], axis = 1)
+
+    df, gaps = combined_frame(hist_df, ytd_df, pred_df, hist_features, tail)
+    assert len(gaps) == 0
+    expected, _ = rolling_features(combine_sources({'Historical': hist_df, 'YTD': ytd_df, 'Prediction': pred_df}))
+    np.testing.assert_allclose(df[NAMES].to_numpy(), expected[NAMES].to_numpy(np.float32), rtol = 1e-6)
+    # The windows that reach back over the switch from historical to YTD rows are filled in
+    switch = df[df['date'] == pd.Timestamp('2024-01-05')]
+    assert (switch['Data Source'] == 'YTD').all() and switch[NAMES].notna().all().all()
+
+
+def test_compact_schema_keeps_the_values():
+    df = source_rows('2024-01-01', '2024-03-31', 0)
+    df['temperature_2m_mean'] = np.linspace(-20, 95, len(df))
+    df.loc[3, 'weather_code'] = np.nan
+    wide = df.copy()
+    compact(df)
+
+    assert isinstance(df['location'].dtype, pd.CategoricalDtype)
+    assert df['weather_code'].dtype == 'Int8' and df['weather_code'].isna().sum() == 1
+    assert df['month'].dtype == np.int8 and df['year'].dtype == np.int16
+    assert (df[sources()].dtypes == np.float32).all()
+    np.testing.assert_allclose(df['temperature_2m_mean'], wide['temperature_2m_mean'], rtol = 1e-6)
+    assert (df['location'].astype(str) == wide['location']).all()
+
+
+def test_descriptions_and_relative_dates_match_the_lookups():
+    codes = pd.Series(list(WMO_CODES) + [4, 100, np.nan], dtype = np.float32)
+    categories = weather_code_category(codes)
+    expected = weather_code_category_by_map(codes)
+    assert categories.isna().sum() == 3
+    assert (pd.Series(categories).astype(object).fillna('none') == expected.fillna('none')).all()
+
+    dates = pd.Series(pd.date_range('2024-04-01', '2024-04-30'))
+    today = pd.Timestamp('2024-04-15')
+    assert (relative_date(dates, today).astype(str) == relative_date_by_where(dates, today)).all()
+    assert relative_date(pd.Series([pd.NaT]), today)[0] == 'Unknown'
@@ -0,0 +1,57 @@
+"""Decoding response sections by the requested variable list."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import decode, fetch
+from sewi_weather.synthetic import SyntheticClient, synthetic_values
+from tests.reference import decode_by_variable
+
+VARIABLES = ["soil_temperature_0_to_7cm", "soil_temperature_7_to_28cm", "soil_moisture_0_to_7cm", "soil_moisture_7_to_28cm"]
+
+PARAMS = {
+	"latitude": 42.9675,
+	"longitude": -88.54972222,
+	"start_date": "2019-11-01",
+	"end_date": "2021-02-28",
+	"hourly": VARIABLES,
+}
+
+
+def section():
+    return SyntheticClient().weather_api("archive", params = PARAMS)[0].Hourly()
+
+
+def test_block_follows_columns_order():
+    hourly = section()
+    columns = VARIABLES[::-1]
+    times, block = decode.decode_block(hourly, VARIABLES, columns)
+    assert block.dtype == np.float32 and block.shape == (len(columns), len(times))
+    for row, column in enumerate(columns):
+        assert np.array_equal(block[row], synthetic_values(column, times)), column
+
+
+def test_frame_follows_columns_order():
+    hourly = section()
+    columns = [VARIABLES[2], VARIABLES[0]]
+    df = decode.decode_frame(hourly, VARIABLES, columns)
+    times = decode.section_times(hourly)
+    assert list(df.columns) == ['date'] + columns
+    assert len(df) == len(times)
+    for column in columns:
+        assert np.array_equal(df[column].to_numpy(), synthetic_values(column, times)), column
+
+
+def test_stitched_section_decodes_like_one_response():
+    chunk_responses = fetch.fetch_chunked(SyntheticClient(), "archive", PARAMS, chunk_years = 1, max_workers = 2)
+    columns = VARIABLES[::-1]
+    stitched_times, stitched = decode.decode_block(fetch.stitch(chunk_responses, 'Hourly'), VARIABLES, columns)
+    times, block = decode.decode_block(section(), VARIABLES, columns)
+    assert np.array_equal(stitched_times, times)
+    assert np.array_equal(stitched, block)
+
+
+def test_frame_matches_decoding_variable_by_variable():
+    hourly = section()
+    expected = decode_by_variable(hourly, VARIABLES)
+    pd.testing.assert_frame_equal(decode.decode_frame(hourly, VARIABLES), expected, check_dtype = False)
@@ -0,0 +1,46 @@
+"""Forecast soil depths mapped onto the archive's layers."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather.depths import (ARCHIVE_LAYERS, FORECAST_MOISTURE_LAYERS, FORECAST_TEMPERATURE_DEPTHS, harmonize_soil,
+                                 layer_columns, overlap_weights, point_weights)
+
+DEPTHS = list(FORECAST_TEMPERATURE_DEPTHS.values())
+
+
+def test_point_weights_average_the_interpolated_profile():
+    weights = point_weights(DEPTHS)
+    np.testing.assert_allclose(weights.sum(axis = 1), 1)
+
+    # Each layer's mean of the profile on a fine grid, for a few profiles
+    rng = np.random.default_rng(0)
+    for values in rng.normal(10, 5, (5, len(DEPTHS))):
+        expected = []
+        for top, bottom in ARCHIVE_LAYERS:
+            z = np.linspace(top, bottom, 100001)
+            expected.append(np.interp(z, DEPTHS, values).mean())
+        np.testing.assert_allclose(weights @ values, expected, rtol = 1e-4)
+
+
+def test_overlap_weights_follow_layer_thickness():
+    weights = overlap_weights(list(FORECAST_MOISTURE_LAYERS.values()))
+    np.testing.assert_allclose(weights.sum(axis = 1), 1)
+    np.testing.assert_allclose(weights[0], [1 / 7, 2 / 7, 4 / 7, 0, 0])
+    np.testing.assert_allclose(weights[1], [0, 0, 2 / 21, 18 / 21, 1 / 21])
+    # The deepest forecast layer is carried down to the bottom of the archive
+    np.testing.assert_allclose(weights[3], [0, 0, 0, 0, 1])
+
+
+def test_a_missing_depth_only_empties_the_layers_that_use_it():
+    df = pd.DataFrame({column: [5.0, 5.0] for column in FORECAST_TEMPERATURE_DEPTHS})
+    for column in FORECAST_MOISTURE_LAYERS:
+        df[column] = [0.3, 0.3]
+    df.loc[1, 'soil_temperature_54cm'] = np.nan
+    harmonize_soil(df)
+
+    temperature = df[layer_columns('soil_temperature')].to_numpy()
+    np.testing.assert_allclose(temperature[0], 5, rtol = 1e-6)
+    np.testing.assert_allclose(temperature[1, 0], 5, rtol = 1e-6)
+    assert np.isnan(temperature[1, 1:]).all()
+    np.testing.assert_allclose(df[layer_columns('soil_moisture')].to_numpy(), 0.3, rtol = 1e-6)
@@ -0,0 +1,47 @@
+"""Daily ensemble statistics from the spread reducer against stacking every member."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import ensemble
+from sewi_weather.synthetic import SyntheticClient
+from tests.reference import spread_by_stacking
+
+PARAMS = {**ensemble.PARAMS, 'latitude': 42.7261, 'longitude': -87.7829, 'forecast_days': 5}
+
+
+def reduced(responses, member_chunk = 64):
+    reducer = ensemble.SpreadReducer()
+    for response in responses:
+        for times, block in ensemble.decode_members(response.Hourly(), ensemble.HOURLY_VARIABLES, member_chunk):
+            reducer.push(*ensemble.member_days(times, block, response.UtcOffsetSeconds()))
+    return reducer.finish()
+
+
+def test_reducer_matches_stacking_every_member():
+    responses = SyntheticClient().weather_api(ensemble.ENSEMBLE_URL, PARAMS)
+    assert len(responses) == len(ensemble.MODELS)
+    expected = spread_by_stacking(responses)
+    for member_chunk in (64, 7, 1):
+        df = reduced(responses, member_chunk)
+        assert (df['members'] == sum(ensemble.MODELS.values())).all()
+        assert (df['date'].diff().dropna() == pd.Timedelta(days = 1)).all()
+        for column in expected.columns:
+            np.testing.assert_allclose(df[column], expected[column], atol = 1e-3, err_msg = column)
+
+
+def test_members_without_a_value_are_left_out():
+    reducer = ensemble.SpreadReducer()
+    values = np.full((3, 2, len(ensemble.COLUMNS)), 40, dtype = np.float32)
+    values[:, :, ensemble.COLUMNS.index('temperature_2m_min')] = [[30, 30], [34, 34], [np.nan, 30]]
+    reducer.push(np.array([0, 1], dtype = np.int32), values)
+    # A later chunk with one member and a day the first did not have
+    reducer.push(np.array([1, 2], dtype = np.int32), values[:1])
+    df = reducer.finish().set_index('date')
+
+    column = 'temperature_2m_min'
+    assert df['members'].tolist() == [3, 4, 1]
+    np.testing.assert_allclose(df[column], [32, 31, 30])
+    np.testing.assert_allclose(df[column + '_spread'], [np.std([30, 34], ddof = 1), np.std([30, 34, 30, 30], ddof = 1), np.nan])
+    np.testing.assert_allclose(df[[column + '_low', column + '_high']], [[30, 34], [30, 34], [30, 30]])
+    np.testing.assert_allclose(df['frost_probability'], [1 / 2, 3 / 4, 1])
@@ -0,0 +1,60 @@
+"""Planting threshold dates against a pandas groupby per event, and their status."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather.events import find_events, update_events
+from tests.reference import events_by_groupby
+
+
+def seasonal_sites(first_day = '2015-01-01', last_day = '2020-12-31', sites = ('Racine', 'Kenosha'), seed = 0):
+    """Air and 7 day soil temperatures with a yearly cycle and daily noise."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(first_day, last_day)
+    df = pd.DataFrame({'location': np.repeat(sites, len(dates)), 'date': np.tile(dates, len(sites))})
+    cycle = -np.cos(2 * np.pi * (df['date'].dt.dayofyear.to_numpy() - 15) / 365)
+    df['temperature_2m_min'] = 35 + 25 * cycle + rng.normal(0, 6, len(df))
+    df['soil_temperature_0_to_7cm_7dayavg'] = 48 + 25 * cycle + rng.normal(0, 3, len(df))
+    return df
+
+
+def test_dates_match_a_groupby_per_event():
+    df = seasonal_sites()
+    found = find_events(df)
+    assert (found['status'] == 'observed').all()
+
+    expected = events_by_groupby(df)
+    found = found.pivot(index = ['location', 'year'], columns = 'event', values = 'date')
+    expected = expected.reindex(found.index)[found.columns]
+    assert found.notna().all().all()
+    pd.testing.assert_frame_equal(found.astype('datetime64[ns]'), expected.astype('datetime64[ns]'), check_names = False)
+
+
+def test_events_reached_only_in_the_forecast_are_projected():
+    df = seasonal_sites('2020-01-01', '2020-05-31', sites = ('Racine',))
+    df['Data Source'] = np.where(df['date'] > pd.Timestamp('2020-05-10'), 'Prediction', 'YTD')
+    found = find_events(df).set_index('event')
+    assert found.loc['soil_above_50F', 'status'] == 'observed'
+    assert found.loc['soil_above_60F', 'status'] == 'projected'
+    assert found.loc['last_spring_frost', 'status'] == 'provisional'
+    assert found.loc['first_fall_frost', 'status'] == 'pending'
+
+
+def test_updates_for_new_and_revised_years_match_a_rebuild(tmp_path):
+    filepath = str(tmp_path) + '/'
+    df = seasonal_sites()
+    first = update_events(df, filepath)
+    assert (tmp_path / 'MKE Weather Data Events.csv').exists()
+
+    # A new year arrives and one old year is revised
+    more = pd.concat([df, seasonal_sites('2021-01-01', '2021-12-31', seed = 1)], ignore_index = True)
+    revised = (more['location'] == 'Racine') & (more['date'].dt.year == 2016)
+    more.loc[revised, 'soil_temperature_0_to_7cm_7dayavg'] += 5
+    updated = update_events(more, filepath)
+    rebuilt = find_events(more)
+    pd.testing.assert_frame_equal(updated.drop(columns = 'checksum'), rebuilt.astype({'location': str, 'year': np.int64}))
+
+    # Site-years that did not change keep their rows
+    kept = ~updated['year'].isin([2016, 2021])
+    pd.testing.assert_frame_equal(updated[kept].reset_index(drop = True),
+                                  first[first['year'] != 2016].reset_index(drop = True), check_dtype = False)
@@ -0,0 +1,71 @@
+"""Window features in one pass and continued from a saved tail, against pandas rolling passes."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+from sewi_weather.features import WINDOWS, rolling_features, sources, update_history_features
+from tests.reference import features_by_date_rolling, features_by_rolling
+
+NAMES = [name for name, _, _, _ in WINDOWS]
+
+
+def daily_sites(first_day = '2019-01-01', last_day = '2021-12-31', sites = 3, seed = 0):
+    """Daily rows of the window source columns for a few sites, with a few missing values."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(first_day, last_day)
+    df = pd.DataFrame({'location': pd.Categorical(np.repeat([f"Site {i}" for i in range(sites)], len(dates))),
+                       'date': np.tile(dates, sites)})
+    for column in sources():
+        df[column] = rng.normal(50, 15, len(df)).astype(np.float32)
+    df.loc[df.index[rng.choice(len(df), 40, replace = False)], 'temperature_2m_mean'] = np.nan
+    df['year'] = df['date'].dt.year
+    return df
+
+
+def test_one_pass_matches_a_rolling_pass_per_feature():
+    df = daily_sites()
+    features, _ = rolling_features(df)
+    np.testing.assert_allclose(features[NAMES].to_numpy(), features_by_rolling(df)[NAMES].to_numpy(), rtol = 1e-9)
+
+    # Rows in any order get the same features
+    shuffled = df.sample(frac = 1, random_state = 0)
+    pd.testing.assert_frame_equal(rolling_features(shuffled)[0].sort_index(), features)
+
+
+def test_windows_over_missing_days_match_a_rolling_pass_over_dates():
+    df = daily_sites()
+    rng = np.random.default_rng(1)
+    df = df.drop(df.index[rng.choice(len(df), 60, replace = False)])
+    features, _ = rolling_features(df)
+    expected = features_by_date_rolling(df)
+    np.testing.assert_allclose(features[NAMES].to_numpy(), expected[NAMES].to_numpy(), rtol = 1e-9)
+
+    # A missing day leaves every window that covers it empty
+    site = df[df['location'] == 'Site 0']
+    after = site['date'].diff() > pd.Timedelta(days = 1)
+    assert features.loc[site.index[after], NAMES].isna().all().all()
+
+
+def test_newest_rows_from_the_saved_tail_match_a_full_recompute():
+    df = daily_sites()
+    recent = df.groupby('location', observed = True).cumcount(ascending = False) < 300
+    full, _ = rolling_features(df)
+    _, tail = rolling_features(df[~recent])
+    newest, _ = rolling_features(df[recent], tail = tail)
+    pd.testing.assert_frame_equal(newest, full[recent])
+
+
+def test_stored_history_features_are_extended_to_match_a_rebuild(tmp_path):
+    filepath = str(tmp_path) + '/'
+    df = daily_sites()
+    store.write(df[df['year'] < 2021], 'Historical', filepath)
+    update_history_features(filepath)
+
+    # A year closes; only its rows are computed, from the saved tail
+    store.write(df[df['year'] == 2021], 'Historical', filepath, mode = 'partitions')
+    tail = update_history_features(filepath)
+    stored = store.read('Features', filepath).sort_values(['location', 'date']).reset_index(drop = True)
+    expected = rolling_features(df)[0].set_axis(stored.index)
+    np.testing.assert_allclose(stored[NAMES].to_numpy(), expected[NAMES].to_numpy(), rtol = 1e-6)
+    assert (tail.groupby('location', observed = True)['date'].max() == pd.Timestamp('2021-12-31')).all()
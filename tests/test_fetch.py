@@ -0,0 +1,90 @@
+"""Chunked fetching and stitching against the local stand-in for the API."""
+
+import threading
+
+import numpy as np
+
+from sewi_weather import fetch, profile
+from sewi_weather.decode import section_times
+from sewi_weather.synthetic import SyntheticClient
+
+PARAMS = {
+	"latitude": 42.9675,
+	"longitude": -88.54972222,
+	"start_date": "1995-06-01",
+	"end_date": "2024-03-31",
+	"hourly": ["soil_temperature_0_to_7cm", "soil_moisture_0_to_7cm"],
+	"daily": ["temperature_2m_max", "precipitation_sum"],
+}
+
+
+class RecordingClient(SyntheticClient):
+    """SyntheticClient that records the date range of every call and whether it failed."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = []
+        self._record_lock = threading.Lock()
+
+    def weather_api(self, url, params, **kwargs):
+        chunk = (params['start_date'], params['end_date'])
+        try:
+            responses = super().weather_api(url, params, **kwargs)
+        except Exception:
+            with self._record_lock:
+                self.requests.append((chunk, False))
+            raise
+        with self._record_lock:
+            self.requests.append((chunk, True))
+        return responses
+
+
+def test_stitched_matches_single_request():
+    single = SyntheticClient().weather_api("archive", params = PARAMS)[0]
+    chunk_responses = fetch.fetch_chunked(SyntheticClient(), "archive", PARAMS, chunk_years = 10, max_workers = 4)
+    assert len(chunk_responses) == 4
+
+    for section in ('Hourly', 'Daily'):
+        expected = getattr(single, section)()
+        stitched = fetch.stitch(chunk_responses, section)
+        assert np.array_equal(section_times(stitched), section_times(expected))
+        for j in range(len(PARAMS[section.lower()])):
+            assert np.array_equal(stitched.Variables(j).ValuesAsNumpy(), expected.Variables(j).ValuesAsNumpy())
+
+
+def test_chunks_come_back_in_date_order():
+    chunks = fetch.date_chunks(PARAMS['start_date'], PARAMS['end_date'], 1)
+    fetched = [chunk for chunk, _ in fetch.iter_chunked(SyntheticClient(), "archive", PARAMS, chunk_years = 1, max_workers = 8)]
+    assert fetched == chunks
+    assert chunks[0][0] == PARAMS['start_date'] and chunks[-1][1] == PARAMS['end_date']
+
+    # Each chunk's responses start where the previous chunk ended
+    chunk_responses = fetch.fetch_chunked(SyntheticClient(), "archive", PARAMS, chunk_years = 1, max_workers = 8)
+    starts = [responses[0].Daily().Time() for responses in chunk_responses]
+    assert starts == sorted(starts)
+    fetch.stitch(chunk_responses, 'Daily')
+
+
+def test_only_failed_chunks_are_requested_again():
+    client = RecordingClient(fail_first = 2)
+    chunk_responses = fetch.fetch_chunked(client, "archive", PARAMS, chunk_years = 10, max_workers = 4, backoff_factor = 0)
+    chunks = fetch.date_chunks(PARAMS['start_date'], PARAMS['end_date'], 10)
+
+    assert client.calls == len(chunks) + 2
+    succeeded = [chunk for chunk, ok in client.requests if ok]
+    failed = [chunk for chunk, ok in client.requests if not ok]
+    assert sorted(succeeded) == sorted(chunks)
+    assert len(failed) == 2
+    # A chunk is only requested again after it failed
+    for chunk in chunks:
+        assert [c for c, _ in client.requests].count(chunk) == 1 + failed.count(chunk)
+    assert len(chunk_responses) == len(chunks)
+
+
+def test_retries_are_only_printed_in_debug_mode(capsys, monkeypatch):
+    fetch.fetch_chunked(SyntheticClient(fail_first = 1), "archive", PARAMS, backoff_factor = 0)
+    assert capsys.readouterr().out == ''
+
+    monkeypatch.setattr(profile, 'DEBUG', True)
+    fetch.fetch_chunked(SyntheticClient(fail_first = 1), "archive", PARAMS, backoff_factor = 0)
+    assert capsys.readouterr().out.startswith("Retrying chunk")
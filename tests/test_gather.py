@@ -0,0 +1,40 @@
+"""The gatherers against the local stand-in for the API."""
+
+from datetime import date
+
+import openmeteo_requests
+import pytest
+
+from sewi_weather import cache, gather, observed, store
+from sewi_weather.synthetic import SyntheticClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A SyntheticClient in place of the open-meteo client, as shared_client() would create it."""
+    client = SyntheticClient()
+    monkeypatch.setattr(openmeteo_requests, 'Client', lambda session = None: client)
+    monkeypatch.setattr(cache, '_shared', {})
+    return client
+
+
+def write_locations(filepath):
+    with open(filepath + 'locations.csv', 'w') as f:
+        f.write("name,latitude,longitude\nRacine,42.7261,-87.7829\nKenosha,42.5847,-87.8212\n")
+
+
+def test_ytd_skips_the_first_days_of_january(tmp_path, monkeypatch, client):
+    filepath = str(tmp_path) + '/'
+    write_locations(filepath)
+    monkeypatch.setattr(observed, 'last_archive_day', lambda today = None: date(date.today().year - 1, 12, 29))
+    assert gather.ytd(filepath) is None
+    assert client.calls == 0 and not store.exists('YTD', filepath)
+
+
+def test_ytd_saves_one_row_per_site_and_day(tmp_path, monkeypatch, client):
+    filepath = str(tmp_path) + '/'
+    write_locations(filepath)
+    monkeypatch.setattr(observed, 'last_archive_day', lambda today = None: date(date.today().year, 1, 1))
+    df = gather.ytd(filepath)
+    assert len(df) == 2 and client.calls == 1
+    assert len(store.read('YTD', filepath)) == 2
@@ -0,0 +1,45 @@
+"""The regional grid: fetching the cells and the area-weighted regional series."""
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import grid
+from sewi_weather.synthetic import SyntheticClient
+from tests.reference import regional_by_groupby
+
+PARAMS = {**grid.PARAMS, 'start_date': '2025-03-01', 'end_date': '2025-03-10'}
+
+
+def test_regional_series_weigh_cells_by_area_and_skip_missing_values():
+    cells = grid.grid_cells(resolution = 0.2)
+    rng = np.random.default_rng(0)
+    days = np.arange(20000, 20010, dtype = np.int32)
+    values = rng.normal(40, 10, (len(cells), len(days), len(grid.COLUMNS))).astype(np.float32)
+    # Cells without data, scattered values missing and one day no cell of a county has
+    values[[0, 5]] = np.nan
+    values[rng.random(values.shape) < 0.05] = np.nan
+    milwaukee = grid.county_masks(cells)[list(grid.COUNTIES).index('Milwaukee')]
+    values[milwaukee, 3] = np.nan
+
+    df = grid.regional_series(cells, days, values)
+    assert df['region'].cat.categories.tolist() == [grid.REGION] + list(grid.COUNTIES)
+    assert (df.loc[df['region'] == grid.REGION, 'cells'] == len(cells)).all()
+    expected = regional_by_groupby(cells, days, values)
+    df = df.set_index(['region', 'date']).loc[pd.MultiIndex.from_frame(expected[['region', 'date']])]
+    np.testing.assert_allclose(df[grid.COLUMNS].to_numpy(), expected[grid.COLUMNS].to_numpy(), rtol = 1e-5)
+
+    day = pd.Timestamp(days[3].astype('datetime64[D]'))
+    assert df.loc[('Milwaukee', day), grid.COLUMNS].isna().all()
+    assert df.loc[(grid.REGION, day), grid.COLUMNS].notna().all()
+
+
+def test_every_cell_is_filled_whatever_the_batches():
+    cells = grid.grid_cells(bounds = (42.5, 43.0, -88.5, -88.0), resolution = 0.1)
+    days, values = grid.fetch_grid(SyntheticClient(), cells, PARAMS, batch_size = 50, max_workers = 1)
+    assert values.shape == (len(cells), 10, len(grid.COLUMNS))
+    assert days[0].astype('datetime64[D]') == np.datetime64('2025-03-01')
+    assert not np.isnan(values).any()
+
+    batched_days, batched = grid.fetch_grid(SyntheticClient(), cells, PARAMS, batch_size = 7, max_workers = 4)
+    assert np.array_equal(batched_days, days)
+    np.testing.assert_array_equal(batched, values)
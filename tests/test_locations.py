@@ -0,0 +1,65 @@
+"""The location registry, batched requests and decoding every site in order."""
+
+import pandas as pd
+import pytest
+
+from sewi_weather import observed
+from sewi_weather.gather import fetch_sections
+from sewi_weather.locations import batch_params, batches, decode_locations, load_locations
+from sewi_weather.synthetic import UTC_OFFSET, SyntheticClient
+
+LOCATIONS = pd.DataFrame({'name': [f"{i:02d}" for i in range(7)],
+                          'latitude': [42.5 + 0.1 * i for i in range(7)], 'longitude': -88.0})
+
+
+class RecordingClient(SyntheticClient):
+    """The stand-in API, keeping the latitudes of every request."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def weather_api(self, url, params, **kwargs):
+        self.requests.append(params['latitude'])
+        return super().weather_api(url, params, **kwargs)
+
+
+def test_registry_is_read_as_written(tmp_path):
+    LOCATIONS.to_csv(tmp_path / 'locations.csv', index = False)
+    pd.testing.assert_frame_equal(load_locations(str(tmp_path) + '/'), LOCATIONS)
+
+    pd.concat([LOCATIONS, LOCATIONS.iloc[[2]]]).to_csv(tmp_path / 'locations.csv', index = False)
+    with pytest.raises(ValueError, match = "Duplicate location names"):
+        load_locations(str(tmp_path) + '/')
+
+
+def test_batches_cover_every_site_once_in_order():
+    parts = batches(LOCATIONS, batch_size = 3)
+    assert [len(part) for part in parts] == [3, 3, 1]
+    pd.testing.assert_frame_equal(pd.concat(parts), LOCATIONS)
+    params = batch_params({'daily': ['temperature_2m_max']}, parts[1])
+    assert params == {'daily': ['temperature_2m_max'], 'latitude': [42.8, 42.9, 43.0], 'longitude': [-88.0] * 3}
+
+    client = RecordingClient()
+    params = {**observed.PARAMS, 'start_date': '2024-01-01', 'end_date': '2024-01-02'}
+    names, sections, utc_offset = fetch_sections(client, observed.URL, params, LOCATIONS, batch_size = 3)
+    assert names == LOCATIONS['name'].tolist() and len(sections) == 7
+    assert sum(client.requests, []) == LOCATIONS['latitude'].tolist() and len(client.requests) == 3
+    assert utc_offset == UTC_OFFSET
+
+
+def test_decoded_sites_keep_the_order_given():
+    # Each site gets another date range, so its rows show which section they came from
+    hourly, daily = ['soil_temperature_0_to_7cm'], ['temperature_2m_max']
+    sections = []
+    for days in (3, 1, 5, 2):
+        params = {'latitude': 42.7, 'longitude': -87.8, 'hourly': hourly, 'daily': daily,
+                  'start_date': '2024-01-01', 'end_date': str(pd.Timestamp('2024-01-01') + pd.Timedelta(days = days - 1))[:10]}
+        response = SyntheticClient().weather_api(observed.URL, params)[0]
+        sections.append((response.Hourly(), response.Daily()))
+    names = ['Racine', 'Kenosha', 'Waukesha', 'Milwaukee']
+    hourly_df, daily_df = decode_locations(names, sections, hourly, daily, max_workers = 4)
+
+    assert hourly_df['location'].cat.categories.tolist() == names
+    assert daily_df['location'].tolist() == [name for name, days in zip(names, (3, 1, 5, 2)) for _ in range(days)]
+    assert hourly_df['location'].tolist() == [name for name, days in zip(names, (3, 1, 5, 2)) for _ in range(24 * days)]
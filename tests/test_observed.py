@@ -0,0 +1,12 @@
+"""The archive's date window."""
+
+from datetime import date
+
+from sewi_weather.observed import last_archive_day, last_history_day
+
+
+def test_history_stops_where_the_archive_has_caught_up():
+    assert last_archive_day(date(2025, 3, 10)) == date(2025, 3, 7)
+    # Early in January the last days of the year are not in the archive yet
+    assert [last_history_day(date(2025, 1, day)) for day in (1, 2, 3, 4, 20)] == \
+        [date(2024, 12, 29), date(2024, 12, 30), date(2024, 12, 31), date(2024, 12, 31), date(2024, 12, 31)]
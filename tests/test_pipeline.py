@@ -0,0 +1,35 @@
+"""The pipeline lock shared by pipeline runs and the forecast poller."""
+
+import subprocess
+import sys
+import time
+
+from sewi_weather.pipeline import LOCK_FILE, Stage, pipeline_lock, run_stages
+
+HOLD = """
+import sys, time
+from sewi_weather.pipeline import pipeline_lock
+with pipeline_lock(sys.argv[1]):
+    print('held', flush = True)
+    time.sleep(1)
+"""
+
+
+def test_lock_waits_for_another_process(tmp_path):
+    path = str(tmp_path / LOCK_FILE)
+    holder = subprocess.Popen([sys.executable, '-c', HOLD, path], stdout = subprocess.PIPE, text = True,
+                              env = {'PYTHONPATH': ':'.join(sys.path)})
+    assert holder.stdout.readline().strip() == 'held'
+    start = time.perf_counter()
+    with pipeline_lock(path):
+        waited = time.perf_counter() - start
+    holder.wait()
+    assert waited > 0.5
+
+
+def test_stages_run_under_the_lock(tmp_path):
+    state_path = str(tmp_path / '.pipeline_state.json')
+    ran = []
+    report = run_stages([Stage('one', lambda: ran.append(1))], state_path)
+    assert [row['status'] for row in report] == ['ran'] and ran == [1]
+    assert (tmp_path / LOCK_FILE).exists()
@@ -0,0 +1,98 @@
+"""The query API over the combined data set."""
+
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sewi_weather import store
+from sewi_weather.query import WeatherQuery, make_server
+from tests.reference import select_by_filter
+
+
+def write_combined(filepath):
+    dates = pd.date_range('2024-04-01', '2024-04-10')
+    df = pd.DataFrame({'location': np.repeat(['Racine', 'Kenosha'], len(dates)), 'date': np.tile(dates, 2),
+                       'temperature_2m_mean': np.arange(2 * len(dates), dtype = np.float32)})
+    df['year'] = df['date'].dt.year
+    store.write(df, 'Combined', filepath)
+
+
+@pytest.fixture
+def server(tmp_path):
+    query = WeatherQuery(str(tmp_path) + '/', check_every = 0)
+    server = make_server(query, port = 0)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read().decode()
+
+
+def test_no_combined_data_yet_is_a_503(server):
+    for path in ('/weather?days=3', '/info'):
+        status, body = get(server, path)
+        assert status == 503 and body.startswith("No combined data")
+
+    write_combined(server.query.filepath)
+    status, body = get(server, '/weather?start=2024-04-09&location=Racine')
+    assert status == 200
+    assert body.splitlines() == ['location,date,temperature_2m_mean,year', 'Racine,2024-04-09,8.0,2024',
+                                 'Racine,2024-04-10,9.0,2024']
+    assert get(server, '/info')[0] == 200
+
+
+def test_bad_requests_are_a_400(server):
+    write_combined(server.query.filepath)
+    assert get(server, '/weather?location=Madison')[0] == 400
+    assert get(server, '/weather?days=x')[0] == 400
+    assert get(server, '/nowhere')[0] == 404
+
+
+def test_select_matches_filtering_the_frame(tmp_path):
+    filepath = str(tmp_path) + '/'
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2023-01-01', '2024-12-31')
+    sites = ['Racine', 'Kenosha', 'Waukesha']
+    df = pd.DataFrame({'location': np.repeat(sites, len(dates)), 'date': np.tile(dates, len(sites)),
+                       'temperature_2m_mean': rng.normal(50, 15, len(sites) * len(dates)).astype(np.float32),
+                       'precipitation_sum': rng.gamma(1, 2, len(sites) * len(dates)).astype(np.float32)})
+    df['year'] = df['date'].dt.year
+    store.write(df.sample(frac = 1, random_state = 0), 'Combined', filepath)
+    query = WeatherQuery(filepath)
+
+    for start, end, locations, columns in [('2024-12-02', '2024-12-31', ['Racine'], ['precipitation_sum']),
+                                           ('2023-12-25', '2024-01-05', ['Waukesha', 'Kenosha'], ['temperature_2m_mean']),
+                                           ('2022-06-01', '2023-01-03', sites, ['temperature_2m_mean', 'precipitation_sum'])]:
+        selected = query.select(start = start, end = end, locations = locations, columns = columns)
+        expected = select_by_filter(df, start, end, locations, columns).reset_index(drop = True)
+        # The index keeps locations in the order asked for
+        expected = expected.set_index('location').loc[locations].reset_index()
+        pd.testing.assert_frame_equal(selected.astype({'location': str, 'date': expected['date'].dtype}), expected)
+
+
+def test_a_matching_etag_is_a_304_until_the_data_changes(tmp_path):
+    filepath = str(tmp_path) + '/'
+    write_combined(filepath)
+    query = WeatherQuery(filepath, check_every = 0)
+    params = {'start': ['2024-04-01'], 'location': ['Racine']}
+    status, headers, body = query.respond(params)
+    assert status == 200 and len(body.decode().splitlines()) == 11
+    assert query.respond(params, headers['ETag'])[0] == 304
+
+    # The pipeline saves the data again
+    write_combined(filepath)
+    status, changed, _ = query.respond(params, headers['ETag'])
+    assert status == 200 and changed['ETag'] != headers['ETag']
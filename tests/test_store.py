@@ -0,0 +1,85 @@
+"""The year-partitioned store: round trips, watermarks, appends and rewriting years."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from sewi_weather import store
+
+
+def daily_rows(first_day, last_day, sites = ('Racine', 'Kenosha'), seed = 0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(first_day, last_day)
+    df = pd.DataFrame({'location': pd.Categorical(np.repeat(sites, len(dates))), 'date': np.tile(dates, len(sites)),
+                       'temperature_2m_mean': rng.normal(50, 15, len(sites) * len(dates)).astype(np.float32),
+                       'weather_code': pd.array(rng.integers(0, 4, len(sites) * len(dates)), dtype = 'Int8')})
+    df['year'] = df['date'].dt.year
+    return df
+
+
+def files(name, filepath):
+    return sorted(os.path.relpath(os.path.join(root, file), store.store_path(name, filepath))
+                  for root, _, names in os.walk(store.store_path(name, filepath)) for file in names)
+
+
+def test_round_trip_keeps_rows_and_types(tmp_path):
+    filepath = str(tmp_path) + '/'
+    df = daily_rows('2022-11-01', '2024-02-29')
+    store.write(df, 'Historical', filepath)
+    assert store.exists('Historical', filepath)
+    assert [path.split(os.sep)[0] for path in files('Historical', filepath)] == ['year=2022', 'year=2023', 'year=2024']
+
+    read = store.read('Historical', filepath)
+    assert read['date'].is_monotonic_increasing
+    read = read.sort_values(['location', 'date'], ignore_index = True)
+    expected = df.sort_values(['location', 'date'], ignore_index = True)
+    pd.testing.assert_frame_equal(read, expected, check_dtype = False, check_categorical = False)
+    assert isinstance(read['location'].dtype, pd.CategoricalDtype)
+    assert read['temperature_2m_mean'].dtype == np.float32 and read['weather_code'].dtype == 'Int8'
+
+    # Only the columns and years asked for
+    some = store.read('Historical', filepath, columns = ['temperature_2m_mean'], years = [2023])
+    assert some.columns.tolist() == ['date', 'temperature_2m_mean'] and len(some) == 2 * 365
+
+
+def test_hourly_rows_round_trip_as_arrow_files(tmp_path):
+    filepath = str(tmp_path) + '/'
+    dates = pd.date_range('2023-12-31', '2024-01-02 23:00', freq = 'h')
+    df = pd.DataFrame({'date': dates, 'soil_temperature_0_to_7cm': np.arange(len(dates), dtype = np.float32)})
+    df['year'] = df['date'].dt.year
+    store.write(df, 'Hourly', filepath, format = 'ipc')
+    assert all(path.endswith('.arrow') for path in files('Hourly', filepath))
+    read = store.read('Hourly', filepath)
+    assert (read['date'].to_numpy() == dates.to_numpy()).all()
+    np.testing.assert_array_equal(read['soil_temperature_0_to_7cm'], df['soil_temperature_0_to_7cm'])
+
+
+def test_watermarks_follow_appends(tmp_path):
+    filepath = str(tmp_path) + '/'
+    assert len(store.watermarks('Historical', filepath)) == 0
+    store.write(daily_rows('2023-01-01', '2023-06-30'), 'Historical', filepath)
+    store.write(daily_rows('2023-07-01', '2023-08-15', sites = ('Racine',)), 'Historical', filepath, mode = 'append')
+    marks = store.watermarks('Historical', filepath)
+    assert marks.to_dict() == {'Kenosha': pd.Timestamp('2023-06-30'), 'Racine': pd.Timestamp('2023-08-15')}
+    assert len(files('Historical', filepath)) == 2
+
+
+def test_rewriting_a_year_compacts_it_and_leaves_the_others(tmp_path):
+    filepath = str(tmp_path) + '/'
+    store.write(daily_rows('2022-01-01', '2022-12-31'), 'Historical', filepath)
+    for month in range(1, 13):
+        start = pd.Timestamp(2023, month, 1)
+        store.write(daily_rows(start, start + pd.offsets.MonthEnd(0), seed = month), 'Historical', filepath, mode = 'append')
+    assert len(files('Historical', filepath)) == 13
+    versions = store.year_versions('Historical', filepath)
+    version = store.version('Historical', filepath)
+
+    year = store.read('Historical', filepath, years = [2023])
+    store.write(year, 'Historical', filepath, mode = 'partitions')
+    assert [path.split(os.sep)[0] for path in files('Historical', filepath)] == ['year=2022', 'year=2023']
+    pd.testing.assert_frame_equal(store.read('Historical', filepath, years = [2023]), year)
+
+    assert store.version('Historical', filepath) != version
+    rewritten = store.year_versions('Historical', filepath)
+    assert rewritten[2022] == versions[2022] and rewritten[2023] != versions[2023]
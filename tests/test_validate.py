@@ -0,0 +1,72 @@
+"""Validation of the fetched data sets: the checks, gap filling and refetching."""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sewi_weather import observed, store, validate
+from sewi_weather.locations import batch_params
+from sewi_weather.synthetic import SyntheticClient
+from tests.reference import inject_faults
+
+LOCATIONS = pd.DataFrame({'name': ['Racine', 'Kenosha', 'Waukesha'], 'latitude': [42.7261, 42.5847, 43.0117],
+                          'longitude': [-87.7829, -87.8212, -88.2315]})
+
+
+@pytest.fixture(scope = 'module')
+def fetched():
+    """A year of archive rows for every site, as the YTD gatherer saves them."""
+    params = {**observed.PARAMS, 'start_date': '2025-01-01', 'end_date': '2025-12-31'}
+    responses = SyntheticClient().weather_api(observed.URL, params = batch_params(params, LOCATIONS))
+    return observed.daily_rows(LOCATIONS['name'], responses)
+
+
+def test_fill_gaps_interpolates_short_runs_inside_a_site():
+    values = np.array([[1, np.nan, np.nan, 4, np.nan, np.nan, np.nan, np.nan, 9, np.nan],
+                       [np.nan, 2, 2, np.nan, 6, 6, 6, 6, 6, 6]], dtype = np.float32)
+    filled = validate.fill_gaps(values, max_days = 3)
+    np.testing.assert_allclose(values, [[1, 2, 3, 4, np.nan, np.nan, np.nan, np.nan, 9, np.nan],
+                                        [np.nan, 2, 2, 4, 6, 6, 6, 6, 6, 6]])
+    assert filled.sum() == 3
+
+
+def test_check_finds_every_injected_fault(fetched):
+    end = fetched['date'].max()
+    clean_df, quality, gaps = validate.check(inject_faults(fetched), end = end)
+    counts = validate.summarize(quality)
+
+    assert len(clean_df) == len(fetched)
+    assert counts['duplicate'] == len(clean_df.columns) - len(validate.KEY_COLUMNS)
+    assert counts['out_of_range'] == 1
+    # The 2 day gap, the out-of-range value and the missing day are filled;
+    # the 10 day gap and the cut-off days are left as gaps
+    assert gaps['location'].astype(str).tolist() == ['Racine', 'Waukesha']
+    assert (gaps['end'] - gaps['start']).dt.days.tolist() == [9, 4]
+    filled = clean_df.set_index(['location', 'date'])
+    original = fetched.set_index(['location', 'date'])
+    day = original.index[100]
+    assert abs(filled.loc[day, 'temperature_2m_mean'] - original.loc[day, 'temperature_2m_mean']) < 10
+    assert filled['temperature_2m_mean'].isna().sum() == 10 + 5
+
+    # Clean rows pass without a flag
+    clean_df, quality, gaps = validate.check(fetched, end = end)
+    assert len(quality) == 0 and len(gaps) == 0
+
+
+def test_missing_archive_days_are_fetched_again(fetched, tmp_path):
+    filepath = str(tmp_path) + '/'
+    LOCATIONS.to_csv(filepath + 'locations.csv', index = False)
+    store.write(inject_faults(fetched), 'YTD', filepath)
+
+    counts = validate.validate_data_set('YTD', filepath, client = SyntheticClient(), today = date(2026, 1, 3))
+    assert counts['refetched'] > 0 and counts['out_of_range'] == 1
+    df = store.read('YTD', filepath)
+    assert len(df) == len(fetched)
+    # Short gaps are filled, long ones fetched again; weather codes are never interpolated
+    assert df.drop(columns = ['weather_code', 'month', 'year']).notna().all().all()
+    assert df['weather_code'].isna().sum() == 1
+    quality = store.read('YTD Quality', filepath)
+    refetched = quality[(quality.drop(columns = ['location', 'date', 'year']) & validate.REFETCHED).any(axis = 1)]
+    assert sorted(refetched['location'].astype(str).unique()) == ['Racine', 'Waukesha']